@@ -0,0 +1,102 @@
+"""Weekly hospitalizations by age class and their shares, precomputed per department.
+
+The age groups page used to roll up the SurSaUD cube, take the 7-day
+averages of each age class and normalize them by date on every move of its
+date range slider. ``AgeShares`` does it once per version of the cube, for
+France or one department, as (day x age class) arrays over the days
+reported: a date range is then two ``searchsorted`` calls, and the total of
+each age class over it the difference of two prefix sums.
+"""
+import numpy as np
+import pandas as pd
+
+from cube import cube_meta_path, load_cube
+from datastore import SURSAUD_2020
+from dimensions import AGE_LABELS, canonical_department
+from instrument import instrumented
+from registry import datasets, freeze
+from timeseries import to_datetime64
+
+MEASURE = "nbre_hospit_corona"
+WINDOW = 7
+ALL_AGES = "0"
+
+
+class AgeShares:
+    """Daily counts, weekly averages and shares of ``MEASURE`` by age class.
+
+    ``dates`` are the days the department (or France, ``dep=None``) reported
+    on and ``ages`` the age classes of the cube, all ages included. The
+    weekly average is the mean of the last ``WINDOW`` reported days, NaN for
+    the first ones; the share of a class is in percent of all ages.
+    """
+
+    def __init__(self, cube, dep=None):
+        self.dates, block = cube.rollup([MEASURE], dep, by_age=True)
+        self.ages = list(cube.ages)
+        counts = block[0]
+        self._prefix = np.zeros((len(counts) + 1, len(self.ages)))
+        np.cumsum(counts, axis=0, out=self._prefix[1:])
+        self.weekly = np.full(counts.shape, np.nan)
+        self.weekly[WINDOW - 1:] = (self._prefix[WINDOW:] - self._prefix[:-WINDOW]) / WINDOW
+        # The classes and "all ages" together count every visit twice
+        with np.errstate(invalid="ignore", divide="ignore"):
+            self.shares = 2 * 100 * self.weekly / np.nansum(self.weekly, axis=1, keepdims=True)
+
+    @property
+    def nbytes(self):
+        return self.dates.nbytes + self._prefix.nbytes + self.weekly.nbytes + self.shares.nbytes
+
+    def freeze(self):
+        for array in (self.dates, self._prefix, self.weekly, self.shares):
+            freeze(array)
+
+    def bounds(self, start=None, end=None):
+        """Row positions of the days in ``[start, end)``."""
+        lo = 0 if start is None else np.searchsorted(self.dates, to_datetime64(start, "D"))
+        hi = len(self.dates) if end is None else np.searchsorted(self.dates, to_datetime64(end, "D"))
+        return lo, max(lo, hi)
+
+    def totals(self, start=None, end=None):
+        """``MEASURE`` summed over the days in ``[start, end)``, by age class."""
+        lo, hi = self.bounds(start, end)
+        return pd.Series(self._prefix[hi] - self._prefix[lo], index=self.ages)
+
+    def window_shares(self, start=None, end=None):
+        """Share in percent of each age class (but all ages) of ``MEASURE`` over ``[start, end)``."""
+        totals = self.totals(start, end)
+        ages = [age for age in self.ages if age != ALL_AGES]
+        with np.errstate(invalid="ignore", divide="ignore"):
+            shares = 100 * totals[ages] / totals[ALL_AGES]
+        return shares.rename(AGE_LABELS)
+
+    def frame(self, start=None, end=None, date_column="date_de_passage", age_column="sursaud_cl_age_corona"):
+        """The rows of the days in ``[start, end)``, one per (day, age class), all ages left out."""
+        lo, hi = self.bounds(start, end)
+        columns = [i for i, age in enumerate(self.ages) if age != ALL_AGES]
+        labels = [AGE_LABELS[self.ages[i]] for i in columns]
+        return pd.DataFrame({
+            date_column: np.repeat(self.dates[lo:hi].astype("datetime64[ns]"), len(columns)),
+            age_column: pd.Categorical.from_codes(np.tile(np.arange(len(columns)), hi - lo), categories=labels),
+            f"{MEASURE}_weekly_avg": self.weekly[lo:hi, columns].reshape(-1),
+            f"{MEASURE}_normalized": self.shares[lo:hi, columns].reshape(-1),
+        })
+
+
+def _read_age_shares(path, dep):
+    return AgeShares(load_cube(SURSAUD_2020), dep)
+
+
+@instrumented("load")
+def load_age_shares(dep="France"):
+    """The ``AgeShares`` of a department, or of France, computed once per cube version."""
+    dep = None if dep == "France" else canonical_department(dep)
+    # Rebuilds a stale cube before its version is read
+    load_cube(SURSAUD_2020)
+    return datasets.get(cube_meta_path(SURSAUD_2020), _read_age_shares, dep)
+
+
+def age_departments():
+    """Canonical codes of the departments with age class data."""
+    cube = load_cube(SURSAUD_2020)
+    return cube.deps[cube.present.any(axis=1)]
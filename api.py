@@ -0,0 +1,242 @@
+"""Local HTTP API serving the numbers behind the dashboard.
+
+Other tools can query the datasets the pages chart instead of scraping them.
+Every endpoint answers ``GET`` with JSON records, or with an Arrow IPC stream
+for ``?format=arrow`` (or ``Accept: application/vnd.apache.arrow.stream``):
+
+* ``/api/epidemic?start=&end=``: daily national cases and tests, with
+  their 7-day averages, positive rate (Tp7) and incidence (Ti7);
+* ``/api/epidemic/week?date=``: the weekly figures of the Overview page;
+* ``/api/saturation?department=&start=&end=``: the health system
+  saturation series of a department (France by default);
+* ``/api/saturation/departments``: the departments of the saturation series;
+* ``/api/departments/<dep>/timeseries?start=&end=``: the daily SurSaUD
+  Covid visits of a department (or ``France``).
+
+``/metrics`` exports the stage metrics of ``instrument.py`` for Prometheus.
+
+``start`` and ``end`` are both included. Responses carry an ETag derived from
+the versions of their source files, so conditional requests are answered with
+304 without touching the data, and are gzip-compressed for clients that
+accept it. The datasets come from the process-wide registry
+(``registry.py``): started from the Streamlit app (``COVID_TRACKER_API_PORT``),
+the API answers from the very frames the pages use. It also runs on its own::
+
+    python api.py [--port 8502]
+"""
+import argparse
+import asyncio
+import hashlib
+import io
+import os
+import threading
+from collections import OrderedDict
+
+import pandas as pd
+import tornado.web
+
+from cube import cube_meta_path
+from datastore import SURSAUD, raw_path
+from dimensions import canonical_department
+from instrument import metrics
+from registry import data_version
+from timeseries import TimeSeries
+from utils import (EPIDEMIC_STATE_PATH, SATURATION_PATH, department_series, load_epidemic_series,
+                   load_saturation_series, weekly_indicators)
+
+DEFAULT_PORT = 8502
+ARROW_STREAM = "application/vnd.apache.arrow.stream"
+# Encoded responses kept by ETag: a repeated query is not encoded again
+MAX_CACHED_BODIES = 256
+
+
+class GZipContentEncoding(tornado.web.GZipContentEncoding):
+    """Compresses the Arrow streams too."""
+
+    CONTENT_TYPES = tornado.web.GZipContentEncoding.CONTENT_TYPES | {ARROW_STREAM}
+
+
+def to_json(df):
+    """JSON records of ``df``, with the dates as YYYY-MM-DD and NaN as null."""
+    df = df.assign(**{name: df[name].dt.strftime("%Y-%m-%d") for name in df.columns
+                      if pd.api.types.is_datetime64_any_dtype(df[name])})
+    return '{"data":' + df.to_json(orient="records", force_ascii=False) + "}"
+
+
+def to_arrow(df):
+    import pyarrow as pa
+
+    table = pa.Table.from_pandas(df, preserve_index=False)
+    sink = io.BytesIO()
+    with pa.ipc.new_stream(sink, table.schema) as writer:
+        writer.write_table(table)
+    return sink.getvalue()
+
+
+class DatasetHandler(tornado.web.RequestHandler):
+    """Serves the frame returned by ``query``, as JSON or Arrow.
+
+    Subclasses give the files the data comes from (``sources``) and build
+    the frame (``query``) from the request arguments.
+    """
+
+    bodies = OrderedDict()
+
+    def sources(self, *args):
+        raise NotImplementedError
+
+    def query(self, *args):
+        raise NotImplementedError
+
+    def date_argument(self, name):
+        value = self.get_argument(name, None)
+        if value is None:
+            return None
+        try:
+            return pd.Timestamp(value)
+        except ValueError:
+            raise tornado.web.HTTPError(400, reason=f"invalid {name} date: {value}")
+
+    def output_format(self):
+        output_format = self.get_argument("format", None)
+        if output_format is None:
+            output_format = "arrow" if ARROW_STREAM in self.request.headers.get("Accept", "") else "json"
+        if output_format not in ("json", "arrow"):
+            raise tornado.web.HTTPError(400, reason=f"unknown format: {output_format}")
+        return output_format
+
+    async def get(self, *args):
+        output_format = self.output_format()
+        arguments = sorted((name, values) for name, values in self.request.query_arguments.items())
+        etag = hashlib.sha1(repr((data_version(self.sources(*args)), self.request.path, arguments,
+                                  output_format)).encode()).hexdigest()[:16]
+        self.set_header("Etag", f'"{etag}"')
+        self.set_header("Cache-Control", "no-cache")
+        self.set_header("Vary", "Accept")
+        if self.check_etag_header():
+            self.set_status(304)
+            return
+
+        body = self.bodies.get(etag)
+        if body is None:
+            # Loading and serializing run off the event loop
+            encode = to_arrow if output_format == "arrow" else to_json
+            body = await asyncio.get_running_loop().run_in_executor(None, lambda: encode(self.query(*args)))
+            self.bodies[etag] = body
+            if len(self.bodies) > MAX_CACHED_BODIES:
+                self.bodies.popitem(last=False)
+        else:
+            self.bodies.move_to_end(etag)
+        self.set_header("Content-Type", ARROW_STREAM if output_format == "arrow" else "application/json")
+        self.finish(body)
+
+
+class EpidemicHandler(DatasetHandler):
+    def sources(self):
+        return [EPIDEMIC_STATE_PATH]
+
+    def query(self):
+        series = load_epidemic_series()
+        return series.window(self.date_argument("start"), self.date_argument("end"), inclusive="both").frame
+
+
+class EpidemicWeekHandler(DatasetHandler):
+    def sources(self):
+        return [EPIDEMIC_STATE_PATH]
+
+    def query(self):
+        series = load_epidemic_series()
+        today = self.date_argument("date") or pd.Timestamp(series.dates[-1])
+        indicators = weekly_indicators(series, today)
+        return pd.DataFrame([{"date": today, **{name: float(value) for name, value in indicators.items()}}])
+
+
+class SaturationHandler(DatasetHandler):
+    def sources(self):
+        return [SATURATION_PATH]
+
+    def query(self):
+        department = self.get_argument("department", "France")
+        if department == "France":
+            department = "France entière"
+        series = load_saturation_series()
+        if department not in series.groups:
+            raise tornado.web.HTTPError(404, reason=f"unknown department: {department}")
+        series = series.group(department)
+        return series.window(self.date_argument("start"), self.date_argument("end"), inclusive="both").frame
+
+
+class SaturationDepartmentsHandler(DatasetHandler):
+    def sources(self):
+        return [SATURATION_PATH]
+
+    def query(self):
+        return pd.DataFrame({"department": load_saturation_series().keys()})
+
+
+class DepartmentTimeserieHandler(DatasetHandler):
+    def sources(self, dep):
+        return [raw_path(SURSAUD), cube_meta_path(SURSAUD)]
+
+    def query(self, dep):
+        try:
+            df = department_series(None if dep == "France" else canonical_department(dep))
+        except KeyError:
+            raise tornado.web.HTTPError(404, reason=f"unknown department: {dep}")
+        series = TimeSeries(df, "date_de_passage")
+        return series.window(self.date_argument("start"), self.date_argument("end"), inclusive="both").frame
+
+
+ROUTES = [
+    (r"/api/epidemic", EpidemicHandler),
+    (r"/api/epidemic/week", EpidemicWeekHandler),
+    (r"/api/saturation", SaturationHandler),
+    (r"/api/saturation/departments", SaturationDepartmentsHandler),
+    (r"/api/departments/([^/]+)/timeseries", DepartmentTimeserieHandler),
+]
+
+
+class MetricsHandler(tornado.web.RequestHandler):
+    def get(self):
+        self.set_header("Content-Type", "text/plain; version=0.0.4")
+        self.finish(metrics.prometheus())
+
+
+class IndexHandler(tornado.web.RequestHandler):
+    def get(self):
+        self.finish({"endpoints": [path for path, _ in ROUTES]})
+
+
+def make_app():
+    return tornado.web.Application([(r"/api", IndexHandler), (r"/metrics", MetricsHandler)] + ROUTES, transforms=[GZipContentEncoding])
+
+
+async def serve(port=DEFAULT_PORT, address="127.0.0.1"):
+    make_app().listen(port, address)
+    await asyncio.Event().wait()
+
+
+_server_lock = threading.Lock()
+_server_thread = None
+
+
+def serve_in_background(port=DEFAULT_PORT, address="127.0.0.1"):
+    """Start the API once per process, on a thread of its own.
+
+    Called from the Streamlit app, the API shares its loaded datasets.
+    """
+    global _server_thread
+    with _server_lock:
+        if _server_thread is None:
+            _server_thread = threading.Thread(target=asyncio.run, args=(serve(port, address),), name="api", daemon=True)
+            _server_thread.start()
+    return _server_thread
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--port", type=int, default=int(os.environ.get("COVID_TRACKER_API_PORT", DEFAULT_PORT)))
+    parser.add_argument("--address", default="127.0.0.1")
+    args = parser.parse_args()
+    print(f"Serving on http://{args.address}:{args.port}/api")
+    asyncio.run(serve(args.port, args.address))
@@ -0,0 +1,99 @@
+"""Size and encode time of the compact figure encoding (``figencode.py``), per builder.
+
+Every figure of the ``run.py`` builder cases is serialized by Plotly, then
+encoded as the figure cache stores it and as the exported HTML files embed
+it (typed arrays). For each figure the report gives the three sizes, the
+median encode times, and whether both encodings render the same data as
+the Plotly JSON (``figencode.rendered``). The exit status is 1 when one of
+them does not::
+
+    python benchmarks/encoding.py --tree /tmp/synthetic
+    python benchmarks/encoding.py --tree /tmp/synthetic --only "map_cov*" --output encoding.json
+"""
+import argparse
+import fnmatch
+import json
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+import run  # installs the Streamlit stand-in and the import paths
+import synthetic
+from figencode import encode, rendered
+
+
+def timed(function, repeat):
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = function()
+        times.append(time.perf_counter() - start)
+    return result, statistics.median(times)
+
+
+def measure(spec_json, repeat):
+    encoded, encode_s = timed(lambda: encode(spec_json), repeat)
+    binary, binary_s = timed(lambda: encode(spec_json, binary=True), repeat)
+    expected = rendered(json.loads(spec_json))
+    return {
+        "json_kb": round(len(spec_json) / 1024, 1),
+        "encoded_kb": round(len(encoded) / 1024, 1),
+        "binary_kb": round(len(binary) / 1024, 1),
+        "encode_ms": round(encode_s * 1000, 1),
+        "binary_ms": round(binary_s * 1000, 1),
+        "round_trip": rendered(json.loads(encoded)) == expected and rendered(json.loads(binary)) == expected,
+    }
+
+
+def run_encoding(pattern="*", repeat=5):
+    results = {}
+    for name, function in run.builder_cases().items():
+        # The figure cache cases already return encoded figures
+        if not fnmatch.fnmatch(name, pattern) or name.startswith("figcache["):
+            continue
+        result = function()
+        figures = result if isinstance(result, tuple) else (result,)
+        figures = [figure for figure in figures if hasattr(figure, "to_json") and hasattr(figure, "layout")]
+        for i, figure in enumerate(figures):
+            case = name if len(figures) == 1 else f"{name}#{i}"
+            results[case] = metrics = measure(figure.to_json(), repeat)
+            print(f"{case:45s} {metrics['json_kb']:8.1f} kB -> {metrics['encoded_kb']:8.1f} kB "
+                  f"({metrics['encode_ms']:6.1f} ms), binary {metrics['binary_kb']:8.1f} kB "
+                  f"({metrics['binary_ms']:6.1f} ms)  {'ok' if metrics['round_trip'] else 'ROUND TRIP FAILED'}",
+                  flush=True)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Size and encode time of the compact figure encoding")
+    parser.add_argument("--tree", help="synthetic data tree to use (created when missing, temporary by default)")
+    parser.add_argument("--departments", type=int, default=None, help="number of departments (the 101 real ones by default)")
+    parser.add_argument("--days", type=int, default=400)
+    parser.add_argument("--repeat", type=int, default=5, help="encodings timed per figure")
+    parser.add_argument("--only", default="*", help="only run the cases matching this glob pattern")
+    parser.add_argument("--output", help="write the results as JSON to this file")
+    args = parser.parse_args()
+
+    tree = args.tree or tempfile.mkdtemp(prefix="covid-tracker-bench-")
+    if not os.path.exists(os.path.join(tree, "raw_data")):
+        print(f"Writing a synthetic tree in {tree}")
+        synthetic.prepare(tree, args.departments, args.days)
+    output = os.path.abspath(args.output) if args.output else None
+    os.chdir(tree)
+
+    results = run_encoding(args.only, args.repeat)
+    totals = {key: sum(metrics[key] for metrics in results.values()) for key in ("json_kb", "encoded_kb", "binary_kb")}
+    if totals["json_kb"]:
+        print(f"\n{'total':45s} {totals['json_kb']:8.1f} kB -> {totals['encoded_kb']:8.1f} kB "
+              f"({totals['encoded_kb'] / totals['json_kb']:.0%}), binary {totals['binary_kb']:8.1f} kB "
+              f"({totals['binary_kb'] / totals['json_kb']:.0%})")
+    if output:
+        with open(output, "w") as f:
+            json.dump(results, f, indent=2)
+    return 0 if all(metrics["round_trip"] for metrics in results.values()) else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,54 @@
+"""Headless stand-in for the ``streamlit`` module.
+
+Widgets return their default value, layout helpers return the module itself
+and charts are serialized as Streamlit would, their JSON size being recorded
+in ``charts``. Install it before importing the app::
+
+    sys.modules["streamlit"] = FakeStreamlit()
+"""
+import types
+
+
+class FakeStreamlit(types.ModuleType):
+
+    def __init__(self):
+        super().__init__("streamlit")
+        self.sidebar = self
+        self.charts = []
+        self.query_params = {}
+
+    def __getattr__(self, name):
+        # markdown, write, header, set_page_config...: nothing to render
+        return self._ignore
+
+    def _ignore(self, *args, **kwargs):
+        return None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+    def experimental_fragment(self, func=None, **kwargs):
+        # A fragment runs inline, as in a full rerun of the script
+        return func if func is not None else (lambda func: func)
+
+    def columns(self, spec, **kwargs):
+        return [self] * (spec if isinstance(spec, int) else len(spec))
+
+    def container(self, **kwargs):
+        return self
+
+    def selectbox(self, label, options, index=0, **kwargs):
+        options = list(options)
+        return options[index] if options else None
+
+    def slider(self, label, min_value=None, max_value=None, value=None, **kwargs):
+        return min_value if value is None else value
+
+    def select_slider(self, label, options=(), value=None, **kwargs):
+        return list(options)[0] if value is None else value
+
+    def plotly_chart(self, figure_or_data, **kwargs):
+        self.charts.append(len(figure_or_data.to_json()))
@@ -0,0 +1,136 @@
+"""Load test of the local API (``api.py``).
+
+Sends ``--requests`` requests over ``--concurrency`` connections, cycling
+through ``--paths``, and reports the latency percentiles and the throughput
+of each path. Without ``--url``, an API process is started on the data of
+``--tree`` (the current directory by default) for the duration of the test::
+
+    python benchmarks/loadtest.py --tree /tmp/synthetic --concurrency 32
+    python benchmarks/loadtest.py --url http://127.0.0.1:8502 --conditional
+"""
+import argparse
+import asyncio
+import os
+import statistics
+import subprocess
+import sys
+import time
+from collections import defaultdict
+
+import numpy as np
+from tornado.httpclient import AsyncHTTPClient, HTTPClientError, HTTPRequest
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DEFAULT_PATHS = [
+    "/api/epidemic",
+    "/api/epidemic?start=2022-01-01&end=2022-06-30",
+    "/api/epidemic/week",
+    "/api/saturation?department=France",
+    "/api/departments/13/timeseries",
+]
+
+
+async def fetch(client, url, headers, gzip):
+    start = time.perf_counter()
+    try:
+        response = await client.fetch(HTTPRequest(url, headers=headers, decompress_response=gzip), raise_error=False)
+        code, size = response.code, len(response.body or b"")
+    except (HTTPClientError, OSError):
+        code, size = 599, 0
+    return time.perf_counter() - start, code, size
+
+
+async def run(base_url, paths, requests, concurrency, gzip, conditional):
+    AsyncHTTPClient.configure(None, max_clients=concurrency)
+    client = AsyncHTTPClient()
+    etags = {}
+    # One untimed pass loads the datasets into the API process
+    for path in paths:
+        response = await client.fetch(base_url + path, decompress_response=gzip)
+        etags[path] = response.headers.get("Etag")
+
+    results = defaultdict(list)
+    queue = asyncio.Queue()
+    for i in range(requests):
+        queue.put_nowait(paths[i % len(paths)])
+
+    async def worker():
+        while not queue.empty():
+            path = queue.get_nowait()
+            headers = {"If-None-Match": etags[path]} if conditional and etags[path] else {}
+            results[path].append(await fetch(client, base_url + path, headers, gzip))
+
+    start = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    return results, time.perf_counter() - start
+
+
+def report(results, elapsed):
+    print(f"{'path':52} {'n':>6} {'p50 ms':>8} {'p99 ms':>8} {'req/s':>8} {'KB':>8}  status")
+    latencies = []
+    for path, samples in results.items():
+        seconds = np.array([sample[0] for sample in samples])
+        latencies.append(seconds)
+        codes = defaultdict(int)
+        for _, code, _ in samples:
+            codes[code] += 1
+        size = statistics.mean(sample[2] for sample in samples) / 1024
+        print(f"{path:52} {len(samples):6d} {np.percentile(seconds, 50) * 1000:8.1f} "
+              f"{np.percentile(seconds, 99) * 1000:8.1f} {len(samples) / elapsed:8.0f} {size:8.1f}  "
+              + ", ".join(f"{code}: {count}" for code, count in sorted(codes.items())))
+    latencies = np.concatenate(latencies)
+    print(f"\n{len(latencies)} requests in {elapsed:.2f} s: {len(latencies) / elapsed:.0f} req/s, "
+          f"p50 {np.percentile(latencies, 50) * 1000:.1f} ms, p99 {np.percentile(latencies, 99) * 1000:.1f} ms")
+
+
+def start_server(tree, port):
+    env = dict(os.environ, PYTHONPATH=REPO_ROOT)
+    server = subprocess.Popen([sys.executable, os.path.join(REPO_ROOT, "api.py"), "--port", str(port)],
+                              cwd=tree, env=env, stdout=subprocess.DEVNULL)
+    base_url = f"http://127.0.0.1:{port}"
+
+    async def wait():
+        client = AsyncHTTPClient()
+        for _ in range(100):
+            try:
+                await client.fetch(base_url + "/api")
+                return
+            except (HTTPClientError, OSError):
+                await asyncio.sleep(0.1)
+        raise RuntimeError("the API did not start")
+
+    asyncio.run(wait())
+    return server, base_url
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load test the local API")
+    parser.add_argument("--url", help="base URL of a running API (default: start one)")
+    parser.add_argument("--tree", default=".", help="data tree of the API started by the test")
+    parser.add_argument("--port", type=int, default=8599, help="port of the API started by the test")
+    parser.add_argument("--paths", nargs="+", default=DEFAULT_PATHS)
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--format", choices=["json", "arrow"], default="json")
+    parser.add_argument("--gzip", action="store_true", help="accept gzip-compressed responses")
+    parser.add_argument("--conditional", action="store_true", help="send If-None-Match (304 responses)")
+    args = parser.parse_args()
+
+    paths = [path + ("&" if "?" in path else "?") + "format=arrow" if args.format == "arrow" else path
+             for path in args.paths]
+    server = None
+    base_url = args.url
+    if base_url is None:
+        server, base_url = start_server(args.tree, args.port)
+    try:
+        results, elapsed = asyncio.run(run(base_url.rstrip("/"), paths, args.requests, args.concurrency,
+                                           args.gzip, args.conditional))
+    finally:
+        if server is not None:
+            server.terminate()
+            server.wait()
+    report(results, elapsed)
+
+
+if __name__ == "__main__":
+    main()
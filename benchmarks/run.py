@@ -0,0 +1,266 @@
+"""Time and memory-profile the figure builders and pages of the dashboard.
+
+Every case is run against a synthetic data tree (see ``synthetic.py``) with
+``streamlit`` replaced by ``FakeStreamlit``. For each case the report gives:
+
+* ``cold_s``: first call, with an empty dataset registry and figure cache;
+* ``median_s`` / ``min_s``: warm calls;
+* ``peak_mb``: peak Python allocations of a cold call (tracemalloc);
+* ``figure_kb``: size of the serialized figure JSON sent to the browser.
+
+Usage::
+
+    python benchmarks/run.py                                # 101 departments x 400 days
+    python benchmarks/run.py --departments 101 --days 1100 --only map_cov
+    python benchmarks/run.py --save-baseline                # store benchmarks/baseline.json
+    python benchmarks/run.py --check                        # exit 1 on a regression
+
+The timings depend on the machine, so the baseline is not committed: record
+it on the machine that runs ``--check``, from the revision to compare with
+and with the same ``--departments`` / ``--days``::
+
+    git checkout main && python benchmarks/run.py --save-baseline
+    git checkout my-branch && python benchmarks/run.py --check
+"""
+import argparse
+import fnmatch
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+BENCHMARKS_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_ROOT = os.path.dirname(BENCHMARKS_DIR)
+sys.path.insert(0, REPO_ROOT)
+sys.path.insert(0, BENCHMARKS_DIR)
+
+from fake_streamlit import FakeStreamlit  # noqa: E402
+
+# Installed before anything imports the app modules
+fake_st = sys.modules["streamlit"] = FakeStreamlit()
+
+import synthetic  # noqa: E402
+
+DEFAULT_OUTPUT = os.path.join(BENCHMARKS_DIR, "results.json")
+DEFAULT_BASELINE = os.path.join(BENCHMARKS_DIR, "baseline.json")
+# Metrics compared with the baseline, and how much worse they may get
+COMPARED_METRICS = ["median_s", "peak_mb", "figure_kb"]
+DEFAULT_TOLERANCE = 1.25
+
+
+def figure_kb(result):
+    figures = result if isinstance(result, tuple) else (result,)
+    sizes = [len(figure.to_json()) for figure in figures if hasattr(figure, "to_json") and hasattr(figure, "layout")]
+    return round(sum(sizes) / 1024, 1) if sizes else None
+
+
+def reset():
+    """Empty the dataset registry and the figure cache, as in a fresh process."""
+    from figcache import figures
+    from registry import datasets
+
+    datasets.clear()
+    figures.clear(disk=True)
+
+
+def measure(function, repeat):
+    reset()
+    start = time.perf_counter()
+    result = function()
+    cold = time.perf_counter() - start
+
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        times.append(time.perf_counter() - start)
+
+    reset()
+    tracemalloc.start()
+    function()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return {
+        "cold_s": round(cold, 4),
+        "median_s": round(statistics.median(times), 4),
+        "min_s": round(min(times), 4),
+        "peak_mb": round(peak / 1024 ** 2, 1),
+        "figure_kb": figure_kb(result),
+    }
+
+
+def builder_cases():
+    import numpy as np
+    import utils
+    from ageshares import AgeShares, load_age_shares
+    from cube import load_cube
+    from datastore import SURSAUD, SURSAUD_2020
+    from dimensions import WAVES
+    from pipeline import latest_drop
+    from views import age_groups, department, overview, saturation
+
+    drop = latest_drop("sp-dep-jour-*.csv")
+    series = utils.load_epidemic_series()
+    end = series.dates[-1]
+    start = end - np.timedelta64(270, "D")
+    age_dates = load_age_shares().dates.astype(str)
+    age_start, age_end = age_dates[len(age_dates) // 3], age_dates[2 * len(age_dates) // 3]
+
+    cases = {
+        "load_data": lambda: utils.load_data(drop),
+        "load_data[chunked]": lambda: utils.load_data(drop, chunksize=utils.SP_DEP_JOUR_CHUNKSIZE),
+        "plot_positive_cases": lambda: overview.plot_positive_cases(start, end),
+        "plot_positive_cases_with_zoom": lambda: overview.plot_positive_cases_with_zoom(start, end),
+        "plot_tested": lambda: overview.plot_tested(),
+        "plot_positive_rate": lambda: overview.plot_positive_rate(),
+        "plot_incidence_rate": lambda: overview.plot_incidence_rate(),
+    }
+    for wave in WAVES:
+        for dep in ["France", "13"]:
+            cases[f"map_cov[wave={wave},dep={dep}]"] = lambda wave=wave, dep=dep: department.map_cov.uncached(dep, wave)
+    map_end = load_cube(SURSAUD).dates[-1]
+    map_start = map_end - np.timedelta64(182, "D")
+    cases["map_cov[range]"] = lambda: department.map_cov.uncached("France", start=map_start, end=map_end)
+    for dep in ["France", "13"]:
+        cases[f"plot_timeserie_with_animation[dep={dep}]"] = lambda dep=dep: department.plot_timeserie_with_animation.uncached(dep)
+    cases["plot_saturation[France]"] = lambda: saturation.plot_saturation.uncached("France")
+    # Warm calls of these are figure cache hits
+    cases["figcache[map_cov]"] = lambda: department.map_cov("France", 3)
+    cases["figcache[plot_timeserie_with_animation]"] = lambda: department.plot_timeserie_with_animation("13")
+    for dep in ["France", "13"]:
+        cases[f"age_shares[dep={dep}]"] = lambda dep=dep: AgeShares(load_cube(SURSAUD_2020), None if dep == "France" else dep)
+        cases[f"plot_age_group_history[dep={dep}]"] = lambda dep=dep: age_groups.plot_age_group_history.uncached(dep)
+        # What moving the date range slider reruns
+        cases[f"plot_age_group_px[dep={dep}]"] = lambda dep=dep: age_groups.plot_age_group_px(dep, age_start, age_end)
+        cases[f"plot_age_group_share[dep={dep}]"] = lambda dep=dep: age_groups.plot_age_group_share(dep, age_start, age_end)
+    return cases
+
+
+def page_cases():
+    # Importing the app runs its default page once
+    import streamlitapp
+    import utils
+
+    def run_page(page):
+        def run():
+            fake_st.charts.clear()
+            page()
+            return None
+        return run
+
+    cases = {f"page[{name}]": run_page(page) for name, page in streamlitapp.PAGES.items()}
+    # What moving the Overview window slider reruns
+    cases["page[Overview: window slider]"] = run_page(lambda: streamlitapp.overview_window(utils.load_epidemic_series()))
+    return cases
+
+
+def run_benchmarks(pattern="*", repeat=5):
+    cases = builder_cases()
+    cases.update(page_cases())
+    results = {}
+    for name, function in cases.items():
+        if not fnmatch.fnmatch(name, pattern):
+            continue
+        results[name] = measure(function, repeat)
+        if name.startswith("page["):
+            results[name]["figure_kb"] = round(sum(fake_st.charts) / 1024, 1)
+        print(f"{name:45s} {results[name]['median_s'] * 1000:9.1f} ms  "
+              f"cold {results[name]['cold_s'] * 1000:9.1f} ms  {results[name]['peak_mb']:7.1f} MB  "
+              f"{results[name]['figure_kb'] or 0:8.1f} kB", flush=True)
+    return results
+
+
+def git_revision():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=REPO_ROOT, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(results, baseline, tolerance=DEFAULT_TOLERANCE):
+    """Print the ratio of each metric to the baseline and return the regressions."""
+    regressions = []
+    print(f"\n{'case':45s} " + " ".join(f"{metric:>12s}" for metric in COMPARED_METRICS))
+    for name, metrics in results.items():
+        reference = baseline.get(name)
+        if reference is None:
+            continue
+        ratios = []
+        for metric in COMPARED_METRICS:
+            if not metrics.get(metric) or not reference.get(metric):
+                ratios.append("")
+                continue
+            ratio = metrics[metric] / reference[metric]
+            ratios.append(f"x{ratio:.2f}")
+            if ratio > tolerance:
+                regressions.append((name, metric, reference[metric], metrics[metric]))
+        print(f"{name:45s} " + " ".join(f"{ratio:>12s}" for ratio in ratios))
+    for name, metric, before, after in regressions:
+        print(f"REGRESSION {name} {metric}: {before} -> {after}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the figure builders and pages of the dashboard")
+    parser.add_argument("--tree", help="synthetic data tree to use (created when missing, temporary by default)")
+    parser.add_argument("--departments", type=int, default=None, help="number of departments (the 101 real ones by default)")
+    parser.add_argument("--days", type=int, default=400)
+    parser.add_argument("--repeat", type=int, default=5, help="warm calls per case")
+    parser.add_argument("--only", default="*", help="only run the cases matching this glob pattern")
+    parser.add_argument("--output", default=DEFAULT_OUTPUT)
+    parser.add_argument("--baseline", default=DEFAULT_BASELINE)
+    parser.add_argument("--save-baseline", action="store_true", help="store the results as the new baseline")
+    parser.add_argument("--tolerance", type=float, default=DEFAULT_TOLERANCE,
+                        help="allowed ratio to the baseline before a metric counts as a regression")
+    parser.add_argument("--check", action="store_true", help="exit with status 1 when a metric regressed")
+    args = parser.parse_args()
+
+    baseline = None
+    if os.path.exists(args.baseline) and not args.save_baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+    if args.check and baseline is None:
+        parser.error(f"--check needs a baseline, {args.baseline} not found: record it with --save-baseline first")
+    if args.check and (baseline["meta"]["departments"], baseline["meta"]["days"]) != (args.departments, args.days):
+        parser.error(f"the baseline was recorded with --departments {baseline['meta']['departments']} "
+                     f"--days {baseline['meta']['days']}: run --check with the same sizes")
+
+    tree = args.tree or tempfile.mkdtemp(prefix="covid-tracker-bench-")
+    if not os.path.exists(os.path.join(tree, "raw_data")):
+        print(f"Writing a synthetic tree in {tree}")
+        synthetic.prepare(tree, args.departments, args.days)
+    os.chdir(tree)
+
+    report = {
+        "meta": {
+            "revision": git_revision(),
+            "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "python": platform.python_version(),
+            "departments": args.departments,
+            "days": args.days,
+            "repeat": args.repeat,
+        },
+        "results": run_benchmarks(args.only, args.repeat),
+    }
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"\nResults written to {args.output}")
+
+    regressions = []
+    if baseline is not None:
+        regressions = compare(report["results"], baseline["results"], args.tolerance)
+    if args.save_baseline:
+        with open(args.baseline, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"Baseline written to {args.baseline}")
+    return 1 if args.check and regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,233 @@
+"""Concurrent viewers of the dashboard, simulated with Streamlit's AppTest.
+
+Each session runs ``streamlitapp.py`` headlessly on a thread of its own, as
+the Streamlit server does, and goes through ``--interactions`` random
+interactions: switching pages, dragging the Overview slider, selecting a
+department or a wave, narrowing the age groups date range. The random
+choices are seeded, so a run can be replayed against another version of
+the data and figure layers. The report gives the latency percentiles of
+each kind of interaction, the peak RSS and the CPU time of the process::
+
+    python benchmarks/sessions.py --tree /tmp/synthetic --sessions 8 --interactions 20
+"""
+import argparse
+import json
+import os
+import random
+import resource
+import sys
+import threading
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+from unittest.mock import MagicMock
+
+import numpy as np
+from streamlit import config
+from streamlit.logger import set_log_level
+from streamlit.runtime import Runtime
+from streamlit.runtime.caching.storage.dummy_cache_storage import MemoryCacheStorageManager
+from streamlit.runtime.media_file_manager import MediaFileManager
+from streamlit.runtime.memory_media_file_storage import MemoryMediaFileStorage
+from streamlit.runtime.scriptrunner.script_cache import ScriptCache
+from streamlit.testing.v1 import AppTest, local_script_runner
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+APP = os.path.join(REPO_ROOT, "streamlitapp.py")
+PAGES = ["Overview", "Covid by Departement", "Age groups repartition", "Health System Saturation"]
+# Chance that the next interaction switches to another page
+PAGE_SWITCH = 0.3
+
+
+def share_runtime():
+    """Let AppTest sessions run concurrently in this process.
+
+    Every AppTest run installs a mock Streamlit runtime and removes it when
+    it ends, which breaks the runs still going on other threads. All the
+    sessions share one mock runtime instead. Each run also patches the
+    ``global.appTest`` option in and out around itself; it is set for good,
+    so that a run ending does not turn it off under the others. And the app
+    is compiled once for all the sessions, as the server does: each run used
+    to compile it on its own, and Python before 3.11.8 can fail compiling on
+    several threads at once.
+    """
+    runtime = MagicMock(spec=Runtime)
+    runtime.media_file_mgr = MediaFileManager(MemoryMediaFileStorage("/mock/media"))
+    runtime.cache_storage_manager = MemoryCacheStorageManager()
+    Runtime.instance = classmethod(lambda cls: cls._instance or runtime)
+    Runtime.exists = classmethod(lambda cls: True)
+    config.set_option("global.appTest", True)
+    script_cache = ScriptCache()
+    local_script_runner.ScriptCache = lambda: script_cache
+    # Plotly imports orjson on the first figure it serializes, which the first
+    # sessions would do at once, some of them seeing the module half-imported
+    try:
+        import orjson  # noqa: F401
+    except ImportError:
+        pass
+    # Calls made outside the script threads warn about their missing context
+    set_log_level("error")
+
+
+def widget(widgets, label):
+    return next(widget for widget in widgets if widget.label == label)
+
+
+def page_interaction(at, page, rng):
+    """Set a widget of ``page`` to a random value; return the name of the interaction."""
+    if page == "Overview":
+        slider = at.slider[0]
+        # The bounds of a date slider are in microseconds since the epoch
+        first, last = (datetime.fromtimestamp(bound / 1e6, timezone.utc).replace(tzinfo=None)
+                       for bound in (slider.min, slider.max))
+        slider.set_value(first + timedelta(days=rng.randint(0, (last - first).days)))
+        return "Overview: slider"
+    if page == "Covid by Departement":
+        if rng.random() < 0.5:
+            selectbox = widget(at.selectbox, "Select an Epidemic Wave:")
+            selectbox.set_value(rng.choice(selectbox.options))
+            return "Department: wave"
+        selectbox = widget(at.selectbox, "Select a Department:")
+        selectbox.set_value(rng.choice(selectbox.options))
+        return "Department: department"
+    if page == "Age groups repartition":
+        select_slider = at.select_slider[0]
+        start, end = sorted(rng.sample(range(len(select_slider.options)), 2))
+        select_slider.set_value((select_slider.options[start], select_slider.options[end]))
+        return "Age groups: date range"
+    selectbox = widget(at.selectbox, "Select a Department:")
+    selectbox.set_value(rng.choice(selectbox.options))
+    return "Saturation: department"
+
+
+def session(seed, interactions, think_time, timeout):
+    """Latency (name, seconds, error) of each interaction of one simulated viewer."""
+    rng = random.Random(seed)
+    at = AppTest.from_file(APP, default_timeout=timeout)
+    samples = []
+
+    def timed(name):
+        start = time.perf_counter()
+        at.run()
+        error = at.exception[0].value if len(at.exception) else None
+        samples.append((name, time.perf_counter() - start, error))
+
+    timed("start")
+    page = PAGES[0]
+    for _ in range(interactions):
+        if think_time:
+            time.sleep(think_time)
+        if rng.random() < PAGE_SWITCH:
+            page = rng.choice([other for other in PAGES if other != page])
+            at.sidebar.selectbox[0].select(page)
+            timed(f"page: {page}")
+        else:
+            timed(page_interaction(at, page, rng))
+    return samples
+
+
+def rss_bytes():
+    with open("/proc/self/statm") as f:
+        return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+
+
+class RssSampler(threading.Thread):
+    def __init__(self, interval=0.05):
+        super().__init__(daemon=True)
+        self.interval = interval
+        self.peak = rss_bytes()
+        self._stop_event = threading.Event()
+
+    def run(self):
+        while not self._stop_event.wait(self.interval):
+            self.peak = max(self.peak, rss_bytes())
+
+    def stop(self):
+        self._stop_event.set()
+        self.join()
+        return self.peak
+
+
+def run(sessions, interactions, seed=0, think_time=0, timeout=300):
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    cpu_start = usage.ru_utime + usage.ru_stime
+    rss_start = rss_bytes()
+    sampler = RssSampler()
+    sampler.start()
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=sessions) as pool:
+        futures = [pool.submit(session, seed + i, interactions, think_time, timeout) for i in range(sessions)]
+        samples = [sample for future in futures for sample in future.result()]
+    elapsed = time.perf_counter() - start
+    peak_rss = sampler.stop()
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    cpu = usage.ru_utime + usage.ru_stime - cpu_start
+
+    by_name = defaultdict(list)
+    for name, seconds, _ in samples:
+        by_name[name].append(seconds)
+    latencies = {
+        name: {"n": len(values), "p50_s": float(np.percentile(values, 50)), "p90_s": float(np.percentile(values, 90)),
+               "p99_s": float(np.percentile(values, 99)), "max_s": float(np.max(values))}
+        for name, values in sorted(by_name.items())
+    }
+    all_seconds = [seconds for _, seconds, _ in samples]
+    return {
+        "sessions": sessions,
+        "interactions": interactions,
+        "seed": seed,
+        "elapsed_s": elapsed,
+        "interactions_per_s": len(samples) / elapsed,
+        "p50_s": float(np.percentile(all_seconds, 50)),
+        "p99_s": float(np.percentile(all_seconds, 99)),
+        "cpu_s": cpu,
+        "cpu_utilization": cpu / elapsed / os.cpu_count(),
+        "rss_start_mb": rss_start / 1024 ** 2,
+        "peak_rss_mb": peak_rss / 1024 ** 2,
+        "errors": [f"{name}: {error}" for name, _, error in samples if error is not None],
+        "latencies": latencies,
+    }
+
+
+def report(results):
+    print(f"{'interaction':34} {'n':>5} {'p50 ms':>8} {'p90 ms':>8} {'p99 ms':>8} {'max ms':>8}")
+    for name, stats in results["latencies"].items():
+        print(f"{name:34} {stats['n']:5d} {stats['p50_s'] * 1000:8.0f} {stats['p90_s'] * 1000:8.0f} "
+              f"{stats['p99_s'] * 1000:8.0f} {stats['max_s'] * 1000:8.0f}")
+    print(f"\n{results['sessions']} sessions in {results['elapsed_s']:.1f} s: "
+          f"{results['interactions_per_s']:.1f} interactions/s, p50 {results['p50_s'] * 1000:.0f} ms, "
+          f"p99 {results['p99_s'] * 1000:.0f} ms")
+    print(f"CPU {results['cpu_s']:.1f} s ({results['cpu_utilization']:.0%} of {os.cpu_count()} CPUs), "
+          f"RSS {results['rss_start_mb']:.0f} MB at start, {results['peak_rss_mb']:.0f} MB at peak")
+    for error in results["errors"]:
+        print(f"error: {error}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Simulate concurrent sessions of the dashboard")
+    parser.add_argument("--tree", default=".", help="data tree the app runs on")
+    parser.add_argument("--sessions", type=int, default=8)
+    parser.add_argument("--interactions", type=int, default=20, help="interactions of each session")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--think-ms", type=float, default=0, help="pause before each interaction")
+    parser.add_argument("--timeout", type=float, default=300, help="timeout of one script run, in seconds")
+    parser.add_argument("--warmup", action="store_true", help="run one session untimed first")
+    parser.add_argument("--output", help="write the results as JSON")
+    args = parser.parse_args()
+
+    os.chdir(args.tree)
+    sys.path.insert(0, REPO_ROOT)
+    share_runtime()
+    if args.warmup:
+        session(args.seed, args.interactions, 0, args.timeout)
+    results = run(args.sessions, args.interactions, args.seed, args.think_ms / 1000, args.timeout)
+    report(results)
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+    return 1 if results["errors"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
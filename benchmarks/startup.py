@@ -0,0 +1,130 @@
+"""Import cost of the dashboard startup path, page by page.
+
+Each page's modules are imported in a fresh interpreter, after streamlit
+itself (which every page pays for anyway). They are read from the source of
+``streamlitapp.py``: its module-level imports, and the ones made by the page
+function and the functions it calls. The report gives the wall time of
+these imports, and with ``-X importtime`` the heaviest modules they pull in.
+The exit status is 1 when a page goes over the budget or imports one of the
+``FORBIDDEN_MODULES``, so the check can run in CI::
+
+    python benchmarks/startup.py
+    python benchmarks/startup.py --budget-ms 1000 --top 15
+"""
+import argparse
+import ast
+import os
+import statistics
+import subprocess
+import sys
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+APP_PATH = os.path.join(REPO_ROOT, "streamlitapp.py")
+
+# Only needed offline (geometry.py) or not at all
+FORBIDDEN_MODULES = ["geopandas", "shapely", "matplotlib", "seaborn", "altair"]
+DEFAULT_BUDGET_MS = 1500
+MARKER = "--- page imports ---"
+
+SCRIPT = """
+import sys, time
+import streamlit
+sys.stderr.write({marker!r} + "\\n")
+start = time.perf_counter()
+{imports}
+print(time.perf_counter() - start)
+print(",".join(sorted(name for name in {forbidden!r} if name in sys.modules)))
+"""
+
+
+def _imported_modules(nodes):
+    modules = []
+    for node in nodes:
+        if isinstance(node, ast.Import):
+            modules += [alias.name for alias in node.names]
+        elif isinstance(node, ast.ImportFrom) and node.level == 0:
+            modules.append(node.module)
+    return modules
+
+
+def page_imports(app_path=APP_PATH):
+    """The modules ``streamlitapp.py`` imports to show each page, by page name.
+
+    They are its module-level imports (those of the optional API and
+    refresher left out), then the imports of the page function and of the
+    functions of the app it calls.
+    """
+    with open(app_path) as f:
+        tree = ast.parse(f.read())
+    functions = {node.name: node for node in tree.body if isinstance(node, ast.FunctionDef)}
+    pages = next(node.value for node in tree.body
+                 if isinstance(node, ast.Assign) and any(getattr(target, "id", None) == "PAGES" for target in node.targets))
+    common = _imported_modules(tree.body)
+
+    def function_imports(name, seen):
+        nodes = list(ast.walk(functions[name]))
+        modules = _imported_modules(nodes)
+        for node in nodes:
+            if isinstance(node, ast.Call) and getattr(node.func, "id", None) in functions and node.func.id not in seen:
+                seen.add(node.func.id)
+                modules += function_imports(node.func.id, seen)
+        return modules
+
+    return {page.value: list(dict.fromkeys(common + function_imports(function.id, {function.id})))
+            for page, function in zip(pages.keys, pages.values)}
+
+
+def run_imports(modules, importtime=False):
+    script = SCRIPT.format(marker=MARKER, imports="\n".join(f"import {module}" for module in modules),
+                           forbidden=FORBIDDEN_MODULES)
+    command = [sys.executable] + (["-X", "importtime"] if importtime else []) + ["-c", script]
+    result = subprocess.run(command, cwd=REPO_ROOT, capture_output=True, text=True, check=True)
+    seconds, forbidden = result.stdout.splitlines()[-2:]
+    return float(seconds), [name for name in forbidden.split(",") if name], result.stderr
+
+
+def parse_importtime(stderr):
+    """(cumulative us, module) of every import made after the marker."""
+    lines = stderr.split(MARKER, 1)[-1].splitlines()
+    imports = []
+    for line in lines:
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, module = line[len("import time:"):].split("|")
+        imports.append((int(cumulative), module.rstrip()))
+    return imports
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure the import cost of each dashboard page")
+    parser.add_argument("--budget-ms", type=float, default=DEFAULT_BUDGET_MS,
+                        help="maximum import time of a page, on top of streamlit")
+    parser.add_argument("--runs", type=int, default=3, help="fresh interpreters timed per page")
+    parser.add_argument("--top", type=int, default=10, help="heaviest imports listed per page")
+    args = parser.parse_args()
+
+    failures = []
+    for page, modules in page_imports().items():
+        timings = []
+        for _ in range(args.runs):
+            seconds, forbidden, _ = run_imports(modules)
+            timings.append(seconds * 1000)
+        elapsed = statistics.median(timings)
+        _, _, stderr = run_imports(modules, importtime=True)
+
+        print(f"\n{page}: {elapsed:.0f} ms ({', '.join(modules)})")
+        heaviest = sorted(parse_importtime(stderr), reverse=True)[:args.top]
+        for cumulative, module in heaviest:
+            print(f"  {cumulative / 1000:8.1f} ms  {module}")
+        if elapsed > args.budget_ms:
+            failures.append(f"{page}: {elapsed:.0f} ms over the {args.budget_ms:.0f} ms budget")
+        if forbidden:
+            failures.append(f"{page}: imports {', '.join(forbidden)}")
+
+    for failure in failures:
+        print(f"FAIL {failure}")
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
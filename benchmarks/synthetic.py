@@ -0,0 +1,161 @@
+"""Synthetic versions of the raw and preprocessed files read by the dashboard.
+
+The generators follow the layout of the real drops (same columns, separators
+and decimal commas) and scale with the number of departments and days. Lay
+out a whole tree, preprocessed files included, with::
+
+    python benchmarks/synthetic.py /tmp/tree --departments 101 --days 1100
+"""
+import os
+import shutil
+
+import numpy as np
+import pandas as pd
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+AGE_CLASSES = ["0", "A", "B", "C", "D", "E"]
+SURSAUD_MEASURES = [
+    "nbre_pass_corona", "nbre_pass_tot", "nbre_hospit_corona",
+    "nbre_pass_corona_h", "nbre_pass_corona_f", "nbre_pass_tot_h", "nbre_pass_tot_f",
+    "nbre_hospit_corona_h", "nbre_hospit_corona_f",
+    "nbre_acte_corona", "nbre_acte_tot", "nbre_acte_corona_h", "nbre_acte_corona_f",
+    "nbre_acte_tot_h", "nbre_acte_tot_f",
+]
+
+
+def department_codes(n_departments=None):
+    codes = pd.read_csv(os.path.join(REPO_ROOT, "raw_data/departements-region.csv"), dtype=str)["num_dep"].tolist()
+    if n_departments is None:
+        return codes
+    # Past the real departments, made-up codes that are not on the map
+    return [codes[i] if i < len(codes) else f"{900 + i}" for i in range(n_departments)]
+
+
+def department_table(n_departments=None):
+    """The department reference table, with the made-up departments appended."""
+    table = pd.read_csv(os.path.join(REPO_ROOT, "raw_data/departements-region.csv"), dtype=str)
+    extra = department_codes(n_departments)[len(table):]
+    made_up = pd.DataFrame({"num_dep": extra, "dep_name": [f"Department {code}" for code in extra],
+                            "region_name": "Synthetic"})
+    return pd.concat([table, made_up], ignore_index=True)
+
+
+def _wave(n_days, rng, scale):
+    t = np.arange(n_days)
+    curve = scale * (1.2 + np.sin(t / 45.0) + 0.5 * np.sin(t / 11.0))
+    return np.maximum(curve + rng.normal(0, scale * 0.1, n_days), 0)
+
+
+def sursaud(n_departments=None, n_days=400, start="2020-02-24", seed=0):
+    rng = np.random.default_rng(seed)
+    deps = department_codes(n_departments)
+    dates = pd.date_range(start, periods=n_days).strftime("%Y-%m-%d")
+    frames = []
+    for dep in deps:
+        base = _wave(n_days, rng, rng.uniform(5, 50))
+        for age in AGE_CLASSES:
+            share = 1.0 if age == "0" else rng.uniform(0.1, 0.3)
+            corona = np.round(base * share)
+            tot = np.round(corona * rng.uniform(8, 15) + 20)
+            frame = {"dep": dep, "date_de_passage": dates, "sursaud_cl_age_corona": age}
+            frame["nbre_pass_corona"] = corona
+            frame["nbre_pass_tot"] = tot
+            frame["nbre_hospit_corona"] = np.round(corona * 0.4)
+            frame["nbre_pass_corona_h"] = np.round(corona * 0.5)
+            frame["nbre_pass_corona_f"] = corona - frame["nbre_pass_corona_h"]
+            frame["nbre_pass_tot_h"] = np.round(tot * 0.5)
+            frame["nbre_pass_tot_f"] = tot - frame["nbre_pass_tot_h"]
+            frame["nbre_hospit_corona_h"] = np.round(frame["nbre_hospit_corona"] * 0.5)
+            frame["nbre_hospit_corona_f"] = frame["nbre_hospit_corona"] - frame["nbre_hospit_corona_h"]
+            frame["nbre_acte_corona"] = np.round(corona * 0.3)
+            frame["nbre_acte_tot"] = np.round(tot * 0.2) + 1
+            frame["nbre_acte_corona_h"] = np.round(frame["nbre_acte_corona"] * 0.5)
+            frame["nbre_acte_corona_f"] = frame["nbre_acte_corona"] - frame["nbre_acte_corona_h"]
+            frame["nbre_acte_tot_h"] = np.round(frame["nbre_acte_tot"] * 0.5)
+            frame["nbre_acte_tot_f"] = frame["nbre_acte_tot"] - frame["nbre_acte_tot_h"]
+            frames.append(pd.DataFrame(frame))
+    return pd.concat(frames, ignore_index=True)
+
+
+def sp_dep_jour(n_departments=None, n_days=400, start="2020-05-13", seed=0):
+    rng = np.random.default_rng(seed)
+    deps = department_codes(n_departments)
+    dates = pd.date_range(start, periods=n_days).strftime("%Y-%m-%d")
+    frames = []
+    for dep in deps:
+        pop = int(rng.uniform(2e5, 2e6))
+        base = _wave(n_days, rng, pop / 2e4)
+        for age in ["0", "9", "19", "29", "39", "49", "59", "69", "79", "89", "90"]:
+            share = 1.0 if age == "0" else 0.1
+            p = np.round(base * share).astype(int)
+            t = np.round(p * rng.uniform(8, 20) + 10).astype(int)
+            frame = pd.DataFrame({"dep": dep, "jour": dates, "pop": int(pop * share), "P": p, "T": t})
+            frame["Ti"] = (p / (pop * share) * 1e5).round(1)
+            frame["Tp"] = (100 * p / t).round(1)
+            frame["Td"] = (t / (pop * share) * 1e5).round(1)
+            frame["cl_age90"] = int(age)
+            frames.append(frame)
+    df = pd.concat(frames, ignore_index=True)
+    # A few gaps, as in the real drops
+    df.loc[df.sample(frac=0.01, random_state=seed).index, ["Ti", "Tp"]] = np.nan
+    for name in ["Ti", "Tp", "Td"]:
+        df[name] = df[name].map(lambda x: "" if pd.isna(x) else f"{x}".replace(".", ","))
+    return df
+
+
+def covid_hospit(n_departments=None, n_days=400, start="2020-03-18", seed=0):
+    rng = np.random.default_rng(seed)
+    deps = department_codes(n_departments)
+    dates = pd.date_range(start, periods=n_days).strftime("%Y-%m-%d")
+    frames = []
+    for dep in deps:
+        rea = np.round(_wave(n_days, rng, rng.uniform(2, 20)))
+        for sexe in [0, 1, 2]:
+            share = 1.0 if sexe == 0 else 0.5
+            frames.append(pd.DataFrame({"dep": dep, "sexe": sexe, "jour": dates,
+                                        "hosp": np.round(rea * 3 * share).astype(int),
+                                        "rea": np.round(rea * share).astype(int)}))
+    return pd.concat(frames, ignore_index=True)
+
+
+def write_tree(root, n_departments=None, n_days=400, seed=0):
+    """Lay out a synthetic copy of raw_data/ under ``root``, with the real geometries."""
+    raw = os.path.join(root, "raw_data")
+    os.makedirs(raw, exist_ok=True)
+    for name in ["departements.geojson", "critical_beds_dep.csv"]:
+        shutil.copy(os.path.join(REPO_ROOT, "raw_data", name), raw)
+    department_table(n_departments).to_csv(os.path.join(raw, "departements-region.csv"), index=False)
+    shutil.copytree(os.path.join(REPO_ROOT, "preprocessed_data", "geometry"),
+                    os.path.join(root, "preprocessed_data", "geometry"), dirs_exist_ok=True)
+    sursaud(n_departments, n_days, seed=seed).to_csv(os.path.join(raw, "sursaud-covid19-departement.csv"), sep=";", index=False)
+    sursaud(n_departments, min(n_days, 300), seed=seed + 1).to_csv(os.path.join(raw, "sursaud-covid19-departement_2020.csv"), sep=";", index=False)
+    sp_dep_jour(n_departments, n_days, seed=seed).to_csv(os.path.join(raw, "sp-dep-jour-2023-06-30-16h26.csv"), sep=";", index=False)
+    covid_hospit(n_departments, n_days, seed=seed).to_csv(os.path.join(raw, "covid-hospit-2023-03-31-18h01.csv"), sep=";", index=False)
+    return root
+
+
+def prepare(root, n_departments=None, n_days=400, seed=0):
+    """Write a synthetic tree and run the preprocessing pipeline in it."""
+    write_tree(root, n_departments, n_days, seed)
+    cwd = os.getcwd()
+    os.chdir(root)
+    try:
+        import pipeline
+        pipeline.run()
+    finally:
+        os.chdir(cwd)
+    return root
+
+
+if __name__ == "__main__":
+    import argparse
+    import sys
+
+    sys.path.insert(0, REPO_ROOT)
+    parser = argparse.ArgumentParser(description="Write a synthetic data tree")
+    parser.add_argument("root")
+    parser.add_argument("--departments", type=int, default=None, help="number of departments (the 101 real ones by default)")
+    parser.add_argument("--days", type=int, default=400)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    prepare(args.root, args.departments, args.days, args.seed)
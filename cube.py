@@ -0,0 +1,235 @@
+"""Dense (department x day x age class x measure) cube of a SurSaUD dataset.
+
+Every chart of the dashboard is a sum of SurSaUD measures over some
+departments, days and age classes. The cube holds the whole dataset as one
+contiguous float32 array laid out as ``values[measure, dep, day, age]``
+(missing rows count as 0), plus the national totals, so that any slice or
+rollup is a NumPy sum over a few contiguous blocks instead of a pandas
+groupby over raw rows.
+
+The arrays are written next to the columnar store, under
+``preprocessed_data/store/<name>.cube/``, and memory-mapped on load. Each
+build is a new generation of that directory (``generations.py``), so the
+arrays and the metadata read together always come from the same build.
+Build them with ``python cube.py`` (``load_cube`` also rebuilds a stale
+cube).
+"""
+import json
+import os
+
+import numpy as np
+import pandas as pd
+
+from datastore import STORE_DIR, SURSAUD, SURSAUD_2020, SURSAUD_KEYS, ensure_store, raw_path, read_sursaud, store_path
+from dimensions import AGE_CLASSES, AGE_DTYPE, DEPARTMENTS_PATH, canonical_department
+from generations import new_generation, publish
+from instrument import instrumented
+from registry import datasets, file_version, freeze, is_pinned
+from timeseries import to_datetime64
+
+def cube_dir(name):
+    return os.path.join(STORE_DIR, f"{name}.cube")
+
+
+def cube_meta_path(name):
+    return os.path.join(cube_dir(name), "meta.json")
+
+
+class SursaudCube:
+    """Slice and rollup API over the dense SurSaUD arrays.
+
+    ``deps`` are the canonical department codes, in department id order,
+    ``dates`` the consecutive days covered, ``ages`` the age classes and
+    ``measures`` the SurSaUD columns. ``present[dep, day]`` tells whether the
+    department reported on that day.
+    """
+
+    def __init__(self, values, present, deps, start, ages, measures):
+        self.values = values
+        self.present = present
+        self.deps = np.asarray(deps)
+        self.dates = np.arange(np.datetime64(start, "D"), np.datetime64(start, "D") + values.shape[2])
+        self.ages = list(ages)
+        self.measures = list(measures)
+        self._dep_index = {dep: i for i, dep in enumerate(deps)}
+        self._measure_index = {measure: i for i, measure in enumerate(measures)}
+        # National totals, per age class and all rows together
+        self.national = values.sum(axis=1, dtype=np.float64)
+        self.national_present = present.any(axis=0)
+
+    @property
+    def nbytes(self):
+        return self.values.nbytes + self.national.nbytes + self.present.nbytes
+
+    def freeze(self):
+        for array in (self.values, self.present, self.deps, self.dates, self.national, self.national_present):
+            freeze(array)
+
+    def dep_index(self, dep):
+        return self._dep_index[canonical_department(dep)]
+
+    def day_slice(self, start=None, end=None):
+        """Days in ``[start, end)``, found by binary search."""
+        first = 0 if start is None else np.searchsorted(self.dates, to_datetime64(start, "D"))
+        last = len(self.dates) if end is None else np.searchsorted(self.dates, to_datetime64(end, "D"))
+        return slice(first, last)
+
+    def age_indexes(self, ages=None):
+        if ages is None:
+            return slice(None)
+        return [self.ages.index(age) for age in ages]
+
+    def rollup(self, measures, dep=None, start=None, end=None, ages=None, by_age=False):
+        """Sum of ``measures`` for one department (all of France by default).
+
+        Returns the days in ``[start, end)`` the department reported on and a
+        ``(measure, day)`` array, or ``(measure, day, age)`` with ``by_age``.
+        Age classes are summed over ``ages`` (all the rows by default, as a
+        groupby on the raw rows would).
+        """
+        measure_indexes = [self._measure_index[measure] for measure in measures]
+        days = self.day_slice(start, end)
+        if dep is None:
+            block = self.national[measure_indexes, days]
+            present = self.national_present[days]
+        else:
+            i = self.dep_index(dep)
+            block = self.values[measure_indexes, i, days]
+            present = self.present[i, days]
+        block = block[..., self.age_indexes(ages)]
+        if not by_age:
+            block = block.sum(axis=-1, dtype=np.float64)
+        return self.dates[days][present], block[:, present]
+
+    @instrumented("compute")
+    def frame(self, measures, dep=None, start=None, end=None, ages=None, date_column="date_de_passage"):
+        """``rollup`` as a DataFrame with one row per reported day."""
+        dates, block = self.rollup(measures, dep, start, end, ages)
+        df = pd.DataFrame(dict(zip(measures, block)))
+        df.insert(0, date_column, dates.astype("datetime64[ns]"))
+        return df
+
+    @instrumented("compute")
+    def age_frame(self, measures, dep=None, start=None, end=None, ages=None, date_column="date_de_passage",
+                  age_column="sursaud_cl_age_corona"):
+        """``rollup`` by age class, as a long DataFrame with one row per (day, age class)."""
+        dates, block = self.rollup(measures, dep, start, end, ages, by_age=True)
+        age_codes = AGE_DTYPE.categories.get_indexer(np.asarray(self.ages)[self.age_indexes(ages)])
+        df = pd.DataFrame({
+            date_column: np.repeat(dates.astype("datetime64[ns]"), len(age_codes)),
+            age_column: pd.Categorical.from_codes(np.tile(age_codes, len(dates)), dtype=AGE_DTYPE),
+        })
+        for measure, values in zip(measures, block):
+            df[measure] = values.reshape(-1)
+        return df
+
+    @instrumented("compute")
+    def weekly_cumulative(self, measure, start=None, end=None, ages=("0",), date_column="date_de_passage"):
+        """Running total of ``measure`` per department, week by week.
+
+        Weeks start on a Monday and are labelled by it; the weeks starting in
+        ``[start, end)`` (all of them by default) are kept, each summing all
+        its days. Returns one row per department and week the department
+        reported in, by department then week, computed for all departments
+        in one pass over the cube.
+        """
+        first_day = self.dates[0].astype(np.int64)
+        # Days between the Monday of the first week and the first day (day 0 is a Thursday)
+        offset = (first_day + 3) % 7
+        monday = first_day - offset
+        n_weeks = (len(self.dates) + offset + 6) // 7
+
+        def week(date, default):
+            if date is None:
+                return default
+            # Index of the first week starting on or after ``date``
+            return int(np.clip(-((monday - to_datetime64(date, "D").astype(np.int64)) // 7), 0, n_weeks))
+
+        first_week, last_week = week(start, 0), week(end, n_weeks)
+        n = max(last_week - first_week, 0)
+        # Days of these weeks, padded with empty days before the first and after the last day
+        lo = first_week * 7 - offset
+        days = slice(max(lo, 0), min(lo + 7 * n, len(self.dates)))
+        counts = np.zeros((len(self.deps), 7 * n))
+        reported = np.zeros((len(self.deps), 7 * n), dtype=bool)
+        pad = days.start - lo
+        counts[:, pad:pad + days.stop - days.start] = self.values[self._measure_index[measure], :, days][..., self.age_indexes(ages)].sum(axis=-1, dtype=np.float64)
+        reported[:, pad:pad + days.stop - days.start] = self.present[:, days]
+
+        cumulative = counts.reshape(len(self.deps), n, 7).sum(axis=-1).cumsum(axis=1)
+        dep_ids, weeks = np.nonzero(reported.reshape(len(self.deps), n, 7).any(axis=-1))
+        return pd.DataFrame({
+            "dep": pd.Categorical.from_codes(dep_ids, dtype=pd.CategoricalDtype(self.deps)),
+            date_column: (monday + 7 * (first_week + weeks)).astype("datetime64[D]").astype("datetime64[ns]"),
+            f"cumulative_{measure}": cumulative[dep_ids, weeks],
+        })
+
+
+@instrumented("compute")
+def build_cube(name=SURSAUD):
+    """Write the dense arrays of a SurSaUD dataset from its columnar store."""
+    df = read_sursaud(name)
+    measures = [column for column in df.columns if column not in SURSAUD_KEYS]
+    # The department and age axes are the dimensions: the codes are the indexes
+    df = df[df["dep"].notna() & df["sursaud_cl_age_corona"].notna()]
+    deps = df["dep"].cat.categories
+    dep_codes = df["dep"].cat.codes.to_numpy()
+    ages = AGE_CLASSES
+    age_codes = df["sursaud_cl_age_corona"].cat.codes.to_numpy()
+    days = df["date_de_passage"].values.astype("datetime64[D]")
+    start = days.min()
+    day_codes = (days - start).astype(int)
+    n_days = day_codes.max() + 1
+
+    values = np.zeros((len(measures), len(deps), n_days, len(ages)), dtype=np.float32)
+    values[:, dep_codes, day_codes, age_codes] = np.nan_to_num(df[measures].to_numpy(dtype=np.float32)).T
+    present = np.zeros((len(deps), n_days), dtype=bool)
+    present[dep_codes, day_codes] = True
+
+    # A new generation of the whole directory, made current once complete
+    directory = new_generation(cube_dir(name))
+    os.makedirs(directory)
+    for array_name, array in [("values", values), ("present", present)]:
+        np.save(os.path.join(directory, f"{array_name}.npy"), array)
+    # Written last: its modification time dates the whole cube (see is_cube_stale)
+    meta = {"deps": deps.tolist(), "start": str(start), "ages": ages, "measures": measures}
+    with open(os.path.join(directory, "meta.json"), "w") as f:
+        json.dump(meta, f)
+    publish(directory, cube_dir(name))
+    return cube_meta_path(name)
+
+
+def _read_cube(meta_path):
+    with open(meta_path) as f:
+        meta = json.load(f)
+    directory = os.path.dirname(meta_path)
+    values = np.load(os.path.join(directory, "values.npy"), mmap_mode="r")
+    present = np.load(os.path.join(directory, "present.npy"))
+    return SursaudCube(values, present, meta["deps"], meta["start"], meta["ages"], meta["measures"])
+
+
+def is_cube_stale(name):
+    meta = file_version(cube_meta_path(name))
+    if meta is None:
+        return True
+    # While the registry is pinned, the cube is only rebuilt by the refresher, off the requests
+    if is_pinned():
+        return False
+    return meta[0] < max(file_version(store_path(name))[0], file_version(DEPARTMENTS_PATH)[0])
+
+
+@instrumented("load")
+def load_cube(name=SURSAUD):
+    """The cube of a SurSaUD dataset, (re)built when missing or older than its store."""
+    ensure_store(name)
+    if is_cube_stale(name):
+        build_cube(name)
+    return datasets.get(cube_meta_path(name), _read_cube)
+
+
+if __name__ == "__main__":
+    for name in [SURSAUD, SURSAUD_2020]:
+        if os.path.exists(raw_path(name)) or os.path.exists(store_path(name)):
+            print(f"{name} -> {build_cube(name)}")
+        else:
+            print(f"{raw_path(name)} not found, skipped")
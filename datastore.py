@@ -0,0 +1,116 @@
+"""Columnar copies of the raw SurSaUD files.
+
+The raw ``sursaud-covid19-departement*.csv`` drops are converted once into
+typed Parquet files under ``preprocessed_data/store``, each rebuild published
+as a new generation (``generations.py``). Readers go through
+``read_sursaud``, which only reads the requested columns and pushes the
+``dep`` / ``date_de_passage`` filters down to the Parquet row groups.
+
+Build the store with::
+
+    python datastore.py
+"""
+import os
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from dimensions import AGE_DTYPE, canonical_department, department_dtype, encode_ages, encode_departments
+from generations import new_generation, publish
+from instrument import instrumented
+from registry import file_version, is_pinned
+
+RAW_DIR = "raw_data"
+STORE_DIR = "preprocessed_data/store"
+
+SURSAUD = "sursaud-covid19-departement"
+SURSAUD_2020 = "sursaud-covid19-departement_2020"
+
+# Keys are read as strings ('01', '2A', '971') so nothing is lost on the way in,
+# then stored as the department / age class categoricals
+SURSAUD_KEYS = {"dep": str, "date_de_passage": str, "sursaud_cl_age_corona": str}
+
+# Small row groups so that the dep/date statistics can prune most of the file
+ROW_GROUP_SIZE = 32_768
+
+
+def raw_path(name):
+    return os.path.join(RAW_DIR, f"{name}.csv")
+
+
+def store_path(name):
+    return os.path.join(STORE_DIR, f"{name}.parquet")
+
+
+@instrumented("compute")
+def build_store(name):
+    """Convert one raw SurSaUD CSV into its typed, sorted Parquet copy."""
+    df = pd.read_csv(raw_path(name), sep=";", dtype=SURSAUD_KEYS)
+    df["date_de_passage"] = pd.to_datetime(df["date_de_passage"])
+    df["dep"] = encode_departments(df["dep"])
+    df["sursaud_cl_age_corona"] = encode_ages(df["sursaud_cl_age_corona"])
+    measures = [column for column in df.columns if column not in SURSAUD_KEYS]
+    df[measures] = df[measures].astype("float64")
+    df = df.sort_values(["dep", "date_de_passage", "sursaud_cl_age_corona"], kind="stable")
+
+    os.makedirs(STORE_DIR, exist_ok=True)
+    table = pa.Table.from_pandas(df, preserve_index=False)
+    # Readers only see the new file once it is complete, and the pinned ones keep the previous one
+    generation = new_generation(store_path(name))
+    pq.write_table(table, generation, row_group_size=ROW_GROUP_SIZE)
+    publish(generation, store_path(name))
+    return store_path(name)
+
+
+def is_stale(name):
+    store, raw = file_version(store_path(name)), file_version(raw_path(name))
+    if store is None:
+        return True
+    # While the registry is pinned, the store is only rebuilt by the refresher, off the requests
+    if raw is None or is_pinned():
+        return False
+    return store[0] < raw[0]
+
+
+def ensure_store(name):
+    if is_stale(name):
+        build_store(name)
+    return store_path(name)
+
+
+@instrumented("load")
+def read_sursaud(name=SURSAUD, columns=None, deps=None, start=None, end=None, path=None):
+    """Read a SurSaUD dataset from the columnar store.
+
+    ``columns`` restricts the columns read from disk, ``deps`` keeps only the
+    given department codes and ``start``/``end`` keep ``date_de_passage`` in
+    ``[start, end)``. The store is (re)built from the raw CSV when missing or
+    older than it; ``path`` reads a given generation of it instead (e.g. the
+    one served by the registry). ``dep`` and ``sursaud_cl_age_corona`` are
+    returned as the categoricals of ``dimensions``.
+    """
+    filters = []
+    if deps is not None:
+        filters.append(("dep", "in", [canonical_department(dep) for dep in deps]))
+    if start is not None:
+        filters.append(("date_de_passage", ">=", pd.Timestamp(start)))
+    if end is not None:
+        filters.append(("date_de_passage", "<", pd.Timestamp(end)))
+
+    table = pq.read_table(path or ensure_store(name), columns=columns, filters=filters or None)
+    df = table.to_pandas()
+    # Row groups may each carry a subset of the categories: restore the full dtypes
+    if "dep" in df:
+        df["dep"] = df["dep"].astype(department_dtype())
+    if "sursaud_cl_age_corona" in df:
+        df["sursaud_cl_age_corona"] = df["sursaud_cl_age_corona"].astype(AGE_DTYPE)
+    return df
+
+
+if __name__ == "__main__":
+    for name in [SURSAUD, SURSAUD_2020]:
+        if os.path.exists(raw_path(name)):
+            print(f"{raw_path(name)} -> {build_store(name)}")
+        else:
+            print(f"{raw_path(name)} not found, skipped")
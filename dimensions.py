@@ -0,0 +1,87 @@
+"""Canonical department, age class and epidemic wave dimensions.
+
+Department codes come spelled in many ways across the sources (``1``,
+``'1'``, ``'01'``, ``'2A'``). They are normalized once, here, to the codes of
+``raw_data/departements-region.csv`` ('01', '2A', '971') and stored as a
+categorical whose codes are the dense department ids (the row of the
+department in ``load_departments()``). Age classes are categorical the same
+way. Joins and filters on these columns then compare small integers, and a
+frame holds one byte per row for each instead of a Python string.
+
+``WAVES`` is the one definition of the epidemic waves the charts use.
+"""
+import numpy as np
+import pandas as pd
+
+from instrument import instrumented
+from registry import datasets
+
+DEPARTMENTS_PATH = "raw_data/departements-region.csv"
+
+# SurSaUD age classes: "0" is all ages together, A to E the individual classes
+AGE_CLASSES = ["0", "A", "B", "C", "D", "E"]
+AGE_DTYPE = pd.CategoricalDtype(AGE_CLASSES)
+AGE_LABELS = {
+    "0": '7. All ages',
+    "A": '5. Less than 15 years old',
+    "B": '4. 15-44 years old',
+    "C": '3. 45-64 years old',
+    "D": '2. 65-74 years old',
+    "E": '1. 75 years old and more',
+}
+
+# First day (included) and last day (excluded) of each epidemic wave
+WAVES = {
+    1: (None, "2020-09-14"),
+    2: ("2020-09-14", "2020-11-02"),
+    3: ("2020-11-02", "2021-02-01"),
+}
+
+
+def canonical_department(value):
+    """The canonical code ('01', '2A', '971') of any spelling of a department code."""
+    if isinstance(value, (int, np.integer)) or (isinstance(value, float) and value.is_integer()):
+        value = int(value)
+    value = str(value).strip().upper()
+    return value.zfill(2) if value.isdigit() else value
+
+
+def _read_departments(path):
+    df = pd.read_csv(path, dtype=str)
+    df = pd.DataFrame({
+        "code": [canonical_department(code) for code in df["num_dep"]],
+        "name": df["dep_name"],
+        "region": df["region_name"],
+    })
+    df = df.sort_values("code", ignore_index=True)
+    df.index.name = "dep_id"
+    return df
+
+
+@instrumented("load")
+def load_departments():
+    """The department dimension: code, name and region, indexed by the dense department id."""
+    return datasets.get(DEPARTMENTS_PATH, _read_departments)
+
+
+def department_dtype():
+    """Categorical dtype of the department columns: its codes are the department ids."""
+    return pd.CategoricalDtype(load_departments()["code"])
+
+
+def encode_departments(values):
+    """Department codes in any spelling as the department categorical.
+
+    Only the distinct values are normalized. Codes missing from the
+    dimension become NaN.
+    """
+    codes, uniques = pd.factorize(np.asarray(values))
+    dtype = department_dtype()
+    ids = dtype.categories.get_indexer([canonical_department(value) for value in uniques])
+    # The last slot maps the missing values (code -1) to -1
+    ids = np.append(ids, -1)
+    return pd.Categorical.from_codes(ids[codes], dtype=dtype)
+
+
+def encode_ages(values):
+    return pd.Categorical(values, dtype=AGE_DTYPE)
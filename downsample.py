@@ -0,0 +1,128 @@
+"""Downsampling of long daily series for the charts.
+
+A chart cannot show more points than it has pixels, yet the daily series go
+back to 2020. ``Pyramid`` pre-computes, once per series, which rows to keep
+at a weekly and at a monthly resolution: in each week (month) and for each
+plotted column, the row of the minimum and the row of the maximum. Every
+visible peak and trough is thus an actual point of the series, at its actual
+date.
+
+``Pyramid.select`` answers a window of the series with the finest resolution
+that fits in ``max_points`` rows. The weeks (months) cut by the window are
+recomputed on the rows inside it, so the extrema of any window, such as the
+first peaks of ``views.saturation.get_date_first_peak``, are always kept.
+When even the monthly rows do not fit, they are reduced further with
+Largest-Triangle-Three-Buckets (``lttb``), keeping the extrema.
+"""
+import numpy as np
+
+RESOLUTIONS = ("D", "W", "M")
+MAX_POINTS = 500
+
+
+def bucket_ids(dates, resolution):
+    """Week (starting on Monday) or month number of each date."""
+    if resolution == "W":
+        # Day 0 (1970-01-01) is a Thursday
+        return (dates.astype("datetime64[D]").astype(np.int64) + 3) // 7
+    return dates.astype(f"datetime64[{resolution}]").astype(np.int64)
+
+
+def bucket_starts(ids):
+    """Positions where a new bucket starts, in rows sorted by bucket."""
+    return np.flatnonzero(np.diff(ids, prepend=ids[:1] - 1))
+
+
+def minmax(values, starts):
+    """Positions of the first minimum and the first maximum of each bucket.
+
+    Missing values are ignored; an all-missing bucket keeps its first row.
+    """
+    values = np.asarray(values, dtype=np.float64)
+    missing = np.isnan(values)
+    lengths = np.diff(np.append(starts, len(values)))
+    buckets = np.repeat(np.arange(len(starts)), lengths)
+    positions = []
+    for reduce, fill in ((np.minimum, np.inf), (np.maximum, -np.inf)):
+        filled = np.where(missing, fill, values)
+        hits = np.flatnonzero(filled == reduce.reduceat(filled, starts)[buckets])
+        _, first = np.unique(buckets[hits], return_index=True)
+        positions.append(hits[first])
+    return np.concatenate(positions)
+
+
+def lttb(x, y, n_out):
+    """Positions of the ``n_out`` points Largest-Triangle-Three-Buckets keeps."""
+    n = len(x)
+    if n_out >= n or n_out < 3:
+        return np.arange(n)
+    x = np.asarray(x, dtype=np.float64)
+    y = np.nan_to_num(np.asarray(y, dtype=np.float64))
+    # The first and the last points are kept, the others split in n_out - 2 buckets
+    edges = np.linspace(1, n - 1, n_out - 1).astype(np.int64)
+    positions = np.empty(n_out, dtype=np.int64)
+    positions[0], positions[-1] = 0, n - 1
+    a = 0
+    for i in range(n_out - 2):
+        lo, hi = edges[i], edges[i + 1]
+        if i + 2 < len(edges):
+            next_x, next_y = x[hi:edges[i + 2]].mean(), y[hi:edges[i + 2]].mean()
+        else:
+            next_x, next_y = x[-1], y[-1]
+        areas = np.abs((x[a] - next_x) * (y[lo:hi] - y[a]) - (x[a] - x[lo:hi]) * (next_y - y[a]))
+        a = lo + int(np.argmax(areas))
+        positions[i + 1] = a
+    return positions
+
+
+class Pyramid:
+    """Rows to keep at each resolution to draw ``columns`` of a date-sorted series."""
+
+    def __init__(self, dates, columns):
+        self.dates = dates
+        self.columns = [np.asarray(values, dtype=np.float64) for values in columns]
+        self.levels = {}
+        for resolution in RESOLUTIONS[1:]:
+            starts = bucket_starts(bucket_ids(dates, resolution))
+            kept = np.unique(np.concatenate([minmax(values, starts) for values in self.columns]))
+            self.levels[resolution] = (np.append(starts, len(dates)), kept)
+
+    def _minmax(self, lo, hi):
+        if lo >= hi:
+            return np.empty(0, dtype=np.int64)
+        return lo + np.concatenate([minmax(values[lo:hi], np.zeros(1, dtype=np.int64)) for values in self.columns])
+
+    def rows(self, resolution, lo, hi):
+        """Positions of the rows kept between positions ``lo`` and ``hi`` at ``resolution``."""
+        if resolution == "D":
+            return np.arange(lo, hi)
+        bounds, kept = self.levels[resolution]
+        # Buckets wholly inside the window come from the pyramid, the cut ones are recomputed
+        inner_lo = bounds[np.searchsorted(bounds, lo, side="left")]
+        inner_hi = bounds[np.searchsorted(bounds, hi, side="right") - 1]
+        if inner_lo > inner_hi:
+            parts = [self._minmax(lo, hi)]
+        else:
+            inner = kept[np.searchsorted(kept, inner_lo):np.searchsorted(kept, inner_hi)]
+            parts = [self._minmax(lo, inner_lo), inner, self._minmax(inner_hi, hi)]
+        return np.unique(np.concatenate(parts + [[lo, hi - 1]]))
+
+    def select(self, lo, hi, max_points=MAX_POINTS, keep=()):
+        """Positions of the rows to draw between positions ``lo`` and ``hi``.
+
+        The finest resolution with at most ``max_points`` rows is used, and
+        the rows at positions ``keep`` are always drawn.
+        """
+        if lo >= hi:
+            return np.empty(0, dtype=np.int64)
+        for resolution in RESOLUTIONS:
+            rows = self.rows(resolution, lo, hi)
+            if len(rows) <= max_points:
+                break
+        else:
+            x = self.dates[rows].astype("datetime64[ns]").astype(np.int64)
+            reduced = rows[lttb(x, self.columns[0][rows], max_points)]
+            extrema = self._minmax(lo, hi)
+            rows = np.union1d(reduced, extrema)
+        keep = np.asarray(keep, dtype=np.int64)
+        return np.union1d(rows, keep[(keep >= lo) & (keep < hi)])
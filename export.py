@@ -0,0 +1,191 @@
+"""Batch export of the department figures for the weekly reports.
+
+For France and every department, renders the department time series, the
+map of the chosen wave (or date range) and the health system saturation
+chart, and writes them as ``<output>/<department>/<figure>.<format>``
+(``json``, ``html`` and, with the kaleido package, ``png``)::
+
+    python export.py --output exports/week-42 [--format html --format json] [--wave 3] [--workers 4]
+
+The datasets are loaded once, before the worker processes are forked, so
+the workers share the parent's frames and arrays (copy-on-write) instead of
+reading them again. The figures go through the figure cache (``figcache.py``):
+an export after ``figcache.py --warm`` only writes files.
+
+Exports are resumable: every file is written atomically, and the
+departments whose files all exist are skipped on the next run, unless the
+data changed since (``manifest.json`` records the data version) or
+``--force`` is given. The HTML files share one ``plotly.min.js`` at the root
+of the output directory; as it reads typed arrays, their numeric arrays are
+written in binary (``figencode.encode(spec, binary=True)``).
+"""
+import argparse
+import importlib.util
+import json
+import multiprocessing
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import plotly.io as pio
+from plotly.offline import get_plotlyjs
+
+from cube import cube_meta_path, load_cube
+from datastore import SURSAUD, raw_path
+from dimensions import DEPARTMENTS_PATH, WAVES, canonical_department, load_departments
+from figencode import encode
+from geometry import INDEX_PATH, LEVELS, level_path, load_geometry, load_geometry_index
+from registry import data_version
+from utils import SATURATION_PATH, load_saturation_series
+
+FORMATS = ["json", "html", "png"]
+MANIFEST = "manifest.json"
+SOURCES = [raw_path(SURSAUD), cube_meta_path(SURSAUD), SATURATION_PATH, DEPARTMENTS_PATH, INDEX_PATH] + \
+          [level_path(level) for level in LEVELS]
+
+
+def load_datasets():
+    """Load everything the figures read into the process-wide registry.
+
+    Returns the figures of each department to export, with the label of its
+    saturation series: the departments without a geometry (overseas) have
+    no map, those without hospital data no saturation chart.
+    """
+    from views.department import unique_departments
+
+    load_cube(SURSAUD)
+    load_departments()
+    geo_index = load_geometry_index()
+    for level in LEVELS:
+        load_geometry(level)
+    df = load_saturation_series().frame[["dep", "Libellé"]].dropna().drop_duplicates("dep")
+    labels = {canonical_department(dep): label for dep, label in zip(df["dep"], df["Libellé"])}
+
+    departments = {"France": {"timeserie": None, "map": None, "saturation": "France"}}
+    for dep in unique_departments():
+        departments[dep] = {"timeserie": None}
+        if dep in geo_index:
+            departments[dep]["map"] = None
+        if dep in labels:
+            departments[dep]["saturation"] = labels[dep]
+    return departments
+
+
+def output_paths(output, dep, figures, formats):
+    return {(figure, file_format): os.path.join(output, dep, f"{figure}.{file_format}")
+            for figure in figures for file_format in formats}
+
+
+def write_atomic(path, content):
+    mode = "wb" if isinstance(content, bytes) else "w"
+    with open(path + ".tmp", mode) as f:
+        f.write(content)
+    os.replace(path + ".tmp", path)
+
+
+def export_department(dep, figures, paths, wave=None, start=None, end=None):
+    """Render and write the figures of ``dep``; return an error message or None."""
+    from views import department, saturation
+
+    builders = {
+        "timeserie": lambda: department.plot_timeserie_with_animation(dep),
+        "map": lambda: (department.map_cov(dep, start=start, end=end) if start or end
+                        else department.map_cov(dep, wave)),
+        "saturation": lambda: saturation.plot_saturation(figures["saturation"]),
+    }
+    try:
+        os.makedirs(os.path.dirname(next(iter(paths.values()))), exist_ok=True)
+        for figure in figures:
+            spec = builders[figure]().to_json()
+            for (name, file_format), path in paths.items():
+                if name != figure:
+                    continue
+                if file_format == "json":
+                    write_atomic(path, spec)
+                elif file_format == "html":
+                    # The spec comes from a built figure: validating it again costs more than the rendering
+                    write_atomic(path, pio.to_html(json.loads(encode(spec, binary=True)), include_plotlyjs="../plotly.min.js",
+                                                   validate=False))
+                else:
+                    write_atomic(path, pio.to_image(json.loads(spec), format="png", validate=False))
+    except Exception as error:
+        return f"{dep}: {error!r}"
+    return None
+
+
+def export(output, formats=("json", "html"), wave=None, start=None, end=None, departments=None, workers=None,
+           force=False):
+    """Export the figures of ``departments`` (all of them by default); return the failures."""
+    started = time.perf_counter()
+    figures = load_datasets()
+    if departments is not None:
+        departments = [dep if dep == "France" else canonical_department(dep) for dep in departments]
+        unknown = [dep for dep in departments if dep not in figures]
+        if unknown:
+            raise ValueError(f"no data for the departments {', '.join(unknown)}")
+    else:
+        departments = list(figures)
+    if wave is None and start is None and end is None:
+        wave = max(WAVES)
+
+    os.makedirs(output, exist_ok=True)
+    manifest_path = os.path.join(output, MANIFEST)
+    manifest = {"data_version": data_version(SOURCES), "wave": wave, "start": start, "end": end}
+    if os.path.exists(manifest_path):
+        with open(manifest_path) as f:
+            # Files exported from other data or for another period are stale
+            force = force or json.load(f) != manifest
+    write_atomic(manifest_path, json.dumps(manifest, indent=2))
+    if "html" in formats:
+        write_atomic(os.path.join(output, "plotly.min.js"), get_plotlyjs())
+
+    tasks = {}
+    for dep in departments:
+        paths = output_paths(output, dep, figures[dep], formats)
+        if force or not all(os.path.exists(path) for path in paths.values()):
+            tasks[dep] = paths
+    skipped = len(departments) - len(tasks)
+    load_time = time.perf_counter() - started
+    print(f"{len(tasks)} departments to export, {skipped} already exported (datasets loaded in {load_time:.1f} s)")
+
+    # Forked workers inherit the loaded datasets; elsewhere each worker loads them again
+    method = "fork" if "fork" in multiprocessing.get_all_start_methods() else None
+    failures = []
+    started = time.perf_counter()
+    with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context(method)) as pool:
+        futures = [pool.submit(export_department, dep, figures[dep], paths, wave, start, end)
+                   for dep, paths in tasks.items()]
+        for done, future in enumerate(as_completed(futures), start=1):
+            failure = future.result()
+            if failure is not None:
+                failures.append(failure)
+            if done % 10 == 0 or done == len(futures):
+                elapsed = time.perf_counter() - started
+                print(f"{done}/{len(futures)} departments exported, {done / elapsed:.2f} departments/s")
+    for failure in failures:
+        print(f"failed: {failure}")
+    return failures
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--output", required=True, help="directory of the exported files")
+    parser.add_argument("--format", dest="formats", action="append", choices=FORMATS,
+                        help="file format, repeatable (default: json and html)")
+    parser.add_argument("--wave", type=int, choices=list(WAVES), help="wave of the maps (default: the last one)")
+    parser.add_argument("--start", help="first day of the maps, instead of a wave")
+    parser.add_argument("--end", help="day after the last day of the maps, instead of a wave")
+    parser.add_argument("--department", dest="departments", action="append",
+                        help="department to export, repeatable (default: France and every department)")
+    parser.add_argument("--workers", type=int, default=None, help="worker processes (one per CPU by default)")
+    parser.add_argument("--force", action="store_true", help="export again the departments already exported")
+    args = parser.parse_args()
+
+    formats = args.formats or ["json", "html"]
+    if "png" in formats and importlib.util.find_spec("kaleido") is None:
+        parser.error("PNG export needs the kaleido package")
+    if args.wave is not None and (args.start or args.end):
+        parser.error("give either --wave or --start/--end")
+    sys.exit(1 if export(args.output, formats, args.wave, args.start, args.end, args.departments, args.workers,
+                         args.force) else 0)
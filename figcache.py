@@ -0,0 +1,298 @@
+"""Cache of the serialized figures, shared by every session.
+
+A figure such as ``map_cov(dep, wave)`` only depends on its arguments and on
+the files it is computed from. ``cached_figure`` stores the Plotly JSON of
+each built figure under (builder, arguments, versions of those files):
+
+* in memory, in an LRU bounded by ``COVID_TRACKER_FIGURE_CACHE_MB`` (128 MB
+  by default);
+* on disk, as ``preprocessed_data/figures/<builder>/<arguments>/<data
+  version>.json``, so that figures survive restarts and can be rendered
+  ahead of time.
+
+The specs are stored in their compact encoding (``figencode.py``), which is
+also what the browser receives.
+
+Concurrent requests for the same missing figure wait for a single build.
+Pre-render every department and wave after a data refresh with::
+
+    python figcache.py --warm [--workers 4]
+"""
+import argparse
+import functools
+import hashlib
+import inspect
+import json
+import os
+import shutil
+import threading
+from collections import OrderedDict
+
+import plotly.graph_objects as go
+
+from figencode import dumps, encode
+from registry import data_version, is_pinned
+
+FIGURES_DIR = "preprocessed_data/figures"
+DEFAULT_MAX_BYTES = int(float(os.environ.get("COVID_TRACKER_FIGURE_CACHE_MB", 128)) * 1024 ** 2)
+
+
+class CachedFigure(go.Figure):
+    """A figure served from its cached JSON.
+
+    Serializing it (``to_dict``, ``to_json``, ``st.plotly_chart``) returns the
+    cached spec without building and validating the Plotly objects again.
+    It is meant for display: call ``figure()`` for a full, editable figure.
+    """
+
+    def __init__(self, spec):
+        super().__init__()
+        self._spec = spec
+
+    def figure(self):
+        return go.Figure(json.loads(self._spec))
+
+    def to_dict(self):
+        return json.loads(self._spec)
+
+    def to_plotly_json(self):
+        return self.to_dict()
+
+    def to_json(self, *args, **kwargs):
+        if args or kwargs:
+            return self.figure().to_json(*args, **kwargs)
+        return self._spec
+
+
+def _merge(target, update):
+    for key, value in update.items():
+        if isinstance(value, dict) and isinstance(target.get(key), dict):
+            _merge(target[key], value)
+        else:
+            target[key] = value
+
+
+def relayout(figure, layout):
+    """``figure`` with ``layout`` merged into its layout, as a ``CachedFigure``.
+
+    The traces are neither built nor validated again, so laying a window or
+    a few shapes over a cached figure only costs a JSON round trip.
+    """
+    spec = json.loads(figure.to_json())
+    _merge(spec.setdefault("layout", {}), layout)
+    return CachedFigure(dumps(spec))
+
+
+def _digest(value):
+    return hashlib.sha1(repr(value).encode()).hexdigest()[:16]
+
+
+class FigureCache:
+    """Two-tier (memory LRU, then disk) cache of figure JSON specs."""
+
+    def __init__(self, directory=FIGURES_DIR, max_bytes=DEFAULT_MAX_BYTES):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._key_locks = {}
+        self.nbytes = 0
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+    def _path(self, builder_name, version, arguments):
+        return os.path.join(self.directory, builder_name, _digest(arguments), version + ".json")
+
+    def get(self, builder_name, arguments, version, build):
+        """The figure ``build()`` returns, built only when in neither tier.
+
+        ``arguments`` must be hashable and ``version`` is the data version.
+        The figure is returned as a ``CachedFigure`` of its encoded spec.
+        """
+        key = (builder_name, arguments, version)
+        with self._lock:
+            spec = self._lookup(key)
+            if spec is not None:
+                return CachedFigure(spec)
+            key_lock = self._key_locks.setdefault(key, threading.Lock())
+
+        # Only one thread builds a given figure, the others wait for it
+        try:
+            with key_lock:
+                with self._lock:
+                    spec = self._lookup(key)
+                if spec is not None:
+                    return CachedFigure(spec)
+
+                path = self._path(builder_name, version, arguments)
+                spec = self._read(path)
+                if spec is not None:
+                    self._store(key, spec, built=False)
+                    return CachedFigure(spec)
+
+                spec = encode(build().to_json())
+                self._write(path, spec)
+                self._store(key, spec, built=True)
+                return CachedFigure(spec)
+        finally:
+            with self._lock:
+                self._key_locks.pop(key, None)
+
+    def _lookup(self, key):
+        spec = self._entries.get(key)
+        if spec is not None:
+            self._entries.move_to_end(key)
+            self.memory_hits += 1
+        return spec
+
+    def _store(self, key, spec, built):
+        with self._lock:
+            if built:
+                self.misses += 1
+            else:
+                self.disk_hits += 1
+            if key in self._entries or len(spec) > self.max_bytes:
+                return
+            self._entries[key] = spec
+            self.nbytes += len(spec)
+            while self.nbytes > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self.nbytes -= len(evicted)
+
+    def _read(self, path):
+        try:
+            with open(path) as f:
+                return f.read()
+        except FileNotFoundError:
+            return None
+
+    def _write(self, path, spec):
+        directory = os.path.dirname(path)
+        os.makedirs(directory, exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "w") as f:
+            f.write(spec)
+        os.replace(tmp_path, path)
+        # Only the current data version of a figure is kept on disk (while pinned, the served
+        # version may be older than the one a refresh is writing)
+        if is_pinned():
+            return
+        for name in os.listdir(directory):
+            if name != os.path.basename(path) and not name.endswith(".tmp"):
+                try:
+                    os.remove(os.path.join(directory, name))
+                except FileNotFoundError:
+                    pass
+
+    def clear(self, disk=False):
+        with self._lock:
+            self._entries.clear()
+            self.nbytes = 0
+        if disk:
+            shutil.rmtree(self.directory, ignore_errors=True)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "nbytes": self.nbytes,
+                "max_bytes": self.max_bytes,
+                "memory_hits": self.memory_hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+            }
+
+
+figures = FigureCache()
+
+
+def cached_figure(*sources):
+    """Cache the figures returned by the decorated builder in ``figures``.
+
+    ``sources`` are the files the figure is computed from: paths, or
+    callables taking the builder arguments and returning a path or a list of
+    paths. The key is made of all the arguments and the version of the
+    sources, so the builder loads its datasets itself rather than taking
+    them as arguments.
+    """
+    def decorator(builder):
+        signature = inspect.signature(builder)
+        builder_name = f"{builder.__module__}.{builder.__qualname__}"
+
+        @functools.wraps(builder)
+        def wrapper(*args, **kwargs):
+            bound = signature.bind(*args, **kwargs)
+            bound.apply_defaults()
+            paths = []
+            for source in sources:
+                path = source(**bound.arguments) if callable(source) else source
+                paths.extend(path if isinstance(path, (list, tuple)) else [path])
+            arguments = tuple(bound.arguments.items())
+            return figures.get(builder_name, arguments, data_version(paths), lambda: builder(*args, **kwargs))
+
+        wrapper.uncached = builder
+        return wrapper
+    return decorator
+
+
+def warm_tasks():
+    """(builder, args) of every figure a visitor can ask for."""
+    from dimensions import WAVES
+    from utils import load_saturation_series
+    from ageshares import age_departments
+    from views.department import unique_departments
+
+    deps = ["France"] + list(unique_departments())
+    tasks = [("map_cov", (dep, wave)) for dep in deps for wave in WAVES]
+    tasks += [("plot_timeserie_with_animation", (dep,)) for dep in deps]
+    tasks += [("plot_saturation", (department,)) for department in ["France"] + load_saturation_series().keys()]
+    tasks += [(name, (dep,)) for dep in ["France"] + list(age_departments())
+              for name in ["plot_age_group_history", "plot_age_group_share_history"]]
+    return tasks
+
+
+def _warm(task):
+    from views import age_groups, department, saturation
+
+    name, args = task
+    try:
+        if name == "plot_saturation":
+            saturation.plot_saturation(*args)
+        elif name.startswith("plot_age_group"):
+            getattr(age_groups, name)(*args)
+        else:
+            getattr(department, name)(*args)
+    except Exception as error:
+        return f"{name}{args}: {error!r}"
+    return None
+
+
+def warm(workers=None):
+    """Render every figure into the disk tier, in parallel processes."""
+    from concurrent.futures import ProcessPoolExecutor
+
+    tasks = warm_tasks()
+    failures = []
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        for done, failure in enumerate(pool.map(_warm, tasks, chunksize=4), start=1):
+            if failure is not None:
+                failures.append(failure)
+            if done % 50 == 0 or done == len(tasks):
+                print(f"{done}/{len(tasks)} figures rendered")
+    for failure in failures:
+        print(f"failed: {failure}")
+    return failures
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--warm", action="store_true", help="pre-render every department and wave")
+    parser.add_argument("--workers", type=int, default=None, help="worker processes (one per CPU by default)")
+    parser.add_argument("--clear", action="store_true", help="delete the figures cached on disk first")
+    args = parser.parse_args()
+
+    if args.clear:
+        figures.clear(disk=True)
+    if args.warm:
+        warm(args.workers)
@@ -0,0 +1,271 @@
+"""Compact encoding of the figure specs sent to the browser.
+
+Plotly serializes every figure as plain JSON: each date as a full
+``2020-02-24T00:00:00`` string, and each animation frame as a complete copy
+of the traces and shapes it updates. ``encode`` rewrites the JSON, without
+changing what plotly.js draws:
+
+* dates at midnight lose their time (``2020-02-24``) and integral floats
+  their fraction;
+* a scatter or bar trace whose x (or y) dates are evenly spaced is given as
+  its first date and step in milliseconds (``x0``/``dx``), which plotly.js
+  expands itself;
+* every frame but the first only carries what differs from it, and names
+  it as its ``baseframe``: plotly.js merges the two when it animates;
+* with ``binary=True``, the numeric trace arrays are written as typed arrays
+  (``{"dtype": "f8", "bdata": <base64>}``). Only plotly.js 2.28 and later
+  read those: the exported HTML files ship such a version, the app does
+  not (Streamlit bundles plotly.js 2.26), so the figure cache stores the
+  plain JSON encoding.
+
+``rendered`` resolves a spec into what plotly.js renders from it (frames
+merged with their base, steps expanded, typed arrays decoded, dates
+normalized): an encoding is checked by comparing
+``rendered(json.loads(encode(spec_json)))`` with
+``rendered(json.loads(spec_json))``. ``benchmarks/encoding.py`` does it for
+every figure builder, and reports the sizes and encode times.
+"""
+import base64
+import json
+import re
+
+import numpy as np
+
+# A whole JSON string holding a date at midnight
+MIDNIGHT = re.compile(r'"(\d{4}-\d{2}-\d{2})T00:00:00(?:\.0+)?"')
+ISO_DATE = re.compile(r"\d{4}-\d{2}-\d{2}(?:[ T]\d{2}:\d{2}(?::\d{2}(?:\.\d+)?)?)?")
+# Arrays of items merged one by one when a frame extends another (Plots.extendObjectWithContainers)
+LAYOUT_CONTAINERS = ("annotations", "images", "selections", "shapes", "sliders", "updatemenus")
+TRACE_CONTAINERS = ("dimensions", "transforms")
+# Trace types that read x0/dx and y0/dy as the coordinates of their points
+STEP_TYPES = ("bar", "scatter", "scattergl")
+# Trace arrays written as typed arrays with binary=True, and the shortest worth it
+BINARY_KEYS = ("x", "y", "z", "lat", "lon", "values")
+BINARY_MARKER_KEYS = ("color", "size")
+MIN_BINARY_LENGTH = 16
+INT_DTYPES = [("u1", np.uint8), ("i1", np.int8), ("u2", np.uint16), ("i2", np.int16), ("u4", np.uint32),
+              ("i4", np.int32)]
+
+
+def dumps(spec):
+    return json.dumps(spec, separators=(",", ":"))
+
+
+def _number(text):
+    value = float(text)
+    return int(value) if value.is_integer() and abs(value) < 2 ** 53 else value
+
+
+def _regular_dates(values):
+    """(first date, step in ms) of evenly spaced ISO dates, None for anything else."""
+    if len(values) < 3 or not all(isinstance(value, str) and ISO_DATE.fullmatch(value) for value in values):
+        return None
+    steps = np.diff(np.array(values, dtype="datetime64[ms]").astype(np.int64))
+    if steps[0] <= 0 or (steps != steps[0]).any():
+        return None
+    return values[0], int(steps[0])
+
+
+def _steps(trace):
+    if trace.get("type", "scatter") not in STEP_TYPES:
+        return
+    for letter in "xy":
+        values = trace.get(letter)
+        if not isinstance(values, list) or letter + "0" in trace or "d" + letter in trace:
+            continue
+        regular = _regular_dates(values)
+        if regular is not None:
+            del trace[letter]
+            trace[letter + "0"], trace["d" + letter] = regular
+
+
+def _extend(base, update, containers=()):
+    """``base`` extended with ``update`` the way plotly.js merges frames."""
+    result = dict(base) if isinstance(base, dict) else {}
+    for key, value in update.items():
+        if key in containers and isinstance(value, list):
+            items = list(result[key]) if isinstance(result.get(key), list) else []
+            for i, item in enumerate(value):
+                if i == len(items):
+                    items.append(None)
+                items[i] = None if item is None else _extend(items[i], item)
+            result[key] = items
+        elif isinstance(value, dict) and isinstance(result.get(key), dict):
+            result[key] = _extend(result[key], value)
+        else:
+            result[key] = value
+    return result
+
+
+def _delta(base, value, containers=()):
+    """What to extend ``base`` with to get ``value``, assuming it can be done."""
+    base = base if isinstance(base, dict) else {}
+    delta = {}
+    for key, item in value.items():
+        old = base.get(key)
+        if key in containers and isinstance(item, list) and isinstance(old, list):
+            delta[key] = [_delta(old[i] if i < len(old) else None, element) if isinstance(element, dict) else element
+                          for i, element in enumerate(item)]
+        elif isinstance(item, dict) and isinstance(old, dict):
+            changed = _delta(old, item)
+            if changed or not item:
+                delta[key] = changed
+        elif key not in base or item != old:
+            delta[key] = item
+    return delta
+
+
+def _covers(value, base, containers=()):
+    """Whether ``value`` sets every key of ``base``, which extending cannot take away."""
+    for key, old in base.items():
+        if key not in value:
+            return False
+        item = value[key]
+        if key in containers and isinstance(item, list) and isinstance(old, list):
+            if len(item) < len(old) or not all(
+                    not isinstance(b, dict) or isinstance(v, dict) and _covers(v, b) for v, b in zip(item, old)):
+                return False
+        elif isinstance(item, dict) and isinstance(old, dict) and not _covers(item, old):
+            return False
+    return True
+
+
+def _frame_traces(frame):
+    return frame.get("traces") or list(range(len(frame.get("data", []))))
+
+
+def _compute_frame(frame, frames):
+    """Layout and traces (by index) of ``frame`` after its base frames (Plots.computeFrame)."""
+    stack, names = [frame], [frame.get("name")]
+    while stack[-1].get("baseframe") is not None and str(stack[-1]["baseframe"]) in frames:
+        base = frames[str(stack[-1]["baseframe"])]
+        if base.get("name") in names:
+            break
+        stack.append(base)
+        names.append(base.get("name"))
+    layout, data = None, {}
+    for current in reversed(stack):
+        if "layout" in current:
+            layout = _extend(layout, current["layout"], LAYOUT_CONTAINERS)
+        for index, trace in zip(_frame_traces(current), current.get("data", [])):
+            if index is not None:
+                data[index] = _extend(data.get(index), trace, TRACE_CONTAINERS)
+    return layout, data
+
+
+def _share_frames(frames):
+    """Write the frames after the first one as their difference from it."""
+    base = frames[0]
+    name = base.get("name")
+    if not isinstance(name, str) or len({frame.get("name") for frame in frames}) < len(frames) \
+            or any("baseframe" in frame for frame in frames):
+        return frames
+    base_layout, base_data = _compute_frame(base, {})
+    shared = [base]
+    for frame in frames[1:]:
+        traces = _frame_traces(frame)
+        data = dict(zip(traces, frame.get("data", [])))
+        # Keys of the base that the frame lacks cannot be taken away: such a frame stays whole
+        if not (_covers(frame.get("layout", {}), base_layout or {}, LAYOUT_CONTAINERS)
+                and all(index in data and _covers(data[index], trace, TRACE_CONTAINERS)
+                        for index, trace in base_data.items())):
+            shared.append(frame)
+            continue
+        delta = {key: value for key, value in frame.items() if key not in ("data", "layout")}
+        delta["baseframe"] = name
+        if "layout" in frame:
+            delta["layout"] = _delta(base_layout or {}, frame["layout"], LAYOUT_CONTAINERS)
+        if "data" in frame:
+            delta["data"] = [_delta(base_data.get(index), trace, TRACE_CONTAINERS)
+                             for index, trace in zip(traces, frame["data"])]
+        shared.append(delta)
+    return shared
+
+
+def _typed_array(values):
+    if len(values) < MIN_BINARY_LENGTH or not all(type(value) in (int, float) for value in values):
+        return None
+    array = np.array(values)
+    if array.dtype.kind == "i":
+        low, high = array.min(), array.max()
+        for dtype, numpy_type in INT_DTYPES:
+            limits = np.iinfo(numpy_type)
+            if limits.min <= low and high <= limits.max:
+                array = array.astype(numpy_type)
+                break
+        else:
+            if np.abs(array).max() >= 2 ** 53:
+                return None
+            dtype, array = "f8", array.astype(np.float64)
+    elif array.dtype.kind == "f":
+        if not np.isfinite(array).all():
+            return None
+        single = array.astype(np.float32)
+        dtype, array = ("f4", single) if (single == array).all() else ("f8", array)
+    else:
+        return None
+    return {"dtype": dtype, "bdata": base64.b64encode(array.astype(array.dtype.newbyteorder("<")).tobytes()).decode()}
+
+
+def _binary(trace):
+    for container, keys in ((trace, BINARY_KEYS), (trace.get("marker"), BINARY_MARKER_KEYS)):
+        if not isinstance(container, dict):
+            continue
+        for key in keys:
+            if isinstance(container.get(key), list):
+                typed = _typed_array(container[key])
+                if typed is not None:
+                    container[key] = typed
+
+
+def encode(spec_json, binary=False):
+    """A compact encoding of the figure JSON ``spec_json``, drawn the same by plotly.js."""
+    spec = json.loads(MIDNIGHT.sub(r'"\1"', spec_json), parse_float=_number)
+    for trace in spec.get("data", []):
+        _steps(trace)
+    if len(spec.get("frames") or []) > 1:
+        spec["frames"] = _share_frames(spec["frames"])
+    if binary:
+        for trace in spec.get("data", []) + [trace for frame in spec.get("frames") or [] for trace in frame.get("data", [])]:
+            _binary(trace)
+    return dumps(spec)
+
+
+def _normalized(value):
+    if isinstance(value, float):
+        return int(value) if value.is_integer() and abs(value) < 2 ** 53 else value
+    if isinstance(value, str):
+        return str(np.datetime64(value, "ms")) if ISO_DATE.fullmatch(value) else value
+    if isinstance(value, list):
+        return [_normalized(item) for item in value]
+    if isinstance(value, dict):
+        if set(value) >= {"dtype", "bdata"}:
+            return _normalized(np.frombuffer(base64.b64decode(value["bdata"]), dtype="<" + value["dtype"]).tolist())
+        return {key: _normalized(item) for key, item in value.items()}
+    return value
+
+
+def _expand_steps(trace):
+    if trace.get("type", "scatter") not in STEP_TYPES:
+        return
+    for letter in "xy":
+        other = trace.get("y" if letter == "x" else "x")
+        if letter in trace or letter + "0" not in trace or other is None:
+            continue
+        start, step = trace.pop(letter + "0"), trace.pop("d" + letter, 1)
+        if isinstance(start, str):
+            dates = np.datetime64(start, "ms") + np.arange(len(other)) * np.timedelta64(int(step), "ms")
+            trace[letter] = [str(date) for date in dates]
+        else:
+            trace[letter] = [start + i * step for i in range(len(other))]
+
+
+def rendered(spec):
+    """What plotly.js draws from ``spec``: its traces, layout and frames resolved and normalized."""
+    spec = _normalized(spec)
+    for trace in spec.get("data", []):
+        _expand_steps(trace)
+    frames = spec.pop("frames", None) or []
+    by_name = {str(frame.get("name")): frame for frame in frames}
+    spec["frames"] = [(frame.get("name"), frame.get("group")) + _compute_frame(frame, by_name) for frame in frames]
+    return spec
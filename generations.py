@@ -0,0 +1,77 @@
+"""Derived files and directories published as generations.
+
+The background refresher (``refresher.py``) rebuilds the derived datasets
+while the requests keep being served the previous ones (``registry.pin``).
+A file replaced on disk, even atomically, is gone for them: a pinned dataset
+evicted from the registry would be read again from the new file, and a cube
+could be read half from each version. As the data segment does
+(``segment.py``), each rebuild is therefore written as a new generation next
+to the previous ones, and the path the readers open becomes a symbolic link,
+swapped atomically to the new generation::
+
+    preprocessed_data/store/
+        sursaud-covid19-departement.parquet -> .generations/1760781600123456789-sursaud-covid19-departement.parquet
+        sursaud-covid19-departement.cube -> .generations/1760781600234567890-sursaud-covid19-departement.cube
+        .generations/
+            1760781600123456789-sursaud-covid19-departement.parquet
+            1760781600234567890-sursaud-covid19-departement.cube/
+                meta.json, values.npy, present.npy
+
+The registry resolves the links when it first looks at a path
+(``registry.served_path``), so a pinned request reads every file of the
+generation it started with. The last ``KEEP_GENERATIONS`` generations of
+each path are kept on disk, for the processes still reading them.
+"""
+import os
+import shutil
+import time
+
+GENERATIONS_DIR = ".generations"
+# Generations kept on disk, for the processes still reading the previous ones
+KEEP_GENERATIONS = 3
+
+
+def _generations_dir(path):
+    return os.path.join(os.path.dirname(path), GENERATIONS_DIR)
+
+
+def new_generation(path):
+    """Where to write the next generation of ``path`` (a file or a directory), before ``publish``."""
+    directory = _generations_dir(path)
+    os.makedirs(directory, exist_ok=True)
+    return os.path.join(directory, f"{time.time_ns()}-{os.path.basename(path)}")
+
+
+def generations(path):
+    """The generations of ``path`` on disk, oldest first."""
+    try:
+        names = os.listdir(_generations_dir(path))
+    except FileNotFoundError:
+        return []
+    versions = []
+    for name in names:
+        version, _, basename = name.partition("-")
+        if version.isdigit() and basename == os.path.basename(path):
+            versions.append((int(version), os.path.join(_generations_dir(path), name)))
+    return [generation for _, generation in sorted(versions)]
+
+
+def publish(generation, path):
+    """Point ``path`` to ``generation`` (from ``new_generation``) in one swap, and drop the old ones."""
+    link = path + ".tmp"
+    if os.path.lexists(link):
+        os.remove(link)
+    os.symlink(os.path.relpath(generation, os.path.dirname(path)), link)
+    if os.path.isdir(path) and not os.path.islink(path):
+        # A directory written before generations cannot be swapped: it is removed first
+        shutil.rmtree(path)
+    os.replace(link, path)
+    current = os.path.realpath(path)
+    for old in generations(path)[:-KEEP_GENERATIONS]:
+        if os.path.realpath(old) == current:
+            continue
+        if os.path.isdir(old):
+            shutil.rmtree(old, ignore_errors=True)
+        else:
+            os.remove(old)
+    return generation
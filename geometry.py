@@ -0,0 +1,122 @@
+"""Preprocessed department geometries for the maps.
+
+``raw_data/departements.geojson`` is a ~1 MB full-resolution polygon set.
+``python geometry.py`` derives from it, under ``preprocessed_data/geometry``:
+
+* one GeoJSON per level of detail, simplified in Lambert-93 (metres) and
+  rounded to ~1 m, see ``LEVELS``;
+* ``index.json``, mapping each department code to its name, its centroid
+  (computed in a projected CRS), its bounding box and its position in the
+  feature collections.
+
+At run time only these small JSON files are read, so geopandas is only
+needed to (re)build them.
+"""
+import json
+import math
+import os
+
+from instrument import instrumented
+from registry import datasets
+
+SOURCE_PATH = "raw_data/departements.geojson"
+GEOMETRY_DIR = "preprocessed_data/geometry"
+INDEX_PATH = os.path.join(GEOMETRY_DIR, "index.json")
+
+# Simplification tolerance of each level of detail, in metres
+LEVELS = {"low": 2000, "medium": 250, "high": 50}
+
+PROJECTED_CRS = "EPSG:2154"
+COORDINATE_DECIMALS = 5
+
+
+def level_path(level):
+    return os.path.join(GEOMETRY_DIR, f"departements_{level}.geojson")
+
+
+def level_for_zoom(zoom, lat=46.5):
+    """Coarsest level of detail whose tolerance stays under one screen pixel."""
+    metres_per_pixel = 156543.03 * math.cos(math.radians(lat)) / 2 ** zoom
+    levels = sorted(LEVELS.items(), key=lambda item: item[1], reverse=True)
+    for level, tolerance in levels:
+        if tolerance <= metres_per_pixel:
+            return level
+    return levels[-1][0]
+
+
+def _round_coordinates(coordinates):
+    if isinstance(coordinates[0], (int, float)):
+        return [round(value, COORDINATE_DECIMALS) for value in coordinates]
+    return [_round_coordinates(part) for part in coordinates]
+
+
+def build_geometry(source=SOURCE_PATH):
+    """Write the simplified levels of detail and the code index."""
+    import geopandas as gpd
+
+    geo_df = gpd.read_file(source)
+    projected = geo_df.to_crs(PROJECTED_CRS)
+    centroids = projected.geometry.centroid.to_crs(geo_df.crs)
+
+    os.makedirs(GEOMETRY_DIR, exist_ok=True)
+    for level, tolerance in LEVELS.items():
+        simplified = projected.geometry.simplify(tolerance, preserve_topology=True).to_crs(geo_df.crs)
+        features = []
+        for code, name, geometry in zip(geo_df["code"], geo_df["nom"], simplified):
+            shape = geometry.__geo_interface__
+            features.append({
+                "type": "Feature",
+                "id": code,
+                "properties": {"code": code, "nom": name},
+                "geometry": {"type": shape["type"], "coordinates": _round_coordinates(shape["coordinates"])},
+            })
+        with open(level_path(level), "w") as f:
+            json.dump({"type": "FeatureCollection", "features": features}, f, separators=(",", ":"))
+
+    index = {}
+    for position, (code, name, centroid, bounds) in enumerate(zip(geo_df["code"], geo_df["nom"], centroids, geo_df.geometry.bounds.values)):
+        index[code] = {
+            "name": name,
+            "centroid": [round(centroid.x, COORDINATE_DECIMALS), round(centroid.y, COORDINATE_DECIMALS)],
+            "bbox": [round(value, COORDINATE_DECIMALS) for value in bounds],
+            "feature": position,
+        }
+    with open(INDEX_PATH, "w") as f:
+        json.dump(index, f, ensure_ascii=False, separators=(",", ":"))
+
+
+def ensure_geometry():
+    if not os.path.exists(INDEX_PATH) or not all(os.path.exists(level_path(level)) for level in LEVELS):
+        build_geometry()
+
+
+def _read_json(path):
+    with open(path) as f:
+        return json.load(f)
+
+
+@instrumented("load")
+def load_geometry(level="low"):
+    """GeoJSON feature collection of all departments at the given level of detail."""
+    ensure_geometry()
+    return datasets.get(level_path(level), _read_json)
+
+
+@instrumented("load")
+def load_geometry_index():
+    ensure_geometry()
+    return datasets.get(INDEX_PATH, _read_json)
+
+
+@instrumented("compute")
+def department_feature(code, level="medium"):
+    """Single-feature collection for one department, e.g. for a zoomed-in map."""
+    feature = load_geometry(level)["features"][load_geometry_index()[code]["feature"]]
+    return {"type": "FeatureCollection", "features": [feature]}
+
+
+if __name__ == "__main__":
+    build_geometry()
+    for level in LEVELS:
+        print(f"{level_path(level)}: {os.path.getsize(level_path(level)) / 1024:.0f} kB")
+    print(INDEX_PATH)
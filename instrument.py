@@ -0,0 +1,217 @@
+"""Opt-in instrumentation of the loaders and figure builders.
+
+The loaders, the computations on their frames and the figure builders are
+decorated with ``instrumented(kind)``; any other block can be timed with
+``with stage(name, kind)``. Each stage records its wall time, the memory it
+allocated (net, when ``tracemalloc`` is tracing), its rows in and out and,
+for the builders, the size of the serialized figure and the time it takes
+to serialize it.
+
+Recording is off by default and costs one context lookup per call. It is
+on for the whole process with ``COVID_TRACKER_INSTRUMENT=1`` (or
+``enable()``), and for a single render inside ``with trace()``, which is how
+the hidden debug panel of the app (``?debug=1``, or ``?debug=memory`` to
+trace allocations too) gets its breakdown.
+Recorded stages are:
+
+* accumulated in ``metrics``, exported in the Prometheus text format by
+  ``metrics.prometheus()`` (and served on ``/metrics`` by ``api.py``), along
+  with the values other modules publish there with ``metrics.set`` (such as
+  the refresh duration and staleness of ``refresher.py``);
+* logged as one JSON object per stage on the ``covid_tracker.stages``
+  logger, at DEBUG level.
+"""
+import contextlib
+import contextvars
+import functools
+import json
+import logging
+import os
+import threading
+import time
+import tracemalloc
+from collections import defaultdict
+from collections.abc import Mapping
+
+logger = logging.getLogger("covid_tracker.stages")
+
+_enabled = os.environ.get("COVID_TRACKER_INSTRUMENT", "") not in ("", "0")
+_trace = contextvars.ContextVar("trace", default=None)
+_depth = contextvars.ContextVar("depth", default=0)
+
+# Accumulated fields of the stage records, with their Prometheus name and help
+COUNTERS = {
+    "calls": ("covid_tracker_stage_calls_total", "Calls of the stage."),
+    "wall_s": ("covid_tracker_stage_seconds_total", "Wall time spent in the stage."),
+    "allocated_bytes": ("covid_tracker_stage_allocated_bytes_total", "Memory allocated by the stage (net, traced runs only)."),
+    "rows_in": ("covid_tracker_stage_rows_in_total", "Rows of the frames given to the stage."),
+    "rows_out": ("covid_tracker_stage_rows_out_total", "Rows of the frames returned by the stage."),
+    "payload_bytes": ("covid_tracker_figure_payload_bytes_total", "Size of the serialized figures."),
+}
+
+
+def enable(flag=True):
+    """Record every stage of the process, not only the traced ones."""
+    global _enabled
+    _enabled = flag
+
+
+def active():
+    return _enabled or _trace.get() is not None
+
+
+class Metrics:
+    """Counters of the recorded stages, by (stage, kind), and other published values."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counters = defaultdict(lambda: dict.fromkeys(COUNTERS, 0))
+        self._values = {}
+
+    def set(self, name, value, help_text, kind="gauge"):
+        """Publish ``value`` (a number, or a function returning one when exported) as ``name``."""
+        with self._lock:
+            self._values[name] = (value, help_text, kind)
+
+    def observe(self, record):
+        with self._lock:
+            counters = self._counters[(record["stage"], record["kind"])]
+            counters["calls"] += 1
+            for field in COUNTERS:
+                if field != "calls" and record.get(field) is not None:
+                    counters[field] += record[field]
+
+    def snapshot(self):
+        with self._lock:
+            return {key: dict(counters) for key, counters in self._counters.items()}
+
+    def clear(self):
+        with self._lock:
+            self._counters.clear()
+
+    def prometheus(self):
+        """The counters in the Prometheus text exposition format."""
+        snapshot = self.snapshot()
+        lines = []
+        for field, (name, help_text) in COUNTERS.items():
+            lines += [f"# HELP {name} {help_text}", f"# TYPE {name} counter"]
+            for (stage_name, kind), counters in sorted(snapshot.items()):
+                lines.append(f'{name}{{stage="{_escape(stage_name)}",kind="{_escape(kind)}"}} {counters[field]:g}')
+        with self._lock:
+            values = dict(self._values)
+        for name, (value, help_text, kind) in sorted(values.items()):
+            value = value() if callable(value) else value
+            if value is not None:
+                lines += [f"# HELP {name} {help_text}", f"# TYPE {name} {kind}", f"{name} {value:.15g}"]
+        return "\n".join(lines) + "\n"
+
+
+def _escape(value):
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+metrics = Metrics()
+
+
+def _rows(value):
+    """Rows of a frame, array or series (summed over tuples), None for anything else."""
+    if isinstance(value, (tuple, list)):
+        counts = [count for count in map(_rows, value) if count is not None]
+        return sum(counts) if counts else None
+    shape = getattr(value, "shape", None)
+    if shape:
+        return shape[0]
+    if hasattr(value, "__len__") and not isinstance(value, (str, bytes, Mapping)):
+        return len(value)
+    return None
+
+
+def _emit(record):
+    metrics.observe(record)
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug(json.dumps(record, default=str))
+
+
+@contextlib.contextmanager
+def stage(name, kind="stage", rows_in=None):
+    """Record the block as a stage; yields its record (None when not recording)."""
+    if not active():
+        yield None
+        return
+    record = {"stage": name, "kind": kind, "depth": _depth.get(), "rows_in": rows_in, "rows_out": None}
+    records = _trace.get()
+    if records is not None:
+        records.append(record)
+    depth_token = _depth.set(record["depth"] + 1)
+    memory = tracemalloc.get_traced_memory()[0] if tracemalloc.is_tracing() else None
+    start = time.perf_counter()
+    try:
+        yield record
+    finally:
+        record["wall_s"] = time.perf_counter() - start
+        record["allocated_bytes"] = tracemalloc.get_traced_memory()[0] - memory if memory is not None else None
+        _depth.reset(depth_token)
+        _emit(record)
+
+
+def instrumented(kind):
+    """Record each call of the decorated function as a stage of ``kind``.
+
+    The figures returned by builders (``kind="figure"``) are serialized in a
+    following ``serialize`` stage to measure their payload.
+    """
+    def decorator(function):
+        name = function.__qualname__
+
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            if not active():
+                return function(*args, **kwargs)
+            with stage(name, kind, _rows(list(args) + list(kwargs.values()))) as record:
+                result = function(*args, **kwargs)
+                record["rows_out"] = _rows(result)
+            if kind == "figure":
+                figure = result[0] if isinstance(result, tuple) else result
+                with stage(f"{name}: serialize", "serialize") as record:
+                    record["payload_bytes"] = len(figure.to_json())
+            return result
+        return wrapper
+    return decorator
+
+
+@contextlib.contextmanager
+def trace(memory=False):
+    """Record the stages run in this context, even when instrumentation is off.
+
+    Yields the list the records are appended to, in the order the stages
+    start. With ``memory``, allocations are traced for the duration, which
+    slows down the traced code several times.
+    """
+    records = []
+    started = memory and not tracemalloc.is_tracing()
+    if started:
+        tracemalloc.start()
+    token = _trace.set(records)
+    try:
+        yield records
+    finally:
+        _trace.reset(token)
+        if started:
+            tracemalloc.stop()
+
+
+def records_frame(records):
+    """The records of a trace as a table, stage names indented by depth."""
+    import pandas as pd
+
+    df = pd.DataFrame(records, columns=["stage", "kind", "depth", "wall_s", "allocated_bytes", "rows_in",
+                                        "rows_out", "payload_bytes"])
+    return pd.DataFrame({
+        "stage": ["  " * depth + name for name, depth in zip(df["stage"], df["depth"])],
+        "kind": df["kind"],
+        "wall ms": df["wall_s"] * 1000,
+        "net allocated KB": df["allocated_bytes"] / 1024,
+        "rows in": df["rows_in"],
+        "rows out": df["rows_out"],
+        "payload KB": df["payload_bytes"] / 1024,
+    })
@@ -0,0 +1,129 @@
+"""Joins of the saturation sources on integer department and day keys.
+
+The saturation dataset merges three sources per department and day: the
+SurSaUD visits, the hospital occupancy and the critical care capacity, given
+per year. Merging the frames on their ``dep`` strings and dates hashes every
+row of each; here the rows are keyed by their dense department id
+(``dimensions.py``) and day number instead, and summed into one
+(department x day) grid per source with ``np.bincount``. The national row
+(``FR``) is the sum of the department rows of the same grids.
+
+The capacity is joined as of the year: a day takes the capacity of the
+latest year at or before its own, so the days after the last year of
+``critical_beds_dep.csv`` keep the last known capacity instead of none.
+
+The result is laid out by department: one block of days per department, in
+department id order, then the national block. ``TimeSeries`` takes such a
+frame as it is, and a department is a slice of it. Rows whose code is not in
+the department dimension are left out, as in the SurSaUD cube.
+"""
+import numpy as np
+import pandas as pd
+
+from dimensions import encode_departments, load_departments
+
+NATIONAL = "FR"
+HOSPIT_COLUMNS = ["hosp", "rea"]
+
+
+def day_numbers(dates):
+    """Days since 1970-01-01 of ``dates``."""
+    return np.asarray(dates, dtype="datetime64[D]").astype(np.int64)
+
+
+def block_ids(codes):
+    """Department ids of ``codes``; ``NATIONAL`` is the block after the last department, anything else -1."""
+    # Only the distinct codes are looked up
+    codes, uniques = pd.factorize(np.asarray(codes))
+    ids = np.append(encode_departments(uniques).codes.astype(np.int64), -1)
+    ids[:-1][uniques == NATIONAL] = len(load_departments())
+    return ids[codes]
+
+
+def grid_sums(ids, days, values, shape, first_day):
+    """Sums of the columns of ``values`` per (department, day) cell, and the cells with rows.
+
+    Like ``groupby(...).sum()``, missing values count as 0.
+    """
+    keep = (ids >= 0) & (ids < shape[0]) & (days >= first_day) & (days < first_day + shape[1])
+    cells = ids[keep] * shape[1] + (days[keep] - first_day)
+    size = shape[0] * shape[1]
+    present = np.bincount(cells, minlength=size).reshape(shape) > 0
+    # One contiguous array per column
+    columns = np.asarray(values, dtype=float).T
+    columns = np.array(columns if keep.all() else columns[:, keep], order="C")
+    columns[np.isnan(columns)] = 0
+    sums = np.stack([np.bincount(cells, weights=column, minlength=size) for column in columns], axis=-1)
+    return sums.reshape(shape + (len(columns),)), present
+
+
+def asof_join(keys, times, right_keys, right_times, right_values):
+    """Value of the latest right row of the same key at or before each (key, time), NaN if none.
+
+    The (key, time) pairs are compared as one integer, so all the rows are
+    matched by a single binary search in the sorted right rows.
+    """
+    keys, times, right_keys, right_times = (np.asarray(a, dtype=np.int64) for a in (keys, times, right_keys, right_times))
+    right_values = np.asarray(right_values, dtype=float)
+    result = np.full(len(keys), np.nan)
+    if not len(keys) or not len(right_keys):
+        return result
+    origin = min(times.min(), right_times.min())
+    span = max(times.max(), right_times.max()) - origin + 1
+    right = right_keys * span + (right_times - origin)
+    order = np.argsort(right, kind="stable")
+    position = np.searchsorted(right[order], keys * span + (times - origin), side="right") - 1
+    found = position >= 0
+    found[found] = right_keys[order[position[found]]] == keys[found]
+    result[found] = right_values[order[position[found]]]
+    return result
+
+
+def saturation_table(covid_data, focus_hosp, critical_beds):
+    """The daily saturation sources of each department and of France, joined.
+
+    ``covid_data`` holds the SurSaUD rows (``dep``, ``date`` and the measures),
+    ``focus_hosp`` the hospital rows (``dep``, ``date``, ``hosp``, ``rea``) and
+    ``critical_beds`` the capacity (``dep``, ``Libellé``, ``year``,
+    ``Critical beds``). There is a row for each department and day of the
+    SurSaUD data; ``hosp`` and ``rea`` are NaN on the days a department has
+    no hospital row.
+    """
+    measures = [name for name in covid_data.columns if name not in ("dep", "date")]
+    departments = load_departments()["code"].to_numpy()
+    ids, days = block_ids(covid_data["dep"]), day_numbers(covid_data["date"])
+    valid = (ids >= 0) & (ids < len(departments))
+    first_day = days[valid].min() if valid.any() else 0
+    shape = (len(departments), days[valid].max() - first_day + 1 if valid.any() else 0)
+
+    sums, present = grid_sums(ids, days, covid_data[measures], shape, first_day)
+    hospit, hospit_present = grid_sums(block_ids(focus_hosp["dep"]), day_numbers(focus_hosp["date"]),
+                                       focus_hosp[HOSPIT_COLUMNS], shape, first_day)
+    hospit[~hospit_present] = np.nan
+    # The national block, in the same grids: the days any department reported on
+    national = present.any(axis=0)
+    sums = np.concatenate([sums, sums.sum(axis=0, keepdims=True)])
+    national_hospit = np.nansum(np.where(present[..., None], hospit, np.nan), axis=0, keepdims=True)
+    hospit = np.concatenate([hospit, national_hospit])
+    present = np.concatenate([present, national[None]])
+
+    blocks, day_index = np.nonzero(present)
+    dates = (first_day + day_index).astype("datetime64[D]")
+    cells = blocks * present.shape[1] + day_index
+    sums, hospit = sums.reshape(-1, len(measures))[cells], hospit.reshape(-1, len(HOSPIT_COLUMNS))[cells]
+    df = pd.DataFrame({
+        "dep": np.append(departments, NATIONAL)[blocks],
+        "date": dates.astype("datetime64[ns]"),
+        **{name: sums[:, i] for i, name in enumerate(measures)},
+        **{name: hospit[:, i] for i, name in enumerate(HOSPIT_COLUMNS)},
+        "year": dates.astype("datetime64[Y]").astype(np.int64) + 1970,
+    })
+
+    beds_ids = block_ids(critical_beds["dep"])
+    known = beds_ids >= 0
+    labels = np.full(len(departments) + 1, np.nan, dtype=object)
+    labels[beds_ids[known]] = critical_beds["Libellé"].to_numpy()[known]
+    df["Libellé"] = labels[blocks]
+    df["Critical beds"] = asof_join(blocks, df["year"], beds_ids[known], critical_beds["year"].to_numpy()[known],
+                                    critical_beds["Critical beds"].to_numpy()[known])
+    return df
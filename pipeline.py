@@ -0,0 +1,297 @@
+"""Preprocessing pipeline producing the files read by the dashboard.
+
+Replaces ``notebooks/preprocessing.ipynb``. The work is split into explicit
+stages, each made of small tasks that read and write Parquet files under
+``preprocessed_data/pipeline``::
+
+    ingest -> clean -> aggregate -> rolling -> export
+
+Every task records a content hash of its inputs (and of its own code) in
+``preprocessed_data/pipeline/state.json`` and is skipped on the next run
+when neither has changed, so a new hospital drop only recomputes
+the saturation dataset. ``--append`` only folds the new days of a fresh
+``sp-dep-jour-*.csv`` drop into ``epidemic_state.csv``.
+
+Usage::
+
+    python pipeline.py                      # run every stage that is out of date
+    python pipeline.py --stage clean --stage aggregate
+    python pipeline.py --force              # ignore the recorded hashes
+    python pipeline.py --append             # only add the new days of the latest drop
+    python pipeline.py --publish            # then publish the shared data segment
+    python pipeline.py --warm               # then pre-render the cached figures
+"""
+import argparse
+import glob
+import hashlib
+import inspect
+import json
+import os
+import time
+from collections import namedtuple
+
+import pandas as pd
+
+from datastore import SURSAUD, build_store, raw_path, store_path
+from generations import new_generation, publish
+from joins import saturation_table
+from utils import (EPIDEMIC_STATE_PATH, SATURATION_PATH, add_weekly_averages, aggregate_epidemic_state,
+                   aggregate_sp_dep_jour_chunks, append_rolling_mean, clean_sp_dep_jour, read_sp_dep_jour_chunks,
+                   rolling_mean)
+
+STAGES = ["ingest", "clean", "aggregate", "rolling", "export"]
+WORK_DIR = "preprocessed_data/pipeline"
+STATE_PATH = os.path.join(WORK_DIR, "state.json")
+
+CRITICAL_BEDS_PATH = "raw_data/critical_beds_dep.csv"
+CRITICAL_BEDS_YEARS = ["2013", "2019", "2020", "2021", "2022"]
+
+SATURATION_COLUMNS = {
+    "SOS_med_call": "Share of SOS med calls for Covid",
+    "emergency_hospitals": "Share of hospital emergency visits for Covid",
+    "critical_care_beds": "Share of all critical care beds occupied by Covid patients",
+}
+
+Task = namedtuple("Task", ["name", "stage", "inputs", "outputs", "run"])
+
+
+def latest_drop(pattern):
+    """Most recent raw drop matching ``pattern``; drops are named by their date."""
+    paths = sorted(glob.glob(os.path.join("raw_data", pattern)))
+    if not paths:
+        raise FileNotFoundError(f"no raw_data/{pattern} file")
+    return paths[-1]
+
+
+def work_path(name):
+    return os.path.join(WORK_DIR, f"{name}.parquet")
+
+
+def file_hash(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def read_frame(path):
+    if path.endswith(".parquet"):
+        return pd.read_parquet(path)
+    return pd.read_csv(path)
+
+
+def write_frame(df, path):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = path + ".tmp"
+    if path.endswith(".parquet"):
+        df.to_parquet(tmp_path, index=False)
+    else:
+        df.to_csv(tmp_path, index=False)
+    os.replace(tmp_path, path)
+
+
+def publish_frame(df, path):
+    """Write a file read by the dashboard as its new generation (see generations.py)."""
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    generation = new_generation(path)
+    if path.endswith(".parquet"):
+        df.to_parquet(generation, index=False)
+    else:
+        df.to_csv(generation, index=False)
+    publish(generation, path)
+
+
+# Ingest: raw drops to typed columnar files, nothing else
+
+def ingest_sp_dep_jour(path):
+    return pd.read_csv(path, sep=";", dtype={"dep": str, "jour": str, "Ti": str, "Tp": str, "Td": str})
+
+
+def ingest_sursaud(path):
+    # The SurSaUD store already is the columnar copy of the raw file
+    build_store(SURSAUD)
+
+
+def ingest_hospit(path):
+    return pd.read_csv(path, sep=";", dtype={"dep": str}, usecols=["dep", "sexe", "jour", "hosp", "rea"])
+
+
+def ingest_critical_beds(path):
+    return pd.read_csv(path, sep=";", dtype=str, encoding="utf-8-sig")
+
+
+# Clean: types, codes and missing values
+
+def clean_critical_beds(path):
+    critical_beds = read_frame(path)
+    critical_beds = critical_beds.melt(id_vars=["Code", "Libellé"], value_vars=CRITICAL_BEDS_YEARS).rename(
+        columns={"Code": "dep", "variable": "year", "value": "Critical beds"})
+    critical_beds["year"] = critical_beds["year"].astype(int)
+    critical_beds["Critical beds"] = critical_beds["Critical beds"].str.replace(" ", "").astype(int)
+    critical_beds["dep"] = critical_beds["dep"].str.zfill(2)
+    return critical_beds
+
+
+def clean_hospit(path):
+    focus_hosp = read_frame(path).drop(columns=["sexe"])
+    focus_hosp["jour"] = pd.to_datetime(focus_hosp["jour"])
+    return focus_hosp.rename(columns={"jour": "date"})
+
+
+def clean_sursaud(path):
+    covid_data = pd.read_parquet(path).drop(columns=["sursaud_cl_age_corona"])
+    covid_data["dep"] = covid_data["dep"].str.zfill(2)
+    return covid_data.rename(columns={"date_de_passage": "date"})
+
+
+# Aggregate: group by department and day, merge the sources
+
+def aggregate_saturation(sursaud_path, hospit_path, beds_path):
+    # Joined on integer department and day keys, laid out by department (see joins.py)
+    return saturation_table(read_frame(sursaud_path), read_frame(hospit_path), read_frame(beds_path))
+
+
+# Rolling metrics
+
+def rolling_epidemic_state(path):
+    return add_weekly_averages(read_frame(path))
+
+
+def rolling_saturation(path):
+    df = read_frame(path)
+    # Proportion of emergency room visits for suspected COVID-19 compared with all emergency room visits,
+    # of SOS Medecins calls for COVID-19 and of intensive care beds occupied by COVID-19 patients.
+    df["emergency_hospitals"] = 100 * df["nbre_pass_corona"] / df["nbre_pass_tot"]
+    df["SOS_med_call"] = 100 * df["nbre_acte_corona"] / df["nbre_acte_tot"]
+    df["critical_care_beds"] = 100 * df["rea"] / df["Critical beds"]
+    # 7-day moving average per department, ignoring missing values
+    shares = list(SATURATION_COLUMNS)
+    df[shares] = rolling_mean(df, shares, by="dep", order="date", min_periods=1).values
+    return df.rename(columns=SATURATION_COLUMNS)
+
+
+# Export: the files read by the dashboard
+
+def tasks():
+    sp_dep_jour = latest_drop("sp-dep-jour-*.csv")
+    hospit = latest_drop("covid-hospit-*.csv")
+    return [
+        Task("ingest:sp_dep_jour", "ingest", [sp_dep_jour], [work_path("sp_dep_jour")], ingest_sp_dep_jour),
+        Task("ingest:sursaud", "ingest", [raw_path(SURSAUD)], [store_path(SURSAUD)], ingest_sursaud),
+        Task("ingest:hospit", "ingest", [hospit], [work_path("hospit")], ingest_hospit),
+        Task("ingest:critical_beds", "ingest", [CRITICAL_BEDS_PATH], [work_path("critical_beds")], ingest_critical_beds),
+
+        Task("clean:sp_dep_jour", "clean", [work_path("sp_dep_jour")], [work_path("sp_dep_jour_clean")],
+             lambda path: clean_sp_dep_jour(read_frame(path))),
+        Task("clean:sursaud", "clean", [store_path(SURSAUD)], [work_path("sursaud_clean")], clean_sursaud),
+        Task("clean:hospit", "clean", [work_path("hospit")], [work_path("hospit_clean")], clean_hospit),
+        Task("clean:critical_beds", "clean", [work_path("critical_beds")], [work_path("critical_beds_clean")], clean_critical_beds),
+
+        Task("aggregate:epidemic_state", "aggregate", [work_path("sp_dep_jour_clean")], [work_path("epidemic_state_daily")],
+             lambda path: aggregate_epidemic_state(read_frame(path))),
+        Task("aggregate:saturation", "aggregate",
+             [work_path("sursaud_clean"), work_path("hospit_clean"), work_path("critical_beds_clean")],
+             [work_path("saturation_daily")], aggregate_saturation),
+
+        Task("rolling:epidemic_state", "rolling", [work_path("epidemic_state_daily")], [work_path("epidemic_state")], rolling_epidemic_state),
+        Task("rolling:saturation", "rolling", [work_path("saturation_daily")], [work_path("saturation")], rolling_saturation),
+
+        Task("export:epidemic_state", "export", [work_path("epidemic_state")], [EPIDEMIC_STATE_PATH], read_frame),
+        Task("export:saturation", "export", [work_path("saturation")], [SATURATION_PATH], read_frame),
+    ]
+
+
+def load_state():
+    if not os.path.exists(STATE_PATH):
+        return {}
+    with open(STATE_PATH) as f:
+        return json.load(f)
+
+
+def save_state(state):
+    os.makedirs(WORK_DIR, exist_ok=True)
+    with open(STATE_PATH + ".tmp", "w") as f:
+        json.dump(state, f, indent=2, sort_keys=True)
+    os.replace(STATE_PATH + ".tmp", STATE_PATH)
+
+
+def inputs_hash(task):
+    digest = hashlib.sha256(task.name.encode())
+    # A change to the task's own code also makes it out of date
+    digest.update(inspect.getsource(task.run).encode())
+    for path in task.inputs:
+        digest.update(file_hash(path).encode())
+    return digest.hexdigest()
+
+
+def run(stages=None, force=False):
+    """Run the tasks of the given stages (all by default), skipping the up-to-date ones."""
+    state = load_state()
+    for task in tasks():
+        if stages is not None and task.stage not in stages:
+            continue
+        digest = inputs_hash(task)
+        if not force and state.get(task.name) == digest and all(os.path.exists(path) for path in task.outputs):
+            print(f"{task.name}: up to date")
+            continue
+
+        start = time.perf_counter()
+        result = task.run(*task.inputs)
+        if result is not None:
+            results = result if isinstance(result, tuple) else (result,)
+            # The exports are read by the app, possibly while they are rebuilt
+            write = publish_frame if task.stage == "export" else write_frame
+            for df, path in zip(results, task.outputs):
+                write(df, path)
+        state[task.name] = digest
+        save_state(state)
+        print(f"{task.name}: done in {time.perf_counter() - start:.1f}s")
+
+
+def append_epidemic_state(drop=None):
+    """Fold only the days of ``drop`` that are newer than ``epidemic_state.csv``.
+
+    The rolling ``P7``/``T7`` averages are only recomputed on the new tail,
+    from the last six known days.
+    """
+    drop = drop or latest_drop("sp-dep-jour-*.csv")
+    history = read_frame(EPIDEMIC_STATE_PATH)
+    history["date"] = pd.to_datetime(history["date"])
+    last_date = history["date"].max()
+
+    # The drop is streamed and only its new days are kept
+    chunks = (chunk[pd.to_datetime(chunk["jour"]) > last_date] for chunk in read_sp_dep_jour_chunks(drop))
+    new_days = aggregate_sp_dep_jour_chunks(chunk for chunk in chunks if not chunk.empty)
+    if new_days.empty:
+        print(f"{drop}: no day after {last_date:%Y-%m-%d}")
+        return history
+
+    new_days[["P7", "T7"]] = append_rolling_mean(history, new_days, ["P", "T"], order="date").values
+    df = pd.concat([history, new_days], ignore_index=True)
+    publish_frame(df, EPIDEMIC_STATE_PATH)
+    print(f"{drop}: added {len(new_days)} days up to {df['date'].max():%Y-%m-%d}")
+    return df
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--stage", action="append", choices=STAGES, help="only run this stage (repeatable)")
+    parser.add_argument("--force", action="store_true", help="rerun tasks even when their inputs are unchanged")
+    parser.add_argument("--append", nargs="?", const="", metavar="DROP",
+                        help="only add the new days of a sp-dep-jour drop (the latest one by default)")
+    parser.add_argument("--publish", action="store_true", help="publish the shared data segment afterwards (see segment.py)")
+    parser.add_argument("--warm", action="store_true", help="pre-render the cached figures afterwards (see figcache.py)")
+    args = parser.parse_args()
+
+    if args.append is not None:
+        append_epidemic_state(args.append or None)
+    else:
+        run(args.stage, args.force)
+    if args.publish:
+        import segment
+        from utils import SHARED_DATASETS
+        print(f"published {segment.publish(SHARED_DATASETS)}")
+    if args.warm:
+        import figcache
+        figcache.warm()
@@ -0,0 +1,220 @@
+"""Background refresh of the datasets when new raw data drops arrive.
+
+Updating the data used to mean running the pipeline by hand and restarting
+the app. With ``COVID_TRACKER_REFRESH_S`` set (a polling interval in
+seconds), the app instead starts a refresher thread that watches
+``raw_data/``: when a drop is added or replaced (``sp-dep-jour-*.csv``,
+``covid-hospit-*.csv``, the SurSaUD files...), it rebuilds the derived
+datasets off the request path, stale-while-revalidate:
+
+1. the registry is pinned (``registry.pin``) for the life of the process:
+   the requests keep the versions of the files they first saw, and never
+   rebuild or reload anything themselves;
+2. the refresher looks at the disk from a ``registry.fresh()`` view: it
+   runs the pipeline, rebuilds the SurSaUD stores and cubes as new
+   generations (``generations.py``), publishes a new data segment when one
+   is in use (``segment.py``), then loads the new datasets and renders the
+   default figures of each page;
+3. ``registry.advance()`` then moves every request to the new versions at
+   once; the datasets of the previous versions are dropped.
+
+The rebuilds of the processes sharing the data directory are serialized by
+a file lock: the other processes find the data up to date, and only load it
+and swap. A file changed by anything else (a manual ``pipeline.py`` run, a
+refresher in another process) is picked up on the next poll the same way.
+A failed refresh is logged and retried on the next poll, while the previous
+data keeps being served.
+
+The refresh runs, failures, duration and the staleness of the served data
+(seconds since the disk got ahead of it) are exported on ``/metrics``
+(``instrument.metrics``). The refresher also runs on its own, e.g. as the
+single process rebuilding the data of several app servers::
+
+    python refresher.py [--interval 60] [--once]
+"""
+import argparse
+import contextlib
+import logging
+import os
+import sys
+import threading
+import time
+
+import registry
+from datastore import RAW_DIR
+from instrument import metrics
+
+try:
+    import fcntl
+except ImportError:  # Windows: the rebuilds of several processes are not serialized
+    fcntl = None
+
+DEFAULT_INTERVAL_S = 60
+LOCK_PATH = "preprocessed_data/refresh.lock"
+
+logger = logging.getLogger("covid_tracker.refresher")
+
+
+def drops_signature(directory=RAW_DIR):
+    """(name, mtime_ns, size) of the raw files, sorted."""
+    try:
+        entries = [entry for entry in os.scandir(directory) if entry.is_file()]
+    except FileNotFoundError:
+        return ()
+    return tuple(sorted((entry.name, entry.stat().st_mtime_ns, entry.stat().st_size) for entry in entries))
+
+
+@contextlib.contextmanager
+def rebuild_lock():
+    """Held by one process at a time, across the processes sharing the data directory."""
+    os.makedirs(os.path.dirname(LOCK_PATH), exist_ok=True)
+    with open(LOCK_PATH, "a") as f:
+        if fcntl is not None:
+            fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            if fcntl is not None:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+
+def rebuild():
+    """Bring the derived datasets up to date with ``raw_data/``."""
+    import pipeline
+    import segment
+    from cube import build_cube, is_cube_stale
+    from datastore import SURSAUD, SURSAUD_2020, ensure_store, raw_path, store_path
+    from utils import SHARED_DATASETS
+
+    pipeline.run()
+    for name in [SURSAUD, SURSAUD_2020]:
+        if os.path.exists(raw_path(name)) or os.path.exists(store_path(name)):
+            ensure_store(name)
+            if is_cube_stale(name):
+                build_cube(name)
+    if segment.current_manifest() is not None and any(segment.locate(source)[1] is None for source in SHARED_DATASETS):
+        print(f"published {segment.publish(SHARED_DATASETS)}")
+
+
+def preload():
+    """Load the datasets and render the default figures of each page."""
+    from cube import load_cube
+    from datastore import SURSAUD, SURSAUD_2020, raw_path, store_path
+    from dimensions import WAVES
+    from utils import load_epidemic_series, load_saturation_series
+    from views import age_groups, department, overview, saturation
+
+    load_epidemic_series()
+    load_saturation_series()
+    for name in [SURSAUD, SURSAUD_2020]:
+        if os.path.exists(raw_path(name)) or os.path.exists(store_path(name)):
+            load_cube(name)
+    for builder in [overview.plot_daily_positive_cases, overview.plot_positive_cases_history, overview.plot_tested,
+                    overview.plot_positive_rate, overview.plot_incidence_rate]:
+        builder()
+    department.map_cov("France", max(WAVES))
+    department.plot_timeserie_with_animation("France")
+    saturation.plot_saturation("France")
+    if os.path.exists(raw_path(SURSAUD_2020)) or os.path.exists(store_path(SURSAUD_2020)):
+        age_groups.plot_age_group_history("France")
+        age_groups.plot_age_group_share_history("France")
+
+
+class Refresher:
+    """Polls ``raw_data/`` and refreshes the served data when it changed."""
+
+    def __init__(self, interval=DEFAULT_INTERVAL_S):
+        self.interval = interval
+        self.runs = 0
+        self.failures = 0
+        self.duration_s = None
+        self.refreshed_at = None
+        self._signature = None
+        self._behind_since = None
+        self._stop = threading.Event()
+
+    def staleness_s(self):
+        """Seconds since the disk got ahead of the served data, 0 when it is up to date."""
+        return 0.0 if self._behind_since is None else time.time() - self._behind_since
+
+    def publish_metrics(self):
+        metrics.set("covid_tracker_refresh_runs_total", lambda: self.runs, "Completed data refreshes.", "counter")
+        metrics.set("covid_tracker_refresh_failures_total", lambda: self.failures, "Failed data refreshes.", "counter")
+        metrics.set("covid_tracker_refresh_duration_seconds", lambda: self.duration_s,
+                    "Duration of the last data refresh (rebuild, load and swap).")
+        metrics.set("covid_tracker_refresh_timestamp_seconds", lambda: self.refreshed_at,
+                    "Unix time of the last data refresh.")
+        metrics.set("covid_tracker_data_staleness_seconds", self.staleness_s,
+                    "Seconds since the data on disk got ahead of the data served.")
+
+    def check(self):
+        """Refresh when a raw drop or a served file changed; return whether the data was swapped."""
+        signature = drops_signature()
+        with registry.fresh():
+            changed = signature != self._signature or registry.stale_keys()
+        if not changed:
+            return False
+        if self._behind_since is None:
+            self._behind_since = time.time()
+
+        started = time.perf_counter()
+        try:
+            with registry.fresh():
+                if signature != self._signature:
+                    with rebuild_lock():
+                        rebuild()
+                preload()
+        except Exception:
+            self.failures += 1
+            logger.exception("data refresh failed, the previous data is still served")
+            return False
+        registry.advance()
+        self._signature = signature
+        self._behind_since = None
+        self.runs += 1
+        self.duration_s = time.perf_counter() - started
+        self.refreshed_at = time.time()
+        logger.info("data refreshed in %.1f s", self.duration_s)
+        return True
+
+    def run(self):
+        """Check now, then every ``interval`` seconds until ``stop()``."""
+        while True:
+            self.check()
+            if self._stop.wait(self.interval):
+                return
+
+    def stop(self):
+        self._stop.set()
+
+
+_refresher_lock = threading.Lock()
+_refresher = None
+
+
+def start_in_background(interval=DEFAULT_INTERVAL_S):
+    """Pin the served data and start the refresher once per process, on a thread of its own."""
+    global _refresher
+    with _refresher_lock:
+        if _refresher is None:
+            registry.pin()
+            _refresher = Refresher(interval)
+            _refresher.publish_metrics()
+            threading.Thread(target=_refresher.run, name="refresher", daemon=True).start()
+    return _refresher
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--interval", type=float, default=float(os.environ.get("COVID_TRACKER_REFRESH_S", DEFAULT_INTERVAL_S)),
+                        help="seconds between two polls of raw_data/")
+    parser.add_argument("--once", action="store_true", help="refresh once and exit")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(message)s")
+    refresher = Refresher(args.interval)
+    if args.once:
+        refresher.check()
+    else:
+        refresher.run()
+    sys.exit(1 if refresher.failures else 0)
@@ -0,0 +1,329 @@
+"""Process-wide cache of the datasets read by the dashboard.
+
+Every Streamlit rerun used to re-parse the CSV / Parquet / GeoJSON files it
+needs. ``datasets.get(path, loader, ...)`` instead keeps the loaded frame in
+memory, keyed by the file path, its modification time and the loader
+arguments, so a file that changes on disk is transparently reloaded.
+
+The cache is bounded by ``COVID_TRACKER_CACHE_MB`` (512 MB by default) and
+evicts the least recently used datasets first.
+
+Cached values are shared by every caller, so they are frozen when stored
+(see ``freeze``): writing into their arrays raises, and so does modifying a
+parsed JSON dict or list. Frames and series are handed out as shallow
+copies: callers can still add, drop or replace columns of their own copy.
+
+The versions of the files come from ``file_version``. After ``pin()``, it
+keeps returning the version a file had when first looked at, so that a
+refresh rewriting the files on disk is not seen by the requests (they keep
+the datasets already loaded, and the figures and ETags keyed by
+``data_version``) until ``advance()`` moves them to the new versions at
+once. The background refresher (``refresher.py``) prepares those from a
+``fresh()`` view of the disk. The rebuilt files are published as
+generations behind symbolic links (``generations.py``): a file is pinned
+together with the generation it resolved to, ``served_path``, which the
+loaders read, so a dataset evicted while pinned is read again from the same
+generation.
+"""
+import contextlib
+import copy
+import hashlib
+import os
+import pickle
+import threading
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+
+from instrument import stage
+
+DEFAULT_MAX_BYTES = int(float(os.environ.get("COVID_TRACKER_CACHE_MB", 512)) * 1024 ** 2)
+
+# What the pinned view returned so far, by key: (value, how to compute it again)
+_pinned = None
+_local = threading.local()
+
+
+def pinned_value(key, compute):
+    """``compute()``, or while pinned, what it returned when first asked since the last swap."""
+    pinned = _pinned
+    if pinned is None or getattr(_local, "fresh", False):
+        return compute()
+    entry = pinned.get(key)
+    if entry is None:
+        entry = pinned.setdefault(key, (compute(), compute))
+    return entry[0]
+
+
+def _stat(path):
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return stat.st_mtime_ns, stat.st_size
+
+
+def _resolve(path):
+    # The path with its links resolved, so the version and the file read are those of one generation
+    real = os.path.realpath(path)
+    stat = _stat(real)
+    return None if stat is None else (real, stat)
+
+
+def served_file(path):
+    """(resolved path, (mtime_ns, size)) of ``path`` as served, None when it is missing."""
+    path = os.path.abspath(path)
+    key = ("file", path)
+    served = pinned_value(key, lambda: _resolve(path))
+    if served is None and is_pinned():
+        # A file missing so far (e.g. a cube built on first use) has no previous version to keep serving
+        served = _resolve(path)
+        if served is not None:
+            _pinned[key] = (served, lambda: _resolve(path))
+    return served
+
+
+def served_path(path):
+    """The file ``path`` resolves to as served: while pinned, the generation it first resolved to."""
+    served = served_file(path)
+    return path if served is None else served[0]
+
+
+def file_version(path):
+    """(mtime_ns, size) of ``path`` as served, None when it is missing."""
+    served = served_file(path)
+    return None if served is None else served[1]
+
+
+def pin():
+    """Serve the files in the version they have when first looked at (or once they exist), until ``advance()``."""
+    global _pinned
+    if _pinned is None:
+        _pinned = {}
+
+
+def is_pinned():
+    """Whether this thread sees the pinned versions rather than the disk."""
+    return _pinned is not None and not getattr(_local, "fresh", False)
+
+
+@contextlib.contextmanager
+def fresh():
+    """Look at the files as they are on disk in this block, even while pinned."""
+    previous = getattr(_local, "fresh", False)
+    _local.fresh = True
+    try:
+        yield
+    finally:
+        _local.fresh = previous
+
+
+def stale_keys():
+    """The pinned values that are no longer what the disk gives."""
+    pinned = _pinned or {}
+    return [key for key, (value, compute) in list(pinned.items()) if compute() != value]
+
+
+def advance():
+    """Move every request to the files as they are now, in one swap."""
+    global _pinned
+    if _pinned is not None:
+        _pinned = {}
+    datasets.drop_stale()
+
+
+def data_version(paths):
+    """Digest of the versions of files (missing ones included)."""
+    versions = [(os.path.abspath(path), served_file(path)) for path in paths]
+    return hashlib.sha1(repr(versions).encode()).hexdigest()[:16]
+
+
+def estimate_nbytes(value):
+    if isinstance(value, pd.DataFrame):
+        return int(value.memory_usage(deep=True).sum())
+    if isinstance(value, pd.Series):
+        return int(value.memory_usage(deep=True))
+    if hasattr(value, "nbytes"):
+        return int(value.nbytes)
+    # Plain Python objects (e.g. parsed GeoJSON): their pickled size is a fair estimate
+    return len(pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL))
+
+
+def _read_only(self, *args, **kwargs):
+    raise TypeError(f"cached {type(self).__name__} objects are read-only")
+
+
+class FrozenDict(dict):
+    """A dict that cannot be modified; copies of it are plain dicts."""
+
+    __setitem__ = __delitem__ = __ior__ = clear = pop = popitem = setdefault = update = _read_only
+
+    def __reduce__(self):
+        return dict, (dict(self),)
+
+    def __deepcopy__(self, memo):
+        return copy.deepcopy(dict(self), memo)
+
+
+class FrozenList(list):
+    """A list that cannot be modified; copies of it are plain lists."""
+
+    __setitem__ = __delitem__ = __iadd__ = __imul__ = _read_only
+    append = clear = extend = insert = pop = remove = reverse = sort = _read_only
+
+    def __reduce__(self):
+        return list, (list(self),)
+
+    def __deepcopy__(self, memo):
+        return copy.deepcopy(list(self), memo)
+
+
+def _freeze_array(array):
+    # Extension arrays (categoricals, datetimes, nullable types) keep their data in NumPy arrays.
+    # Object arrays stay writeable: some pandas routines cannot read them otherwise.
+    for data in (array, getattr(array, "_ndarray", None), getattr(array, "_data", None), getattr(array, "_mask", None)):
+        if isinstance(data, np.ndarray) and data.dtype != object:
+            data.flags.writeable = False
+
+
+def freeze(value):
+    """Make ``value`` read-only and return it.
+
+    The arrays of a DataFrame, Series or NumPy array are made read-only in
+    place, dicts and lists (parsed JSON) are returned as ``FrozenDict`` /
+    ``FrozenList`` and any other object is frozen by its own ``freeze()``
+    method, when it has one.
+    """
+    if isinstance(value, pd.DataFrame):
+        for array in value._mgr.arrays:
+            _freeze_array(array)
+    elif isinstance(value, pd.Series):
+        _freeze_array(value._values)
+    elif isinstance(value, np.ndarray):
+        value.flags.writeable = False
+    elif isinstance(value, dict):
+        return FrozenDict((key, freeze(item)) for key, item in value.items())
+    elif isinstance(value, list):
+        return FrozenList(freeze(item) for item in value)
+    elif hasattr(value, "freeze"):
+        value.freeze()
+    return value
+
+
+def read_only(value):
+    """A cached value as handed out: frames and series as shallow copies, the rest as is (frozen)."""
+    if isinstance(value, (pd.DataFrame, pd.Series)):
+        return value.copy(deep=False)
+    return value
+
+
+class DatasetRegistry:
+    """Thread-safe LRU cache of datasets keyed by (path, loader, args) and served file."""
+
+    def __init__(self, max_bytes=DEFAULT_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._key_locks = {}
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def _key(self, path, loader, args, kwargs):
+        name = f"{loader.__module__}.{loader.__qualname__}"
+        return (os.path.abspath(path), name, args, tuple(sorted(kwargs.items()))), served_file(path)
+
+    def get(self, path, loader, *args, **kwargs):
+        """Return ``loader(path, *args, **kwargs)``, loading it only on a miss.
+
+        The loader is given the served path (``served_path``), which it must
+        read rather than the files ``path`` links to now. Arguments must be
+        hashable. The value is frozen (see ``freeze``); a
+        returned DataFrame shares its data with the cached one but cannot
+        modify it.
+        """
+        key = self._key(path, loader, args, kwargs)
+        with self._lock:
+            entry = self._lookup(key)
+            if entry is not None:
+                return read_only(entry[0])
+            key_lock = self._key_locks.setdefault(key, threading.Lock())
+
+        # Only one thread loads a given dataset, the others wait for it
+        try:
+            with key_lock:
+                with self._lock:
+                    entry = self._lookup(key, count=False)
+                    if entry is not None:
+                        self.hits += 1
+                        return read_only(entry[0])
+                    self.misses += 1
+                served = key[1]
+                with stage(loader.__qualname__, "read"):
+                    value = freeze(loader(path if served is None else served[0], *args, **kwargs))
+                self._store(key, value)
+        finally:
+            with self._lock:
+                self._key_locks.pop(key, None)
+        return read_only(value)
+
+    def _lookup(self, key, count=True):
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        self._entries.move_to_end(key)
+        if count:
+            self.hits += 1
+        return entry
+
+    def _store(self, key, value):
+        nbytes = estimate_nbytes(value)
+        with self._lock:
+            if key in self._entries:
+                self._drop(key)
+            # The previous versions of the file are dropped, unless pinned requests still use them
+            if _pinned is None:
+                for old in [old for old in self._entries if old[0] == key[0]]:
+                    self._drop(old)
+                    self.invalidations += 1
+            if nbytes > self.max_bytes:
+                return
+            self._entries[key] = (value, nbytes)
+            self.nbytes += nbytes
+            while self.nbytes > self.max_bytes:
+                self._drop(next(iter(self._entries)))
+                self.evictions += 1
+
+    def _drop(self, key):
+        _, nbytes = self._entries.pop(key)
+        self.nbytes -= nbytes
+
+    def drop_stale(self):
+        """Drop the datasets loaded from another version of their file than the served one."""
+        with self._lock:
+            for key in [key for key in self._entries if key[1] != served_file(key[0][0])]:
+                self._drop(key)
+                self.invalidations += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.nbytes = 0
+
+    def stats(self):
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "nbytes": self.nbytes,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "invalidations": self.invalidations,
+            }
+
+
+datasets = DatasetRegistry()
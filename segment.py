@@ -0,0 +1,157 @@
+"""Memory-mapped data segment shared by the app processes.
+
+Several Streamlit servers behind a balancer each used to parse their own
+copy of the CSV datasets. ``publish`` writes those datasets once as a
+segment of fixed-dtype columns, one ``.npy`` file per column, that every
+process maps read-only: the pages are then shared by all the processes
+through the OS page cache instead of being copied in each of them::
+
+    preprocessed_data/segment/
+        current -> 1760781600123456789
+        1760781600123456789/
+            manifest.json
+            epidemic_state/0.npy, 1.npy, ...
+            covid19-saturation-dep/0.npy, ...
+
+Text columns are stored as categoricals: their codes are mapped, their
+categories kept in the manifest. ``read_frame`` builds a DataFrame over the
+mapped columns without copying them (one block per column).
+
+A new version is written next to the previous ones and the ``current``
+link is swapped atomically, so running processes move to it on their next
+load, without a restart; the processes still reading an older version keep
+their mapping. The manifest records the version of each source file: a file
+changed since the last publication is read directly until it is published
+again. Publish with ``python segment.py`` or ``python pipeline.py --publish``
+(the background refresher of ``refresher.py`` publishes after each rebuild).
+While the registry is pinned (``registry.pin``), ``current`` is followed as it
+was when first read, like the files (``registry.served_path``).
+
+The SurSaUD data is already memory-mapped through its cube (``cube.py``).
+"""
+import json
+import os
+import shutil
+import time
+
+import numpy as np
+import pandas as pd
+
+from registry import file_version as served_version, served_path
+
+SEGMENT_DIR = "preprocessed_data/segment"
+SEGMENT_PATH = os.path.join(SEGMENT_DIR, "current")
+# Versions kept on disk, for the processes still mapping the previous ones
+KEEP_VERSIONS = 3
+
+_manifests = {}
+
+
+def file_version(path):
+    stat = os.stat(path)
+    return [stat.st_mtime_ns, stat.st_size]
+
+
+def _write_column(path, values):
+    """Write a column as a fixed-dtype array; return its manifest entry."""
+    column = {}
+    if isinstance(values.dtype, pd.CategoricalDtype) or values.dtype == object:
+        categorical = pd.Categorical(values)
+        column["categories"] = categorical.categories.tolist()
+        values = categorical.codes
+    np.save(path, np.ascontiguousarray(values))
+    return column
+
+
+def publish(readers):
+    """Write a new segment version from ``readers`` ({source path: reader}) and make it current.
+
+    Each reader returns the frame of its source file, in the row order the
+    loaders expect.
+    """
+    version = str(time.time_ns())
+    directory = os.path.join(SEGMENT_DIR, version)
+    manifest = {"created": time.strftime("%Y-%m-%dT%H:%M:%S"), "datasets": {}}
+    for source, reader in readers.items():
+        # The generation the source links to (see generations.py): its version is that of what is read
+        generation = os.path.realpath(source)
+        source_version = file_version(generation)
+        df = reader(generation)
+        name = os.path.splitext(os.path.basename(source))[0]
+        os.makedirs(os.path.join(directory, name))
+        columns = []
+        for i, column in enumerate(df.columns):
+            entry = _write_column(os.path.join(directory, name, f"{i}.npy"), df[column])
+            columns.append({"name": column, "file": f"{name}/{i}.npy", **entry})
+        manifest["datasets"][source] = {"version": source_version, "rows": len(df), "columns": columns}
+    with open(os.path.join(directory, "manifest.json"), "w") as f:
+        json.dump(manifest, f, ensure_ascii=False)
+
+    link = SEGMENT_PATH + ".tmp"
+    if os.path.lexists(link):
+        os.remove(link)
+    os.symlink(version, link)
+    os.replace(link, SEGMENT_PATH)
+    for old in sorted(name for name in os.listdir(SEGMENT_DIR) if name.isdigit())[:-KEEP_VERSIONS]:
+        shutil.rmtree(os.path.join(SEGMENT_DIR, old), ignore_errors=True)
+    return directory
+
+
+def _manifest(directory):
+    manifest = _manifests.get(directory)
+    if manifest is None:
+        with open(os.path.join(directory, "manifest.json")) as f:
+            manifest = _manifests[directory] = json.load(f)
+    return manifest
+
+
+def current_version(segment_path=SEGMENT_PATH):
+    """The version ``current`` links to (as served), None when nothing is published."""
+    if served_version(segment_path) is None:
+        return None
+    return os.path.basename(served_path(segment_path))
+
+
+def current_manifest():
+    """Manifest of the current segment version, None when nothing is published."""
+    version = current_version()
+    if version is None:
+        return None
+    return _manifest(os.path.join(SEGMENT_DIR, version))
+
+
+def locate(source):
+    """(path, source) to load ``source`` from: the segment when it holds this version of the file.
+
+    Returns ``(SEGMENT_PATH, source)`` when the current segment was published
+    from the file as it is on disk (or the file is gone), ``(source, None)``
+    otherwise.
+    """
+    manifest = current_manifest()
+    entry = manifest["datasets"].get(source) if manifest is not None else None
+    version = served_version(source)
+    if entry is not None and (version is None or entry["version"] == list(version)):
+        return SEGMENT_PATH, source
+    return source, None
+
+
+def read_frame(segment_path, source):
+    """The frame of ``source`` in the segment, over its read-only mapped columns.
+
+    ``segment_path`` is ``current``, or the version directory it was resolved to.
+    """
+    directory = os.path.realpath(segment_path)
+    columns = {}
+    for column in _manifest(directory)["datasets"][source]["columns"]:
+        values = np.load(os.path.join(directory, column["file"]), mmap_mode="r")
+        if "categories" in column:
+            values = pd.Categorical.from_codes(values, categories=column["categories"])
+        columns[column["name"]] = values
+    # Without copy=False, the columns would be copied into consolidated blocks
+    return pd.DataFrame(columns, copy=False)
+
+
+if __name__ == "__main__":
+    from utils import SHARED_DATASETS
+
+    print(f"published {publish(SHARED_DATASETS)}")
@@ -1,16 +1,64 @@
 import streamlit as st
-from utils import *
 import pandas as pd
 import numpy as np
 from datetime import datetime, timedelta
-import pandas as pd
+import os
 import warnings
 warnings.filterwarnings("ignore")
 
+# The data and figure modules are imported by the page that needs them, so a
+# cold start only pays for the page being shown.
 
 st.set_page_config(layout="wide")
 
+# The local API (api.py) answers from the datasets this process has loaded
+if os.environ.get("COVID_TRACKER_API_PORT"):
+    import api
+    api.serve_in_background(int(os.environ["COVID_TRACKER_API_PORT"]))
+
+# New raw data drops are rebuilt and swapped in by a background thread (refresher.py)
+if os.environ.get("COVID_TRACKER_REFRESH_S"):
+    import refresher
+    refresher.start_in_background(float(os.environ["COVID_TRACKER_REFRESH_S"]))
+
+
+
+
+@st.experimental_fragment
+def overview_window(series):
+    """Window slider and the two charts that follow it.
+
+    Moving the slider only reruns this fragment, not the whole page.
+    """
+    from views.overview import plot_positive_cases, plot_positive_cases_with_zoom
+
+    # The bounds follow the dates of the served series
+    min_value = pd.Timestamp(series.dates[0]).to_pydatetime()
+    max_value = max(pd.Timestamp(series.dates[-1]).to_pydatetime() - timedelta(days=30*9), min_value)
+    start_value = max_value
+
+    # Create a slider for date selection
+    selected_date = st.slider(
+    "Move the sliding window:",
+    min_value=min_value,
+    max_value=max_value,
+    value=start_value,
+    format="YYYY-MM-DD"
+    )
+    end_object = datetime.strptime(str(selected_date), '%Y-%m-%d %H:%M:%S')
+
+    start_date = str(pd.Timestamp(end_object.date()) )
+
+    end_date =  str(pd.to_datetime(start_date)+ pd.DateOffset(months=9))
+
+    col1, col2  = st.columns(2)
+    with col1:
+        st.plotly_chart(plot_positive_cases_with_zoom(start_date, end_date), use_container_width=True)
+        st.write('Move or resize the period you wish to inspect ')
 
+    with col2:
+        # The whole series, shown over the window: it can be panned and zoomed without a rerun
+        st.plotly_chart(plot_positive_cases(start_date, end_date), use_container_width=True)
 
 
 def Overview_page():
@@ -21,16 +69,19 @@ def Overview_page():
 
 
 
+    from utils import load_epidemic_series, weekly_indicators
+    from views.overview import plot_incidence_rate, plot_positive_rate, plot_tested
+
     st.header('State of the epidemic in France')
 
-    df = pd.read_csv('./preprocessed_data/epidemic_state.csv')
-    df['date'] = pd.to_datetime(df['date'])
+    series = load_epidemic_series()
+    df = series.frame
 
-    st.write(f'As of May 31, 2023, the total number of infections detected since the start of the epidemic has reached {"{:,}".format(np.sum(df["P"]))} cases')
+    today = pd.Timestamp(series.dates[-1])
+    st.write(f'As of {today.strftime("%B %d, %Y")}, the total number of infections detected since the start of the epidemic has reached {"{:,}".format(np.sum(df["P"]))} cases')
 
     # Global figures
     col = st.columns((1.5, 1.5, 1.5), gap="medium")
-    today = df["date"].max()
     st.markdown(
         """
     <style>
@@ -46,20 +97,21 @@ def Overview_page():
     with col[0]:
         with st.container():
             st.subheader("Total number of Covid cases last week")
-            df_week = df[df["date"] > today - timedelta(days=7)]
-            st.markdown(f"""<p class="big-font">{np.sum(df_week['P'])}</p>""", unsafe_allow_html=True)
+            # Prefix sums over the sorted dates: each weekly total is two lookups
+            indicators = weekly_indicators(series, today)
+            week_cases = indicators["cases"]
+            st.markdown(f"""<p class="big-font">{week_cases}</p>""", unsafe_allow_html=True)
 
     with col[1]:
         with st.container():
             st.subheader("Percentage of cases among last week's tests")
-            percentage_positive = np.sum(df_week["P"])/np.sum(df_week['T']) * 100
+            percentage_positive = indicators["positive_rate"]
             st.markdown(f"""<p class="big-font" ">{percentage_positive:.2f} %</p>""", unsafe_allow_html=True)
 
     with col[2]:
         with st.container():
             st.subheader("Evolution of Covid cases")
-            df_previous_week = df[(df["date"] > today - timedelta(days=14)) & (df["date"] < today - timedelta(days=7))]
-            evolution = (np.sum(df_week["P"]) - np.sum(df_previous_week["P"]))/np.sum(df_week["P"]) * 100
+            evolution = indicators["evolution"]
             if evolution > 0:
                 st.markdown(
                     f"""<p class="big-font" style="color: #ff0000;">{evolution:.2f} %</p>""",
@@ -72,43 +124,14 @@ def Overview_page():
                 )
 
 
-    end_date = max(df['date'])
-    # Add 9 months to the start date
-    start_date =  pd.to_datetime(end_date) - pd.DateOffset(months=9)
-
-
-    min_value = datetime(2020, 5, 13)
-    max_value = datetime(2023, 6, 23) - timedelta(days=30*9)
-    start_value = datetime(2023, 6, 23) - timedelta(days=30*9)
-
     st.subheader("Epidemic evolution in terms of number of cases")
     st.write('Number of Covid-19 cases reported at the time of testing in hospitals and Ehpad.')
 
-    # Create a slider for date selection
-    selected_date = st.slider(
-    "Move the sliding window:",
-    min_value=min_value,
-    max_value=max_value,
-    value=start_value,
-    format="YYYY-MM-DD"
-    )
-    end_object = datetime.strptime(str(selected_date), '%Y-%m-%d %H:%M:%S')
-
-    start_date = str(pd.Timestamp(end_object.date()) )
-
-    end_date =  str(pd.to_datetime(start_date)+ pd.DateOffset(months=9))
-
-    col1, col2  = st.columns(2)
-    with col1:
-        st.plotly_chart(plot_positive_cases_with_zoom(df,  start_date, end_date), use_container_width=True)
-        st.write('Move or resize the period you wish to inspect ')
-
-    with col2:
-        st.plotly_chart(plot_positive_cases(df, start_date, end_date), use_container_width=True)
+    overview_window(series)
 
 
     st.subheader("National dynamics of the epidemic")
-    st.write('These graphs show the average weekly incidence rate (per 100,000 inhabitants, i.e. ), the number of tests and their positivity rate on May 31, 2023.')
+    st.write(f'These graphs show the average weekly incidence rate (per 100,000 inhabitants, i.e. ), the number of tests and their positivity rate on {today.strftime("%B %d, %Y")}.')
     col1, col2, col3 = st.columns(3)
 
     with col1:
@@ -117,7 +140,7 @@ def Overview_page():
                     f"""<h4 style="color: #7f7f7f;">{df.iloc[-1]['Ti']:.0f} ‰ on {today.strftime("%A, %B %d, %Y")}</h4>""",
                     unsafe_allow_html=True,
                 )
-        st.plotly_chart(plot_incidence_rate(df), use_container_width=True)
+        st.plotly_chart(plot_incidence_rate(), use_container_width=True)
 
     with col2:
         st.subheader("People tested")
@@ -125,7 +148,7 @@ def Overview_page():
                     f"""<h4 style="color: #4c7aaf;">{df.iloc[-1]['T']//1000}k on {today.strftime("%A, %B %d, %Y")}</h4>""",
                     unsafe_allow_html=True,
                 )
-        st.plotly_chart(plot_tested(df), use_container_width=True)
+        st.plotly_chart(plot_tested(), use_container_width=True)
 
     with col3:
         st.subheader("Positive Rate")
@@ -133,7 +156,7 @@ def Overview_page():
                     f"""<h4 style="color: #886688;">{df.iloc[-1]['Tp']:.1f} % on {today.strftime("%A, %B %d, %Y")}</h4>""",
                     unsafe_allow_html=True,
                 )
-        st.plotly_chart(plot_positive_rate(df), use_container_width=True)
+        st.plotly_chart(plot_positive_rate(), use_container_width=True)
 
 def DepartmentPage():
     """
@@ -142,6 +165,9 @@ def DepartmentPage():
     elements for users to select a department and a wave of the epidemic, 
     and displays corresponding visual data.
     """
+    from dimensions import WAVES
+    from views.department import map_cov, plot_timeserie_with_animation, unique_departments
+
     # Begin by defining the departments dropdown, including a default 'France' option
     departments = ['France'] + list(unique_departments())
     
@@ -164,7 +190,7 @@ def DepartmentPage():
     
     with col_wave:
         # Epidemic wave selection dropdown
-        wave = st.selectbox("Select an Epidemic Wave:", [1, 2, 3], index=2)
+        wave = st.selectbox("Select an Epidemic Wave:", list(WAVES), index=len(WAVES) - 1)
     
     # MAP VISUALIZATION
     st.write("""
@@ -201,21 +227,25 @@ def AgeGroupsPage():
     st.title('Repartition of COVID-19 per age group in France')
     st.write('This section displays the evolution of COVID-19 hospitalizations in France by age group.')
 
-    # Load the data
-    path = "./raw_data/sursaud-covid19-departement_2020.csv"
-    df = pd.read_csv(path, sep=";")
+    from ageshares import age_departments, load_age_shares
+    from views.age_groups import plot_age_group_px, plot_age_group_share
 
     columns = st.columns((4, 1), gap="large")
 
     with columns[0]:
+        # Drill down to a department, at the same cost: its shares are precomputed the same way
+        selected_department = st.selectbox('Select a Department:', ['France'] + list(age_departments()))
+        shares = load_age_shares(selected_department)
+
         st.subheader('Evolution of COVID hospitalizations by age group over time')
         st.write("You can select a date range to zoom in the chart below. An overview of the share of each age group over this period will be displayed on the right.")
         # Add a transparent box to chart_evol to select a date range
-        date_range = st.select_slider('Select a date range:', df['date_de_passage'].unique(), (df['date_de_passage'].min(), df['date_de_passage'].max()))
+        dates = shares.dates.astype(str).tolist()
+        date_range = st.select_slider('Select a date range:', dates, (dates[0], dates[-1]))
         date_start, date_end = date_range[0], date_range[1]
 
         # Plot the evolution of hospitalizations by age group
-        chart_evol, df_chart = plot_age_group_px(df, date_end=date_end, date_start=date_start)
+        chart_evol = plot_age_group_px(selected_department, date_end=date_end, date_start=date_start)
         st.plotly_chart(chart_evol)
 
     with columns[1]:
@@ -226,8 +256,10 @@ def AgeGroupsPage():
         st.write("")
         st.write("")
         # Plot the share of each age group in hospitalizations over time
-        chart_prop = plot_age_group_share(df_chart, date_start, date_end)
+        chart_prop = plot_age_group_share(selected_department, date_start, date_end)
         st.plotly_chart(chart_prop)
+        # And over the selected period as a whole, from the running totals
+        st.dataframe(shares.window_shares(date_start, date_end).round(1).rename("%"))
 
 
 
@@ -237,11 +269,14 @@ def SaturationPage():
     elements for users to select a department, 
     and displays corresponding visual data.
     """
+    from utils import load_saturation_series
+    from views.saturation import plot_saturation
+
     # Data loading
-    df = pd.read_csv('./preprocessed_data/covid19-saturation-dep.csv')
+    saturation = load_saturation_series()
 
     # Begin by defining the departments dropdown, including a default 'France' option
-    departments = ["France"] + df["Libellé"].unique().tolist()
+    departments = ["France"] + saturation.keys()
     
     # Display a section header and an introductory message
     st.subheader("Health System Saturation by Department")
@@ -266,7 +301,7 @@ def SaturationPage():
     """)
 
     # Generate and display the chart
-    line_chart = plot_saturation(df, selected_department)
+    line_chart = plot_saturation(selected_department)
     st.plotly_chart(line_chart, use_container_width=True)
 
 
@@ -279,4 +314,14 @@ PAGES = {
 }
 
 demo_name = st.sidebar.selectbox("Choose a page", PAGES.keys())
-PAGES[demo_name]()
\ No newline at end of file
+# Hidden breakdown of the render by stage (loaders, computations, figures), shown with
+# ?debug=1, or ?debug=memory to also trace the allocations (much slower)
+if st.query_params.get("debug") in ("1", "memory"):
+    from instrument import records_frame, stage, trace
+    with trace(memory=st.query_params["debug"] == "memory") as records:
+        with stage(demo_name, "page"):
+            PAGES[demo_name]()
+    with st.sidebar.expander("Render stages", expanded=True):
+        st.dataframe(records_frame(records), hide_index=True)
+else:
+    PAGES[demo_name]()
\ No newline at end of file
@@ -0,0 +1,49 @@
+"""The animated department figure grows linearly with the number of days."""
+import json
+
+import numpy as np
+import pytest
+from plotly.utils import PlotlyJSONEncoder
+
+import utils
+from cube import SursaudCube
+from views import department
+
+MEASURES = ["nbre_pass_corona", "nbre_pass_tot"]
+DAYS = 200
+
+
+def synthetic_cube(n_days, seed=0):
+    rng = np.random.default_rng(seed)
+    values = rng.uniform(1, 100, (len(MEASURES), 2, n_days, 2)).astype(np.float32)
+    # Ten times more visits than Covid visits
+    values[1] *= 10
+    present = np.ones((2, n_days), dtype=bool)
+    return SursaudCube(values, present, ["01", "13"], "2021-01-01", ["0", "A"], MEASURES)
+
+
+def json_size(value):
+    return len(json.dumps(value, cls=PlotlyJSONEncoder))
+
+
+def figure_sizes(monkeypatch, n_days):
+    """Size of the figure and of its frames, in JSON, over ``n_days`` days."""
+    monkeypatch.setattr(utils, "load_cube", lambda name=None: synthetic_cube(n_days))
+    fig = department.plot_timeserie_with_animation.uncached("13")
+    return json_size(fig.to_plotly_json()), json_size([frame.to_plotly_json() for frame in fig.frames])
+
+
+def test_frames_only_update_the_gauge(monkeypatch):
+    monkeypatch.setattr(utils, "load_cube", lambda name=None: synthetic_cube(DAYS))
+    dep_df = utils.department_series("13")
+    frames = department.indicator_frames(dep_df, dep_df["nbre_pass_corona"].max())
+    assert len(frames) == DAYS
+    assert all(frame["traces"] == [1] and len(frame["data"]) == 1 for frame in frames)
+
+
+def test_payload_grows_linearly(monkeypatch):
+    figure, frames = figure_sizes(monkeypatch, DAYS)
+    double_figure, double_frames = figure_sizes(monkeypatch, 2 * DAYS)
+    # Repeating the series in every frame would make them about 4 times larger
+    assert double_frames / frames == pytest.approx(2, rel=0.05)
+    assert double_figure / figure < 2.1
@@ -0,0 +1,142 @@
+"""The compact figure encoding (figencode.py) decodes back to the figures.
+
+The encoded specs are decoded here the way plotly.js reads them, without
+``figencode.rendered``: ``x0``/``dx`` steps are expanded into the explicit
+arrays, typed arrays are read back and frames are merged with their
+``baseframe``. The result must be the figure's own ``to_dict()``.
+"""
+import base64
+import datetime
+import json
+import math
+import os
+import re
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from benchmarks import synthetic
+from figencode import encode
+
+DATE = re.compile(r"\d{4}-\d{2}-\d{2}(?:[ T]\d{2}:\d{2}(?::\d{2}(?:\.\d+)?)?)?")
+# Layout arrays whose items plotly.js merges one by one into those of the base frame
+ITEM_CONTAINERS = ("annotations", "images", "shapes", "sliders", "updatemenus")
+
+
+@pytest.fixture(scope="module")
+def tree(tmp_path_factory):
+    root = synthetic.prepare(str(tmp_path_factory.mktemp("tree")), n_departments=12, n_days=120)
+    cwd = os.getcwd()
+    os.chdir(root)
+    yield root
+    os.chdir(cwd)
+
+
+def figure(name):
+    from views import department, overview, saturation
+
+    builders = {
+        "overview": lambda: overview.plot_positive_cases_history.uncached(),
+        "department": lambda: department.plot_timeserie_with_animation.uncached("France"),
+        "saturation": lambda: saturation.plot_saturation.uncached("France"),
+    }
+    return builders[name]()
+
+
+def expand_steps(trace):
+    for letter, other in (("x", "y"), ("y", "x")):
+        if letter + "0" in trace and letter not in trace and other in trace:
+            start = pd.Timestamp(trace.pop(letter + "0"))
+            step = pd.Timedelta(milliseconds=trace.pop("d" + letter))
+            trace[letter] = [start + i * step for i in range(len(trace[other]))]
+    return trace
+
+
+def read_typed_arrays(value):
+    if isinstance(value, dict):
+        if set(value) == {"dtype", "bdata"}:
+            return np.frombuffer(base64.b64decode(value["bdata"]), dtype="<" + value["dtype"]).tolist()
+        return {key: read_typed_arrays(item) for key, item in value.items()}
+    if isinstance(value, list):
+        return [read_typed_arrays(item) for item in value]
+    return value
+
+
+def merged(base, update):
+    result = dict(base)
+    for key, value in update.items():
+        old = result.get(key)
+        if isinstance(value, dict) and isinstance(old, dict):
+            result[key] = merged(old, value)
+        elif key in ITEM_CONTAINERS and isinstance(value, list) and isinstance(old, list):
+            items = list(old)
+            for i, item in enumerate(value):
+                if i < len(items) and isinstance(items[i], dict) and isinstance(item, dict):
+                    items[i] = merged(items[i], item)
+                elif i < len(items):
+                    items[i] = item
+                else:
+                    items.append(item)
+            result[key] = items
+        else:
+            result[key] = value
+    return result
+
+
+def resolve_frame(frame, frames):
+    """``frame`` merged with its base frame, if any, as plotly.js animates it."""
+    if "baseframe" not in frame:
+        return frame
+    base = resolve_frame(frames[frame["baseframe"]], frames)
+    base_data = dict(zip(base.get("traces", range(len(base.get("data", [])))), base.get("data", [])))
+    traces = frame.get("traces", list(range(len(frame.get("data", [])))))
+    resolved = {key: value for key, value in base.items() if key not in ("data", "layout")}
+    resolved.update({key: value for key, value in frame.items() if key not in ("data", "layout", "baseframe")})
+    resolved["data"] = [merged(base_data.get(index, {}), trace) for index, trace in zip(traces, frame.get("data", []))]
+    resolved["layout"] = merged(base.get("layout", {}), frame.get("layout", {}))
+    return resolved
+
+
+def decode(spec_json):
+    spec = read_typed_arrays(json.loads(spec_json))
+    spec["data"] = [expand_steps(trace) for trace in spec["data"]]
+    frames = {frame["name"]: frame for frame in spec.get("frames", [])}
+    spec["frames"] = [resolve_frame(frame, frames) for frame in spec.get("frames", [])]
+    return spec
+
+
+def normalized(value):
+    """Dates as Timestamps, numbers as floats and NaN as None, arrays as lists."""
+    if isinstance(value, dict):
+        return {key: normalized(item) for key, item in value.items()}
+    if isinstance(value, (list, tuple, np.ndarray)):
+        return [normalized(item) for item in value]
+    if isinstance(value, (np.datetime64, datetime.date)) or isinstance(value, str) and DATE.fullmatch(value):
+        return pd.Timestamp(value)
+    if isinstance(value, (bool, np.bool_)):
+        return bool(value)
+    if isinstance(value, (int, float, np.integer, np.floating)):
+        return None if math.isnan(value) else float(value)
+    return value
+
+
+@pytest.mark.parametrize("binary", [False, True])
+@pytest.mark.parametrize("name", ["overview", "department", "saturation"])
+def test_encoding_decodes_to_the_figure(tree, name, binary):
+    fig = figure(name)
+    encoded = encode(fig.to_json(), binary=binary)
+    expected = fig.to_dict()
+    if not expected.get("frames"):
+        expected.pop("frames", None)
+    decoded = decode(encoded)
+    if not decoded["frames"]:
+        decoded.pop("frames")
+    assert normalized(decoded) == normalized(expected)
+
+
+def test_encoding_uses_steps_and_base_frames(tree):
+    overview = json.loads(encode(figure("overview").to_json()))
+    assert any("x0" in trace and "x" not in trace for trace in overview["data"])
+    department = json.loads(encode(figure("department").to_json()))
+    assert all(frame.get("baseframe") == department["frames"][0]["name"] for frame in department["frames"][1:])
@@ -0,0 +1,27 @@
+"""Every page of the app imports within the startup budget (see benchmarks/startup.py)."""
+import pytest
+
+from benchmarks import startup
+
+PAGES = startup.page_imports()
+
+
+def test_page_imports_are_read_from_the_app():
+    assert list(PAGES) == ["Overview", "Covid by Departement", "Age groups repartition", "Health System Saturation"]
+    assert "views.overview" in PAGES["Overview"]
+    assert "views.department" in PAGES["Covid by Departement"]
+    assert "views.age_groups" in PAGES["Age groups repartition"]
+    assert "views.saturation" in PAGES["Health System Saturation"]
+
+
+@pytest.mark.parametrize("page", list(PAGES))
+def test_page_imports_within_budget(page):
+    # Noise only adds time: the best of a few fresh interpreters is compared
+    timings = []
+    for _ in range(3):
+        seconds, forbidden, _ = startup.run_imports(PAGES[page])
+        assert not forbidden, f"{page} imports {', '.join(forbidden)}"
+        timings.append(seconds * 1000)
+        if min(timings) <= startup.DEFAULT_BUDGET_MS:
+            break
+    assert min(timings) <= startup.DEFAULT_BUDGET_MS
@@ -0,0 +1,163 @@
+"""Date-indexed frames with binary-search window queries.
+
+Filtering a frame on a date window with a boolean mask scans every row and
+copies the matching ones. ``TimeSeries`` keeps the frame sorted by a
+datetime64 column instead: a window is two ``searchsorted`` calls and a
+zero-copy row slice, and the sum of a column over any window is the
+difference of two prefix sums.
+"""
+import numpy as np
+import pandas as pd
+
+from downsample import MAX_POINTS, Pyramid
+from registry import freeze
+
+# searchsorted side used for the start and the end of a window, as in Series.between
+INCLUSIVE_SIDES = {
+    "left": ("left", "left"),
+    "right": ("right", "right"),
+    "both": ("left", "right"),
+    "neither": ("right", "left"),
+}
+
+
+def to_datetime64(value, unit="ns"):
+    if isinstance(value, str):
+        # Timestamp rejects numpy.str_, e.g. an item of an array of dates
+        value = str(value)
+    return np.datetime64(pd.Timestamp(value), unit)
+
+
+class TimeSeries:
+    """A frame sorted by ``date_column``, optionally grouped by ``by``.
+
+    A grouped series is sorted by group (in order of first appearance) then by
+    date; select one group with ``group`` before querying windows.
+    """
+
+    def __init__(self, df, date_column="date", by=None):
+        dates = df[date_column]
+        if dates.dtype != "datetime64[ns]":
+            dates = pd.to_datetime(dates)
+            df = df.assign(**{date_column: dates})
+        self.groups = None
+        if by is None:
+            if not dates.is_monotonic_increasing:
+                df = df.sort_values(date_column, kind="stable")
+        else:
+            codes, keys = pd.factorize(df[by], sort=False)
+            values = dates.to_numpy()
+            # A frame already laid out by group then date (see joins.py) is taken as it is
+            same = codes[1:] == codes[:-1]
+            if not ((codes[1:] >= codes[:-1]).all() and (values[1:][same] >= values[:-1][same]).all()):
+                order = np.lexsort((values, codes))
+                df = df.iloc[order]
+                codes = codes[order]
+            offsets = np.searchsorted(codes, np.arange(len(keys) + 1))
+            self.groups = {key: (offsets[i], offsets[i + 1]) for i, key in enumerate(keys)}
+        self.date_column = date_column
+        self._frame = df
+        self._dates = df[date_column].to_numpy()
+        self._prefix = {}
+        self._pyramids = {}
+        self._lo, self._hi = 0, len(df)
+
+    def _view(self, lo, hi):
+        view = object.__new__(TimeSeries)
+        view.__dict__.update(self.__dict__)
+        view.groups = None
+        view._lo, view._hi = lo, hi
+        return view
+
+    def __len__(self):
+        return self._hi - self._lo
+
+    @property
+    def nbytes(self):
+        return int(self._frame.memory_usage(deep=True).sum())
+
+    def freeze(self):
+        """Make the rows read-only, as the registry does with the values it caches."""
+        freeze(self._frame)
+        freeze(self._dates)
+
+    @property
+    def frame(self):
+        """The rows of the series, as a DataFrame sharing its data (read-only when cached)."""
+        # A shallow copy rather than the slice itself, which pandas would warn about adding columns to
+        return self._frame.iloc[self._lo:self._hi].copy(deep=False)
+
+    @property
+    def dates(self):
+        return self._dates[self._lo:self._hi]
+
+    def column(self, name):
+        return self._frame[name].to_numpy()[self._lo:self._hi]
+
+    def keys(self):
+        return list(self.groups)
+
+    def group(self, key):
+        """The series of one group."""
+        return self._view(*self.groups[key])
+
+    def bounds(self, start=None, end=None, inclusive="left"):
+        """Row positions of the dates between ``start`` and ``end``.
+
+        ``inclusive`` tells which bounds belong to the window, as in
+        ``Series.between``; the default is ``[start, end)``.
+        """
+        if self.groups is not None:
+            raise ValueError("select a group before querying a grouped series")
+        start_side, end_side = INCLUSIVE_SIDES[inclusive]
+        dates = self.dates
+        lo = 0 if start is None else np.searchsorted(dates, to_datetime64(start), side=start_side)
+        hi = len(dates) if end is None else np.searchsorted(dates, to_datetime64(end), side=end_side)
+        return self._lo + lo, self._lo + max(lo, hi)
+
+    def window(self, start=None, end=None, inclusive="left"):
+        """The rows between ``start`` and ``end``, without copying them."""
+        return self._view(*self.bounds(start, end, inclusive))
+
+    def _prefix_sums(self, name):
+        prefix = self._prefix.get(name)
+        if prefix is None:
+            values = self._frame[name].to_numpy()
+            if values.dtype.kind == "f":
+                # Missing values are skipped, as Series.sum does
+                values = np.nan_to_num(values)
+            prefix = np.zeros(len(values) + 1, dtype=np.result_type(values.dtype, np.int64))
+            np.cumsum(values, out=prefix[1:])
+            self._prefix[name] = prefix
+        return prefix
+
+    def sum(self, name, start=None, end=None, inclusive="left"):
+        """Sum of a column between ``start`` and ``end``, in constant time."""
+        lo, hi = self.bounds(start, end, inclusive)
+        prefix = self._prefix_sums(name)
+        return prefix[hi] - prefix[lo]
+
+    def pyramid(self, *columns):
+        """Downsampling pyramid of ``columns`` over the whole series, built once."""
+        pyramid = self._pyramids.get(columns)
+        if pyramid is None:
+            pyramid = Pyramid(self._dates, [self._frame[name].to_numpy() for name in columns])
+            self._pyramids[columns] = pyramid
+        return pyramid
+
+    def downsample(self, *columns, max_points=MAX_POINTS, keep=()):
+        """The rows to draw ``columns`` with at most about ``max_points`` points.
+
+        The peaks and troughs of each column are kept, see ``downsample.py``;
+        so are the rows at the dates ``keep``.
+        """
+        keep = np.searchsorted(self._dates[self._lo:self._hi], [to_datetime64(date) for date in keep]) + self._lo
+        rows = self.pyramid(*columns).select(self._lo, self._hi, max_points, keep)
+        return self._frame.iloc[rows]
+
+
+def as_time_series(data, date_column="date", by=None):
+    """``data`` itself if already a ``TimeSeries``, else a series over it."""
+    if isinstance(data, TimeSeries):
+        return data
+    return TimeSeries(data, date_column, by)
@@ -1,17 +1,104 @@
-import streamlit as st
+"""Data loading and preparation shared by the pages and the pipeline.
+
+The figures are built in ``views/``, one module per page, so that importing
+this module only costs pandas and NumPy.
+"""
 import pandas as pd
-import altair as alt
 import numpy as np
-import matplotlib.pyplot as plt
-import seaborn as sns
-from datetime import datetime
-import plotly.express as px
-import plotly.graph_objects as go
-from plotly.subplots import make_subplots
-import geopandas as gpd
-
-def load_data(filename):
-    data = pd.read_csv(filename, sep=';')
+from cube import load_cube
+from datastore import SURSAUD, ensure_store, read_sursaud
+from registry import datasets
+from segment import locate, read_frame
+from dimensions import DEPARTMENTS_PATH, canonical_department
+from instrument import instrumented
+from timeseries import TimeSeries
+
+EPIDEMIC_STATE_PATH = 'preprocessed_data/epidemic_state.csv'
+SATURATION_PATH = 'preprocessed_data/covid19-saturation-dep.csv'
+
+
+def _read_epidemic_state(path):
+    df = pd.read_csv(path)
+    df['date'] = pd.to_datetime(df['date'])
+    return df
+
+def _read_epidemic_series(path, source=None):
+    # ``path`` is the shared segment when it holds ``source`` (see segment.py)
+    df = read_frame(path, source) if source else _read_epidemic_state(path)
+    # Weekly positivity and incidence, charted on the Overview page
+    df['Tp7'] = (df['P7'] / df['T7']).round(2)
+    df['Ti7'] = df['P7'] / df['pop'] * 100000
+    return TimeSeries(df)
+
+def _read_saturation_frame(path):
+    # Published in the order of the series, which then does not reorder (copy) the mapped rows
+    return _read_saturation_series(path).frame
+
+def _read_saturation_series(path, source=None):
+    df = read_frame(path, source) if source else pd.read_csv(path, dtype={"dep": str})
+    return TimeSeries(df, "date", by="Libellé")
+
+# The datasets published in the shared segment, with their readers
+SHARED_DATASETS = {
+    EPIDEMIC_STATE_PATH: _read_epidemic_state,
+    SATURATION_PATH: _read_saturation_frame,
+}
+
+def _read_store(path, name, columns, deps):
+    return read_sursaud(name, columns=list(columns) if columns else None, deps=deps, path=path)
+
+# All the loaders below go through the process-wide registry: the files are
+# only parsed again when they change on disk.
+@instrumented("load")
+def load_epidemic_series():
+    path, source = locate(EPIDEMIC_STATE_PATH)
+    return datasets.get(path, _read_epidemic_series, source)
+
+@instrumented("load")
+def load_epidemic_state():
+    return load_epidemic_series().frame
+
+@instrumented("load")
+def load_saturation_series():
+    path, source = locate(SATURATION_PATH)
+    return datasets.get(path, _read_saturation_series, source)
+
+@instrumented("load")
+def load_saturation():
+    return load_saturation_series().frame
+
+@instrumented("load")
+def load_sursaud(name=SURSAUD, columns=None, deps=None):
+    columns = tuple(columns) if columns is not None else None
+    deps = tuple(canonical_department(dep) for dep in deps) if deps is not None else None
+    return datasets.get(ensure_store(name), _read_store, name, columns, deps)
+
+@instrumented("compute")
+def department_series(dep=None):
+    """Daily SurSaUD Covid visits of a department (of France when ``dep`` is None).
+
+    ``nbre_pass_corona`` is averaged over 7 days and ``prop_covid`` is the
+    share of Covid visits among all the visits of the day.
+    """
+    dep_df = load_cube(SURSAUD).frame(['nbre_pass_corona', 'nbre_pass_tot'], dep=dep)
+    dep_df['prop_covid'] = dep_df['nbre_pass_corona'] / dep_df['nbre_pass_tot']
+    dep_df['nbre_pass_corona'] = rolling_mean(dep_df, ['nbre_pass_corona'], order='date_de_passage')['nbre_pass_corona']
+    return dep_df
+
+def weekly_indicators(series, today):
+    """Cases and positive rate (%) of the week up to ``today``, and the change (%) of cases from the week before."""
+    week = pd.Timedelta(days=7)
+    cases = series.sum("P", today - week, today, inclusive="right")
+    tests = series.sum("T", today - week, today, inclusive="right")
+    previous_cases = series.sum("P", today - 2 * week, today - week, inclusive="neither")
+    return {
+        "cases": cases,
+        "positive_rate": cases / tests * 100,
+        "evolution": (cases - previous_cases) / cases * 100,
+    }
+
+@instrumented("compute")
+def clean_sp_dep_jour(data):
     for name in ['Ti','Td','Tp']:
         data[name] = data[name].str.replace(',', '.')
         data[name] = data[name].astype(float)
@@ -19,444 +106,155 @@ def load_data(filename):
     df = df.fillna(0)
     df['date'] = pd.to_datetime(data['jour'])
     df.drop(['dep','jour','cl_age90'], axis=1, inplace=True)
-    df = df.groupby('date').agg({'P':'sum', 'T':'sum','Ti':'mean', 'Tp':'mean','Td':'mean', 'pop':'sum'}).reset_index()
-    df['P7'] = df['P'].rolling(window=7).mean()
-    df['T7'] = df['T'].rolling(window=7).mean()
+    return df
 
+@instrumented("compute")
+def aggregate_epidemic_state(df):
+    return df.groupby('date').agg({'P':'sum', 'T':'sum','Ti':'mean', 'Tp':'mean','Td':'mean', 'pop':'sum'}).reset_index()
+
+def rolling_mean_blocks(values, block_starts, window=7, min_periods=None):
+    """Moving average over the rows of ``values``, restarting at every block.
+
+    ``values`` is a (rows,) or (rows, columns) array made of contiguous blocks
+    (one per department, age class...) each sorted by date, and
+    ``block_starts`` the row where each block begins. All blocks are handled
+    in one vectorized pass. Like ``Series.rolling``, missing values are
+    ignored and rows with fewer than ``min_periods`` (default ``window``)
+    values in their window are NaN.
+    """
+    values = np.asarray(values, dtype=float)
+    n = len(values)
+    min_periods = max(window if min_periods is None else min_periods, 1)
+
+    padded = np.concatenate([np.full((window - 1,) + values.shape[1:], np.nan), values])
+    block_start = np.repeat(block_starts, np.diff(np.append(block_starts, n)))
+    rows = np.arange(n)
+    total = np.zeros(values.shape)
+    count = np.zeros(values.shape, dtype=int)
+    # One contiguous pass per position in the window, skipping the positions
+    # that fall before the start of the row's block
+    for offset in range(window):
+        shifted = padded[offset:offset + n]
+        in_block = rows - (window - 1) + offset >= block_start
+        valid = ~np.isnan(shifted) & (in_block[:, None] if values.ndim == 2 else in_block)
+        total += np.where(valid, shifted, 0)
+        count += valid
+
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return np.where(count >= min_periods, total / count, np.nan)
+
+@instrumented("compute")
+def rolling_mean(df, columns, by=None, order=None, window=7, min_periods=None):
+    """Moving averages of ``columns`` computed separately for each ``by`` group.
+
+    Rows are put in (``by``, ``order``) order so that each group is a
+    contiguous block, then the result is returned aligned with ``df``.
+    """
+    keys = [key for key in [by, order] if key is not None]
+    positions = np.arange(len(df))
+    if keys:
+        positions = np.lexsort([pd.factorize(df[key], sort=True)[0] for key in reversed(keys)])
+    block_starts = np.array([0])
+    if by is not None and len(df):
+        groups = df[by].values[positions]
+        block_starts = np.flatnonzero(np.r_[True, groups[1:] != groups[:-1]])
+
+    means = np.empty((len(df), len(columns)))
+    means[positions] = rolling_mean_blocks(df[columns].to_numpy(dtype=float)[positions], block_starts, window, min_periods)
+    return pd.DataFrame(means, index=df.index, columns=columns)
+
+def append_rolling_mean(history, new, columns, by=None, order=None, window=7, min_periods=None):
+    """Moving averages of the rows of ``new`` only, appended after ``history``.
+
+    Only the last ``window - 1`` rows of each group of ``history`` are used,
+    so the cost does not depend on the length of the history.
+    """
+    context = history.groupby(by).tail(window - 1) if by is not None else history.tail(window - 1)
+    keys = [key for key in [by, order] if key is not None]
+    combined = pd.concat([context[keys + columns], new[keys + columns]], ignore_index=True)
+    means = rolling_mean(combined, columns, by, order, window, min_periods)
+    return means.iloc[len(context):].set_axis(new.index)
+
+def add_weekly_averages(df):
+    df[['P7', 'T7']] = rolling_mean(df, ['P', 'T'], order='date').values
     return df
 
-def plot_positive_cases(df, start_date, end_date):
-    df_filtered = df[(df['date'] > start_date) & (df['date'] < end_date)]
-    fig = px.bar(df_filtered, x='date', y='P')
-    fig.data[0].marker.color = '#eed5dc'
-    line_trace = go.Scatter(x=df_filtered['date'], y=df_filtered['P7'], mode='lines', line=dict(color='#c8738b'), showlegend=False, hoverinfo = 'none')
-    fig.update_layout(legend=dict(orientation="h", yanchor="top", y=1.1),
-                      plot_bgcolor='white',
-                      yaxis=dict(showgrid=True, gridwidth=1, gridcolor='lightgrey'),
-                      hovermode="x unified")
-    # Update hovertemplate for each trace
-    fig.update_traces(
-    hovertemplate='%{x}<br> <b>%{y:.2s}</b> <extra></extra>'  # Customize tooltip content
-    )
-    fig.add_trace(line_trace)
-
-    fig.update_yaxes(title_text='')
-    fig.update_xaxes(title_text='')
-    return fig
-
-def plot_positive_cases_with_zoom(df, start_date, end_date):
-    fig = px.bar(df, x='date', y='P')
-    fig.data[0].marker.color = '#eed5dc'
-    line_trace = go.Scatter(x=df['date'], y=df['P7'], mode='lines', name='Moving average over the last 7 days', line=dict(color='#c8738b'), hoverinfo = 'none')
-    fig.update_traces(
-    hovertemplate='%{x}<br> <b>%{y:.2s}</b> <extra></extra>'  # Customize tooltip content
-    )
-
-    fig.update_layout(legend=dict(orientation="h", yanchor="top", y=1.1),
-                      yaxis=dict(showgrid=True, gridwidth=1, gridcolor='lightgrey'),
-                      plot_bgcolor='white',
-                      hovermode="x unified")
-    fig.update_yaxes(title_text='')
-    fig.update_xaxes(title_text='')
-    fig.add_trace(line_trace)
-    fig.add_vrect(x0=str(start_date), x1=str(end_date),
-                  annotation_text="Zoom Area", annotation_position="top left",
-                  fillcolor="grey", opacity=0.1, line_width=1,
-                  annotation_font=dict(size=15, color='grey'))
-    fig.add_vline(x=str(start_date), line_width=1, line_dash="dash", line_color="grey")
-    fig.add_vline(x=str(end_date), line_width=1, line_dash="dash", line_color="grey")
-    return fig
-
-def plot_tested(df):
-    fig = px.line(df, x='date', y='T7')
-    fig.update_layout(legend=dict(orientation="h", yanchor="top", y=1.1),
-                      xaxis=dict(title_text=''),
-                      plot_bgcolor='white',
-                      yaxis=dict(showgrid=True, gridwidth=1, gridcolor='lightgrey', title_text=''),
-                      hovermode="x unified")
-    fig.data[0].fill = 'tozeroy'
-    fig.data[0].fillcolor = '#d5e5f5'
-    fig.update_traces(marker=dict(size=10), line=dict(color='#4c7aaf'))
-    fig.update_traces(
-    marker=dict(size=10),
-    line=dict(color='#4c7aaf'),
-    hovertemplate=' <b>%{y:.2s}</b><extra></extra>'
-    )
-    return fig
-
-def plot_positive_rate(df):
-    df['Tp7'] = df['P7']/df['T7']
-    df['Tp7'] = df['Tp7'].round(2)
-    fig = px.line(df, x='date', y='Tp7')
-    fig.update_layout(legend=dict(orientation="h", yanchor="top", y=1.1),
-                      xaxis=dict(title_text=''),
-                      plot_bgcolor='white',
-                      yaxis=dict(
-                          showgrid=True,
-                          gridwidth=1,
-                          gridcolor='lightgrey',
-                          title_text='',
-                          tickformat=".0%",
-                      ),
-                      hovermode="x unified")
-    fig.data[0].fill = 'tozeroy'
-    fig.data[0].fillcolor = '#d5bad5'
-    fig.update_traces(marker=dict(size=10), line=dict(color='#886688'))
-    fig.update_traces(
-    marker=dict(size=10),
-    line=dict(color='#886688'),
-    hovertemplate='<b>%{y} </b><extra></extra>'
-    )
-    return fig
-
-def plot_incidence_rate(df):
-    df['Ti7'] = df['P7']/df['pop']*100000
-    fig = px.line(df, x='date', y='Ti7')
-    fig.update_layout(legend=dict(orientation="h", yanchor="top", y=1.1),
-                      xaxis=dict(title_text=''),
-                      plot_bgcolor='white',
-                      yaxis=dict(showgrid=True, gridwidth=1, gridcolor='lightgrey', title_text=''),
-                      hovermode="x unified")
-    fig.data[0].fill = 'tozeroy'
-    fig.data[0].fillcolor = '#eaeaea'
-    fig.update_traces(marker=dict(size=10), line=dict(color='#7f7f7f'))
-    fig.update_traces(
-    marker=dict(size=10),
-    line=dict(color='#7f7f7f'),
-    hovertemplate='<b>%{y:.0f}‰ </b><extra></extra>'
-    )
-    return fig
-
-def prop_covid(date, dep_df):
-    # Filter the DataFrame for the given date and date-1
-    date_df = dep_df[dep_df['date_de_passage'] == date]
-
-    previous_date_df = dep_df[dep_df['date_de_passage'] == date - pd.DateOffset(days=1)]
-
-    value_at_date = date_df['prop_covid'].values[0] if not date_df.empty else 0
-    try : 
-        value_at_date_before = previous_date_df['prop_covid'].values[0] if not previous_date_df.empty else 0
-    except:
-        value_at_date_before = 0
-    return value_at_date, value_at_date_before
-
-def unique_departments():
-    weekly_df = pd.read_csv("raw_data/sursaud-covid19-departement.csv", sep = ";")
-    weekly_df["dep"] = weekly_df["dep"].apply(lambda x: int(x) if isinstance(x, str) and x.isdigit() else x)
-    return weekly_df['dep'].unique()
-
-def plot_timeserie_with_animation(dep):
-    dep = int(dep) if isinstance(dep, str) and dep.isdigit() else dep
-    dep = None if dep == "France" else dep
-    weekly_df = pd.read_csv("raw_data/sursaud-covid19-departement.csv", sep = ";")
-    weekly_df["date_de_passage"] = pd.to_datetime(weekly_df["date_de_passage"])
-    weekly_df["dep"] = weekly_df["dep"].apply(lambda x: int(x) if isinstance(x, str) and x.isdigit() else x)
-
-    if dep is not None:
-        # Filter data based on department and dates
-        weekly_df = weekly_df[weekly_df['dep'] == dep]
-        dep_df = weekly_df[['date_de_passage', 'nbre_pass_corona',"nbre_pass_tot"]].groupby('date_de_passage').sum().reset_index()
-        dep_df['prop_covid'] = dep_df['nbre_pass_corona'] / dep_df['nbre_pass_tot']
-        #make a moving average on nbre_pass_corona
-        dep_df['nbre_pass_corona'] = dep_df['nbre_pass_corona'].rolling(window=7).mean()
-
-    else:
-        #group by date and sum the values
-        dep_df = weekly_df[['date_de_passage', 'nbre_pass_corona',"nbre_pass_tot"]].groupby('date_de_passage').sum().reset_index()
-        dep_df['prop_covid'] = dep_df['nbre_pass_corona'] / dep_df['nbre_pass_tot']
-        #make a moving average on nbre_pass_corona
-        dep_df['nbre_pass_corona'] = dep_df['nbre_pass_corona'].rolling(window=7).mean()
-
-    wave1_end_date = '2020-09-14'
-
-    wave2_end_date = '2020-11-02'
-        
-    wave3_end_date = '2021-02-01'
-    
-    max_val = dep_df['nbre_pass_corona'].max()
-    dates = sorted(dep_df['date_de_passage'].unique())
-    
-    # Create a subplot with 2 rows and 1 column
-    fig = make_subplots(rows=2, cols=3, 
-                        specs=[[{"type": "scatter", "colspan": 3}, None, None],
-                               [{"type": "indicator"}, {"type": "indicator"}, {"type": "indicator"}]],
-                        vertical_spacing=0.2, column_widths=[0.3, 0.4, 0.3])
-    
-
-    fig.add_trace(go.Scatter(x=dep_df['date_de_passage'], y=dep_df['nbre_pass_corona'],
-                                mode='lines+markers', name=f"Cases for department {dep}", line=dict(color='#c8738b')),
-                    row=1, col=1)
-    
-
-    wave1_end_date = pd.to_datetime('2020-09-14').timestamp() * 1000
-    wave2_end_date = pd.to_datetime('2020-11-02').timestamp() * 1000
-    wave3_end_date = pd.to_datetime('2021-02-01').timestamp() * 1000
-
-    fig.update_layout(xaxis_type='date')
-
-    # Now use these datetime objects in your add_vline calls
-    fig.add_vline(x=wave1_end_date, line_dash="dash", line_color="green", row=1, col=1)
-    fig.add_vline(x=wave1_end_date, line_dash="dash", line_color="green", row=1, col=1, 
-                annotation_text="End of wave 1", annotation_position="top left")
-    fig.add_vline(x=wave2_end_date, line_dash="dash", line_color="green", row=1, col=1, 
-                annotation_text="End of wave 2", annotation_position="top left")
-    fig.add_vline(x=wave3_end_date, line_dash="dash", line_color="green", row=1, col=1, 
-                annotation_text="End of wave 3", annotation_position="top left")
-    
-    
-    #add waves legend 
-   
-    gauge={
-            'axis': {'range': [None, 0.3], 'tickwidth': 1, 'tickcolor': "darkblue"},
-            'bar': {'color': "#c8738b"},
-            'steps': [
-                {'range': [0, 0.06], 'color': 'lightgray'},
-                {'range': [0.06, 0.12], 'color': 'gray'},
-                {'range': [0.12, 0.18], 'color': 'darkgray'},
-                {'range': [0.18, 0.24], 'color': 'gray'},
-                {'range': [0.24, 3], 'color': 'lightgray'}
-            ],
-            'threshold': {
-                'line': {'color': "red", 'width': 4},
-                'thickness': 0.75,
-                'value': 0.25
-            }
-        }
-
-    # Add a placeholder trace for the proportion over max value, to be updated in frames
-    fig.add_trace(go.Indicator(mode="number+gauge", value=dep_df['prop_covid'][0], delta={'reference': 1, 'relative': True},
-                               title={"text": "<span style='font-size:0.8em'>Proportion of covid cases out of all healthcare visits</span>"},gauge=gauge),
-                  row=2, col=2)
-    
-
-    # Add frames for each date with the red dashed line and update the indicator
-    frames = []
-    for date in dates:
-        prop_at_date, prop_at_date_before = prop_covid(date, dep_df)
-
-        # Update the indicators for each frame
-        frame_data = [
-            go.Scatter(
-                x=dep_df['date_de_passage'],
-                y=dep_df['nbre_pass_corona'],
-                mode='lines+markers'
-            ),
-            go.Indicator(
-                mode="number+gauge+delta",
-                value=prop_at_date ,
-                delta={'reference': prop_at_date_before, 'relative': True}
-            ),
-            ]
-
-        # Add shapes to indicate the current date with a vertical line
-        frame_layout = go.Layout(shapes=[dict(
-            type="line",
-            x0=date,
-            y0=0,
-            x1=date,
-            y1=max_val,
-            line=dict(color="Red", width=2, dash="dash")
-        )])
-    
-        frames.append(go.Frame(
-            data=frame_data,
-            layout=frame_layout,
-            name=str(date)
-        ))
-
-    fig.frames = frames
-
-    
-    # Set up the slider and play button
-    fig.update_layout(
-        updatemenus=[{
-            "type": "buttons",
-            "showactive": False,
-            "buttons": [{
-                "label": "Play",
-                "method": "animate",
-                "args": [None, {"frame": {"duration": 500, "redraw": True}, "fromcurrent": True}]
-            }]
-        }],
-        sliders=[{
-            "steps": [{"method": "animate", "args": [[str(date)], {"frame": {"duration": 500, "redraw": True}, "mode": "immediate"}], "label": str(date)} for date in dates]
-        }]
-    )
-    if dep is None:
-        fig.update_layout(title="Covid cases for all departments",
-                        xaxis_title="Date", yaxis_title="Covid cases", height=800)
-    else:
-        fig.update_layout(title=f"Covid cases for department {dep}",
-                        xaxis_title="Date", yaxis_title="Covid cases", height=800)
-
-    return fig
-
-
-def map_cov(dep_to_highlight=None, wave = 1):
-    dep_to_highlight = None if dep_to_highlight == "France" else dep_to_highlight
-
-    if wave == 1 :
-        weekly_df = pd.read_csv("preprocessed_data/weekly_covid_cases_by_department_wave_1.csv")
-    
-    if wave == 2 :
-        weekly_df = pd.read_csv("preprocessed_data/weekly_covid_cases_by_department_wave_2.csv")
-    
-    if wave == 3 :
-        weekly_df = pd.read_csv("preprocessed_data/weekly_covid_cases_by_department_wave_3.csv")
-
-    weekly_df["date_de_passage"] = pd.to_datetime(weekly_df["date_de_passage"])
-    max_cumulative_value = weekly_df['cumulative_nbre_pass_corona'].max()
-    
-    dep_names = pd.read_csv("raw_data/departements-region.csv")
-    dep_names["num_dep"] = dep_names["num_dep"].apply(lambda x: str(int(x)) if isinstance(x, str) and x.isdigit() else x)
-    dep_names = dep_names[["num_dep","dep_name"]]
-    weekly_df = pd.merge(weekly_df, dep_names, how='left', left_on='dep', right_on='num_dep')
-
-    geo_df = gpd.read_file('raw_data/departements.geojson')
-    # Convert 'code' column to int except for '2A' and '2B'
-    geo_df["code"] = geo_df["code"].apply(lambda x: int(x) if x.isdigit() else x)
-    
-    if dep_to_highlight == None:
-       
-        fig = px.choropleth_mapbox(weekly_df, geojson=geo_df, locations='dep',
-                                featureidkey="properties.code",
-                                color='cumulative_nbre_pass_corona',
-                                hover_name='dep_name',
-                                center={"lat": 46.2276, "lon": 2.2137},
-                                mapbox_style="carto-positron", zoom=3.5,
-                                animation_frame='date_de_passage',
-                                color_continuous_scale='PuRd',
-                                range_color=[0, max_cumulative_value])
-        fig.update_layout(title_text=f'Covid cases in France by department during the wave {wave}')
-
-    if dep_to_highlight is not None:
-        dep_to_highlight = int(dep_to_highlight)
-        #long lat of the center of highlighted department
-        center_lat = geo_df[geo_df['code'] == dep_to_highlight].geometry.centroid.y.values[0]
-        center_lon = geo_df[geo_df['code'] == dep_to_highlight].geometry.centroid.x.values[0] 
-        
-        weekly_df =  weekly_df[weekly_df['dep'] == str(dep_to_highlight)]
-        fig = px.choropleth_mapbox(weekly_df, geojson=geo_df, locations='dep',
-                                featureidkey="properties.code",
-                                hover_name='dep_name',
-                                color='cumulative_nbre_pass_corona',
-                                center={"lat": center_lat, "lon": center_lon},
-                                mapbox_style="carto-positron", zoom=7,
-                                animation_frame='date_de_passage',
-                                color_continuous_scale='PuRd',
-                                range_color=[0, max_cumulative_value])
-        # add department name to the map
-        dep_name = geo_df[geo_df['code'] == dep_to_highlight].nom.values[0]
-        fig.update_layout(title_text=f'Covid cases in {dep_name} during the wave {wave}')
-    
-    return fig
-
-
-def get_date_first_peak(data: pd.DataFrame, column: str):
-    # Filter data to keep only the period of interest
-    data = data[(data["date"]<"2020-10-01") & (data["date"]>"2020-03-01")]
-    max_value = data[column].max()
-    if pd.isna(max_value):
-        return None, None
-    return data[data[column] == max_value]["date"].values[0], max_value
-
-
-def plot_saturation(data: pd.DataFrame, department: str):
-    # Filter data to keep only department of interest
-    if department == "France":
-        department = "France entière"
-    data = data[data["Libellé"] == department]
-    data = data[(data["date"]>"2020-03-01")]
-
-    # Create the plot
-    fig = go.Figure()
-    fig.add_trace(go.Scatter(x=data["date"], y=data["Share of SOS med calls for Covid"], mode='lines', name='Share of SOS medecin calls for Covid'))
-    fig.add_trace(go.Scatter(x=data["date"], y=data["Share of hospital emergency visits for Covid"], mode='lines', name='Share of all emergency visits for Covid'))
-    fig.add_trace(go.Scatter(x=data["date"], y=data["Share of all critical care beds occupied by Covid patients"], mode='lines', name='Share of all critical care beds occupied by Covid patients'))
-    fig.add_shape(type="line", x0=data["date"].min(), y0=100, x1=data["date"].max(), y1=100, line=dict(color="red", width=1, dash="dash"))
-    fig.add_annotation(x=data["date"].max(), y=100, text="Saturation", showarrow=False, yshift=10, xshift=30)
-    
-    # Plot dash lines to indicate the date of the first peak for each indicator
-    max_dates = [get_date_first_peak(data, column) for column in ["Share of SOS med calls for Covid","Share of hospital emergency visits for Covid", "Share of all critical care beds occupied by Covid patients"]]
-    max_dates = [date for date in max_dates if date[0] is not None]
-    for index, (x0, max_value) in enumerate(max_dates):
-        fig.add_shape(type="line", x0=x0, y0=0, x1=x0, y1=max_value, line=dict(color="black", width=1, dash="dash"))
-        fig.add_annotation(x=x0, y=max_value, text=f"({index+1})", showarrow=False, yshift=10)
-    
-    # Update layout
-    fig.update_layout(title='Saturation of health system during Covid-19 in France',
-                        xaxis_title='Date',
-                        yaxis_title='Percentage',
-                        showlegend=True,
-                        plot_bgcolor='white',  
-                        paper_bgcolor='white', 
-                        font=dict(color='black'),
-                        xaxis=dict(showgrid=False), 
-                        yaxis=dict(showgrid=False)
-                    )
-    return fig
-
-
-def plot_age_group_px(df, date_start, date_end):
-    # Create a working dataframe
-    df_evol_ages = df.groupby(['date_de_passage', 'sursaud_cl_age_corona']).agg({
-        "nbre_hospit_corona": 'sum',
-        "nbre_hospit_corona_h": 'sum',
-        "nbre_hospit_corona_f": 'sum'
-    }).reset_index()
-
-    # Map the age group codes to their corresponding labels
-    age_group_labels = {
-        "0": '7. All ages',
-        "A": '5. Less than 15 years old',
-        "B": '4. 15-44 years old',
-        "C": '3. 45-64 years old',
-        "D": '2. 65-74 years old',
-        "E": '1. 75 years old and more',
-    }
-    df_evol_ages['sursaud_cl_age_corona'] = df_evol_ages["sursaud_cl_age_corona"].apply(lambda x: age_group_labels[x])
-
-    # Calculate rolling average and normalize counts
-    df_evol_ages['nbre_hospit_corona_weekly_avg'] = df_evol_ages.groupby('sursaud_cl_age_corona')['nbre_hospit_corona'].transform(lambda x: x.rolling(7).mean())
-    df_evol_ages['nbre_hospit_corona_normalized'] = df_evol_ages.groupby('date_de_passage')['nbre_hospit_corona_weekly_avg'].transform(lambda x: 2 * 100 * (x / x.sum()))
-
-    # Filter out the 'All ages' category
-    df_chart = df_evol_ages[df_evol_ages["sursaud_cl_age_corona"] != "7. All ages"]
-
-    # Set desired order for age groups
-    desired_order = ['1. 75 years old and more', '2. 65-74 years old', '3. 45-64 years old', '4. 15-44 years old', '5. Less than 15 years old']
-
-    # Create the line chart for hospitalizations over time
-    chart_evol = px.area(df_chart, x='date_de_passage', y='nbre_hospit_corona_weekly_avg',
-                          color='sursaud_cl_age_corona', category_orders={"sursaud_cl_age_corona": desired_order},
-                          labels={'date_de_passage': 'Date', 'nbre_hospit_corona_weekly_avg': 'Count'},
-                          width=800, height=300)
-    # Add a transparent box cover the graph from date_start to date_end. Fill it in lightgrey with opacity 0.5
-    chart_evol.add_vrect(x0=date_start, x1=date_end, fillcolor='rgba(100,100,100,0.1)', line_width=0, )
-
-    # Update the layout to display legend above the chart
-    chart_evol.update_layout(legend=dict(
-        orientation="h",  # Set legend orientation to horizontal
-        yanchor="top",  # Anchor legend to the top
-        y=10,  # Adjust the distance of the legend from the top
-        xanchor="center",  # Anchor legend to the center horizontally
-        x=0.5  # Position legend at the center horizontally
-    ))
-
-    return chart_evol, df_chart
-
-def plot_age_group_share(df_chart, date_start, date_end):
-
-    # Create the line chart for normalized hospitalizations over time
-    # Filter the data to only include the relevant dates
-    desired_order = ['1. 75 years old and more', '2. 65-74 years old', '3. 45-64 years old', '4. 15-44 years old', '5. Less than 15 years old']
-    df_chart = df_chart[(df_chart["date_de_passage"] >= date_start) & (df_chart["date_de_passage"] < date_end)]
-    chart_prop = px.area(df_chart, x='date_de_passage', y='nbre_hospit_corona_normalized',
-                          color='sursaud_cl_age_corona', category_orders={"sursaud_cl_age_corona": desired_order},
-                          labels={'date_de_passage': 'Date', 'nbre_hospit_corona_normalized': ''},
-                            width=100, height=300
-                          )
-    
-    chart_prop.layout.update(showlegend=False)
-
-    return chart_prop
\ No newline at end of file
+def _kahan_add(sums, compensation, labels, values):
+    """Add ``values`` to ``sums[labels]`` in row order, with Kahan compensation.
+
+    This is the summation pandas uses for groupby means: carrying the
+    compensation from one chunk to the next gives bit-identical means. Each
+    pass handles the k-th row of every label at once.
+    """
+    occurrence = pd.Series(labels).groupby(labels).cumcount().values
+    order = np.argsort(occurrence, kind='stable')
+    bounds = np.searchsorted(occurrence[order], np.arange(occurrence.max() + 2))
+    for start, end in zip(bounds[:-1], bounds[1:]):
+        rows = order[start:end]
+        lab = labels[rows]
+        y = values[rows] - compensation[lab]
+        t = sums[lab] + y
+        compensation[lab] = t - sums[lab] - y
+        compensation[lab] = np.where(np.isnan(compensation[lab]), 0, compensation[lab])
+        sums[lab] = t
+
+def aggregate_sp_dep_jour_chunks(chunks):
+    """Fold chunks of a sp-dep-jour drop into the per-date aggregates of ``aggregate_epidemic_state``.
+
+    Only per-date running sums, compensations and row counts are kept between
+    chunks, so memory does not depend on the size of the drop. ``Ti``/``Tp``/``Td``
+    are summed over all rows and divided by the row count at the end, which
+    weights every chunk by its number of rows.
+    """
+    dates = {}
+    totals = {name: np.zeros(0, dtype='int64') for name in ['P', 'T', 'pop']}
+    means = {name: (np.zeros(0), np.zeros(0)) for name in ['Ti', 'Tp', 'Td']}
+    rows = np.zeros(0, dtype='int64')
+    for chunk in chunks:
+        chunk = chunk.fillna(0)
+        for date in chunk['jour'].unique():
+            dates.setdefault(date, len(dates))
+        labels = chunk['jour'].map(dates).values
+        size = len(dates)
+
+        rows = np.pad(rows, (0, size - len(rows)))
+        rows += np.bincount(labels, minlength=size)
+        for name in totals:
+            values = chunk[name].values
+            dtype = np.result_type(totals[name], values)
+            totals[name] = np.pad(totals[name].astype(dtype), (0, size - len(totals[name])))
+            np.add.at(totals[name], labels, values)
+        for name, (sums, compensation) in means.items():
+            sums, compensation = np.pad(sums, (0, size - len(sums))), np.pad(compensation, (0, size - len(compensation)))
+            _kahan_add(sums, compensation, labels, chunk[name].values.astype(float))
+            means[name] = (sums, compensation)
+
+    df = pd.DataFrame({'date': pd.to_datetime(list(dates))})
+    df['P'], df['T'] = totals['P'], totals['T']
+    for name, (sums, _) in means.items():
+        df[name] = sums / rows
+    df['pop'] = totals['pop']
+    return df.sort_values('date', ignore_index=True)
+
+SP_DEP_JOUR_CHUNKSIZE = 200_000
+
+def read_sp_dep_jour_chunks(filename, chunksize=SP_DEP_JOUR_CHUNKSIZE):
+    # The parser reads the decimal commas of Ti/Tp/Td itself, rounding like float()
+    return pd.read_csv(filename, sep=';', decimal=',', usecols=['jour', 'P', 'T', 'Ti', 'Tp', 'Td', 'pop'],
+                       float_precision='round_trip', chunksize=chunksize)
+
+@instrumented("load")
+def load_data(filename, chunksize=None):
+    """Daily national aggregates of a sp-dep-jour drop.
+
+    With ``chunksize``, the drop is streamed ``chunksize`` rows at a time
+    instead of being loaded at once; the result is the same.
+    """
+    if chunksize is not None:
+        df = aggregate_sp_dep_jour_chunks(read_sp_dep_jour_chunks(filename, chunksize))
+        return add_weekly_averages(df)
+
+    data = pd.read_csv(filename, sep=';')
+    df = clean_sp_dep_jour(data)
+    df = aggregate_epidemic_state(df)
+    return add_weekly_averages(df)
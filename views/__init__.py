@@ -0,0 +1,5 @@
+"""Figure builders, one module per dashboard page.
+
+``streamlitapp.py`` imports a module only when its page is shown, so a page
+never pays for the plotting and geometry dependencies of the others.
+"""
@@ -0,0 +1,70 @@
+"""Figures of the age groups page.
+
+The figures are drawn from the precomputed ``AgeShares`` of France or of a
+department (``ageshares.py``), over the whole period, and cached
+(``figcache.py``): the date range slider only lays its window over them
+(``figcache.relayout``).
+"""
+import plotly.express as px
+
+from ageshares import load_age_shares
+from cube import cube_meta_path
+from datastore import SURSAUD_2020, raw_path
+from figcache import cached_figure, relayout
+from instrument import instrumented
+
+# Set desired order for age groups
+DESIRED_ORDER = ['1. 75 years old and more', '2. 65-74 years old', '3. 45-64 years old', '4. 15-44 years old', '5. Less than 15 years old']
+
+
+@instrumented("figure")
+@cached_figure(raw_path(SURSAUD_2020), cube_meta_path(SURSAUD_2020))
+def plot_age_group_history(dep="France"):
+    """Weekly hospitalizations by age group over the whole period."""
+    df_chart = load_age_shares(dep).frame()
+
+    # Create the line chart for hospitalizations over time
+    chart_evol = px.area(df_chart, x='date_de_passage', y='nbre_hospit_corona_weekly_avg',
+                          color='sursaud_cl_age_corona', category_orders={"sursaud_cl_age_corona": DESIRED_ORDER},
+                          labels={'date_de_passage': 'Date', 'nbre_hospit_corona_weekly_avg': 'Count'},
+                          width=800, height=300)
+
+    # Update the layout to display legend above the chart
+    chart_evol.update_layout(legend=dict(
+        orientation="h",  # Set legend orientation to horizontal
+        yanchor="top",  # Anchor legend to the top
+        y=10,  # Adjust the distance of the legend from the top
+        xanchor="center",  # Anchor legend to the center horizontally
+        x=0.5  # Position legend at the center horizontally
+    ))
+
+    return chart_evol
+
+@instrumented("figure")
+def plot_age_group_px(dep, date_start, date_end):
+    # Add a transparent box cover the graph from date_start to date_end (the shape of add_vrect),
+    # laid over the cached history
+    return relayout(plot_age_group_history(dep), {
+        "shapes": [dict(type="rect", xref="x", yref="y domain", x0=str(date_start), x1=str(date_end), y0=0, y1=1,
+                        fillcolor='rgba(100,100,100,0.1)', line=dict(width=0))],
+    })
+
+@instrumented("figure")
+@cached_figure(raw_path(SURSAUD_2020), cube_meta_path(SURSAUD_2020))
+def plot_age_group_share_history(dep="France"):
+    """Share of each age group in the weekly hospitalizations over the whole period."""
+    df_chart = load_age_shares(dep).frame()
+    chart_prop = px.area(df_chart, x='date_de_passage', y='nbre_hospit_corona_normalized',
+                          color='sursaud_cl_age_corona', category_orders={"sursaud_cl_age_corona": DESIRED_ORDER},
+                          labels={'date_de_passage': 'Date', 'nbre_hospit_corona_normalized': ''},
+                            width=100, height=300
+                          )
+
+    chart_prop.layout.update(showlegend=False)
+
+    return chart_prop
+
+@instrumented("figure")
+def plot_age_group_share(dep, date_start, date_end):
+    # Zoom the cached shares on the selected period
+    return relayout(plot_age_group_share_history(dep), {"xaxis": {"range": [str(date_start), str(date_end)]}})
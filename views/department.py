@@ -0,0 +1,191 @@
+"""Figures of the department page: the wave map and the animated time series."""
+import pandas as pd
+import plotly.express as px
+import plotly.graph_objects as go
+from plotly.subplots import make_subplots
+
+from cube import cube_meta_path, load_cube
+from datastore import SURSAUD, raw_path
+from dimensions import DEPARTMENTS_PATH, WAVES, canonical_department, load_departments
+from figcache import cached_figure
+from geometry import INDEX_PATH, LEVELS, department_feature, level_for_zoom, level_path, load_geometry, load_geometry_index
+from instrument import instrumented
+from timeseries import TimeSeries
+from utils import department_series
+
+
+def prop_covid_with_previous_day(dep_df):
+    """Gauge value at each date and at the previous calendar day (0 when missing), in one pass."""
+    prop = pd.Series(dep_df['prop_covid'].values, index=pd.DatetimeIndex(dep_df['date_de_passage']))
+    previous = prop.reindex(prop.index - pd.Timedelta(days=1), fill_value=0)
+    return prop.values, previous.values
+
+def indicator_frames(dep_df, max_val, frame_step=1):
+    """Animation frames that only update the gauge (trace 1) and the date cursor.
+
+    The scatter series is never repeated in the frames, so the figure grows
+    linearly with the number of dates. ``frame_step`` keeps one frame every
+    ``frame_step`` dates (e.g. 7 for weekly frames over long ranges).
+    """
+    values, previous_values = prop_covid_with_previous_day(dep_df)
+    dates = pd.DatetimeIndex(dep_df['date_de_passage'])
+    # Plain dicts: the figure validates them once when they are assigned to it
+    frames = []
+    for date, value, previous_value in zip(dates[::frame_step], values[::frame_step], previous_values[::frame_step]):
+        frames.append(dict(
+            data=[dict(type="indicator", mode="number+gauge+delta", value=value,
+                       delta={'reference': previous_value, 'relative': True})],
+            traces=[1],
+            # Add shapes to indicate the current date with a vertical line
+            layout=dict(shapes=[dict(type="line", x0=date, y0=0, x1=date, y1=max_val,
+                                     line=dict(color="Red", width=2, dash="dash"))]),
+            name=str(date)
+        ))
+    return frames
+
+@instrumented("compute")
+def unique_departments():
+    """Canonical codes of the departments with SurSaUD data."""
+    cube = load_cube(SURSAUD)
+    return cube.deps[cube.present.any(axis=1)]
+
+@instrumented("figure")
+@cached_figure(raw_path(SURSAUD), cube_meta_path(SURSAUD))
+def plot_timeserie_with_animation(dep, frame_step=1):
+    dep = None if dep == "France" else canonical_department(dep)
+
+    # Daily sums over all the rows of the department (or of France), read from the cube
+    dep_df = department_series(dep)
+
+    max_val = dep_df['nbre_pass_corona'].max()
+    
+    # Create a subplot with 2 rows and 1 column
+    fig = make_subplots(rows=2, cols=3, 
+                        specs=[[{"type": "scatter", "colspan": 3}, None, None],
+                               [{"type": "indicator"}, {"type": "indicator"}, {"type": "indicator"}]],
+                        vertical_spacing=0.2, column_widths=[0.3, 0.4, 0.3])
+    
+
+    # The markers are only drawn for the rows kept at the resolution the range allows
+    points = TimeSeries(dep_df, 'date_de_passage').downsample('nbre_pass_corona')
+    fig.add_trace(go.Scatter(x=points['date_de_passage'], y=points['nbre_pass_corona'],
+                                mode='lines+markers', name=f"Cases for department {dep}", line=dict(color='#c8738b')),
+                    row=1, col=1)
+    
+
+    fig.update_layout(xaxis_type='date')
+
+    for wave, (_, end) in WAVES.items():
+        fig.add_vline(x=pd.to_datetime(end).timestamp() * 1000, line_dash="dash", line_color="green", row=1, col=1,
+                      annotation_text=f"End of wave {wave}", annotation_position="top left")
+    
+    
+    #add waves legend 
+   
+    gauge={
+            'axis': {'range': [None, 0.3], 'tickwidth': 1, 'tickcolor': "darkblue"},
+            'bar': {'color': "#c8738b"},
+            'steps': [
+                {'range': [0, 0.06], 'color': 'lightgray'},
+                {'range': [0.06, 0.12], 'color': 'gray'},
+                {'range': [0.12, 0.18], 'color': 'darkgray'},
+                {'range': [0.18, 0.24], 'color': 'gray'},
+                {'range': [0.24, 3], 'color': 'lightgray'}
+            ],
+            'threshold': {
+                'line': {'color': "red", 'width': 4},
+                'thickness': 0.75,
+                'value': 0.25
+            }
+        }
+
+    # Add a placeholder trace for the proportion over max value, to be updated in frames
+    fig.add_trace(go.Indicator(mode="number+gauge", value=dep_df['prop_covid'][0], delta={'reference': 1, 'relative': True},
+                               title={"text": "<span style='font-size:0.8em'>Proportion of covid cases out of all healthcare visits</span>"},gauge=gauge),
+                  row=2, col=2)
+    
+
+    # Add frames for each date with the red dashed line and update the indicator
+    fig.frames = indicator_frames(dep_df, max_val, frame_step)
+
+    
+    # Set up the slider and play button
+    fig.update_layout(
+        updatemenus=[{
+            "type": "buttons",
+            "showactive": False,
+            "buttons": [{
+                "label": "Play",
+                "method": "animate",
+                "args": [None, {"frame": {"duration": 500, "redraw": True}, "fromcurrent": True}]
+            }]
+        }],
+        sliders=[{
+            "steps": [{"method": "animate", "args": [[frame.name], {"frame": {"duration": 500, "redraw": True}, "mode": "immediate"}], "label": frame.name} for frame in fig.frames]
+        }]
+    )
+    if dep is None:
+        fig.update_layout(title="Covid cases for all departments",
+                        xaxis_title="Date", yaxis_title="Covid cases", height=800)
+    else:
+        fig.update_layout(title=f"Covid cases for department {dep}",
+                        xaxis_title="Date", yaxis_title="Covid cases", height=800)
+
+    return fig
+
+
+@instrumented("figure")
+@cached_figure(raw_path(SURSAUD), cube_meta_path(SURSAUD), DEPARTMENTS_PATH, INDEX_PATH,
+               [level_path(level) for level in LEVELS])
+def map_cov(dep_to_highlight=None, wave = 1, start=None, end=None):
+    """Weekly cumulative Covid visits by department, during ``wave`` or between ``start`` and ``end``."""
+    dep_to_highlight = None if dep_to_highlight == "France" else dep_to_highlight
+    if start is None and end is None:
+        start, end = WAVES[wave]
+        period = f"during the wave {wave}"
+    else:
+        period = " ".join(part for part in [start and f"from {start}", end and f"until {end}"] if part)
+
+    # Computed from the cube for all departments at once
+    weekly_df = load_cube(SURSAUD).weekly_cumulative('nbre_pass_corona', start, end)
+    max_cumulative_value = weekly_df['cumulative_nbre_pass_corona'].max()
+    
+    # Names looked up by department id; the canonical codes are the geometry ids
+    weekly_df['dep_name'] = load_departments()['name'].to_numpy()[weekly_df['dep'].cat.codes]
+    weekly_df['code'] = weekly_df['dep']
+
+    geo_index = load_geometry_index()
+    code = None if dep_to_highlight is None else canonical_department(dep_to_highlight)
+
+    # The overseas departments (DROM) have no outline in the geometry: France is shown instead
+    if code not in geo_index:
+        center = {"lat": 46.2276, "lon": 2.2137}
+        zoom = 3.5
+        geojson = load_geometry(level_for_zoom(zoom, center["lat"]))
+        title = f'Covid cases in France by department {period}'
+
+    else:
+        #long lat of the center of highlighted department
+        center_lon, center_lat = geo_index[code]['centroid']
+        center = {"lat": center_lat, "lon": center_lon}
+        zoom = 7
+        # Only the highlighted department is drawn, at a finer level of detail
+        geojson = department_feature(code, level_for_zoom(zoom, center_lat))
+        weekly_df = weekly_df[weekly_df['code'] == code]
+        # add department name to the map
+        title = f'Covid cases in {geo_index[code]["name"]} {period}'
+
+    fig = px.choropleth_mapbox(weekly_df, locations='code',
+                            hover_name='dep_name',
+                            color='cumulative_nbre_pass_corona',
+                            center=center,
+                            mapbox_style="carto-positron", zoom=zoom,
+                            animation_frame='date_de_passage',
+                            color_continuous_scale='PuRd',
+                            range_color=[0, max_cumulative_value])
+    # The polygons are only sent once, with the initial trace: animation frames
+    # are merged into it by plotly.js and only need to carry the values.
+    fig.update_traces(geojson=geojson, featureidkey="properties.code")
+    fig.update_layout(title_text=title)
+
+    return fig
@@ -0,0 +1,157 @@
+"""Figures of the Overview page: national cases, tests, positivity and incidence.
+
+The builders read the epidemic series (``utils.load_epidemic_series``)
+themselves, so that their cached figures are keyed by its version. Their
+lines only go through the rows ``TimeSeries.downsample`` keeps for the width
+of their window; the daily bars are all drawn, one per day.
+
+The figures are cached (``figcache.py``); the two that follow the window
+slider are cached figures too, of the whole series, over which the window
+is only laid out (``figcache.relayout``).
+"""
+import numpy as np
+import plotly.express as px
+import plotly.graph_objects as go
+
+from figcache import cached_figure, relayout
+from instrument import instrumented
+from utils import EPIDEMIC_STATE_PATH, load_epidemic_series
+
+
+@instrumented("figure")
+@cached_figure(EPIDEMIC_STATE_PATH)
+def plot_daily_positive_cases():
+    """Daily cases and their 7-day average over the whole series."""
+    # Every day is drawn: the chart shows a window of it, which the browser can pan and zoom on its own
+    df_filtered = load_epidemic_series().frame
+    fig = px.bar(df_filtered, x='date', y='P')
+    fig.data[0].marker.color = '#eed5dc'
+    line_trace = go.Scatter(x=df_filtered['date'], y=df_filtered['P7'], mode='lines', line=dict(color='#c8738b'), showlegend=False, hoverinfo = 'none')
+    fig.update_layout(legend=dict(orientation="h", yanchor="top", y=1.1),
+                      plot_bgcolor='white',
+                      yaxis=dict(showgrid=True, gridwidth=1, gridcolor='lightgrey'),
+                      hovermode="x unified")
+    # Update hovertemplate for each trace
+    fig.update_traces(
+    hovertemplate='%{x}<br> <b>%{y:.2s}</b> <extra></extra>'  # Customize tooltip content
+    )
+    fig.add_trace(line_trace)
+
+    fig.update_yaxes(title_text='')
+    fig.update_xaxes(title_text='')
+    return fig
+
+@instrumented("figure")
+def plot_positive_cases(start_date, end_date):
+    window = load_epidemic_series().window(start_date, end_date, inclusive="neither")
+    top = max(np.nanmax(window.column('P'), initial=0), np.nanmax(window.column('P7'), initial=0))
+    return relayout(plot_daily_positive_cases(), {
+        "xaxis": {"range": [str(start_date), str(end_date)]},
+        "yaxis": {"range": [0, float(top) * 1.05]},
+    })
+
+@instrumented("figure")
+@cached_figure(EPIDEMIC_STATE_PATH)
+def plot_positive_cases_history():
+    series = load_epidemic_series()
+    # Every day keeps its bar; only the 7-day average line is downsampled
+    df = series.frame
+    line = series.downsample('P7')
+    fig = px.bar(df, x='date', y='P')
+    fig.data[0].marker.color = '#eed5dc'
+    line_trace = go.Scatter(x=line['date'], y=line['P7'], mode='lines', name='Moving average over the last 7 days', line=dict(color='#c8738b'), hoverinfo = 'none')
+    fig.update_traces(
+    hovertemplate='%{x}<br> <b>%{y:.2s}</b> <extra></extra>'  # Customize tooltip content
+    )
+
+    fig.update_layout(legend=dict(orientation="h", yanchor="top", y=1.1),
+                      yaxis=dict(showgrid=True, gridwidth=1, gridcolor='lightgrey'),
+                      plot_bgcolor='white',
+                      hovermode="x unified")
+    fig.update_yaxes(title_text='')
+    fig.update_xaxes(title_text='')
+    fig.add_trace(line_trace)
+    return fig
+
+@instrumented("figure")
+def plot_positive_cases_with_zoom(start_date, end_date):
+    # Only the zoom area moves with the window: its shapes (those of add_vrect and add_vline)
+    # are laid over the cached history
+    start_date, end_date = str(start_date), str(end_date)
+    edge = dict(type="line", xref="x", yref="y domain", y0=0, y1=1, line=dict(color="grey", dash="dash", width=1))
+    return relayout(plot_positive_cases_history(), {
+        "shapes": [
+            dict(type="rect", xref="x", yref="y domain", x0=start_date, x1=end_date, y0=0, y1=1,
+                 fillcolor="grey", opacity=0.1, line=dict(width=1)),
+            dict(edge, x0=start_date, x1=start_date),
+            dict(edge, x0=end_date, x1=end_date),
+        ],
+        "annotations": [dict(text="Zoom Area", x=start_date, xref="x", xanchor="left", y=1, yref="y domain",
+                             yanchor="top", showarrow=False, font=dict(size=15, color="grey"))],
+    })
+
+@instrumented("figure")
+@cached_figure(EPIDEMIC_STATE_PATH)
+def plot_tested():
+    df = load_epidemic_series().downsample('T7')
+    fig = px.line(df, x='date', y='T7')
+    fig.update_layout(legend=dict(orientation="h", yanchor="top", y=1.1),
+                      xaxis=dict(title_text=''),
+                      plot_bgcolor='white',
+                      yaxis=dict(showgrid=True, gridwidth=1, gridcolor='lightgrey', title_text=''),
+                      hovermode="x unified")
+    fig.data[0].fill = 'tozeroy'
+    fig.data[0].fillcolor = '#d5e5f5'
+    fig.update_traces(marker=dict(size=10), line=dict(color='#4c7aaf'))
+    fig.update_traces(
+    marker=dict(size=10),
+    line=dict(color='#4c7aaf'),
+    hovertemplate=' <b>%{y:.2s}</b><extra></extra>'
+    )
+    return fig
+
+@instrumented("figure")
+@cached_figure(EPIDEMIC_STATE_PATH)
+def plot_positive_rate():
+    df = load_epidemic_series().downsample('Tp7')
+    fig = px.line(df, x='date', y='Tp7')
+    fig.update_layout(legend=dict(orientation="h", yanchor="top", y=1.1),
+                      xaxis=dict(title_text=''),
+                      plot_bgcolor='white',
+                      yaxis=dict(
+                          showgrid=True,
+                          gridwidth=1,
+                          gridcolor='lightgrey',
+                          title_text='',
+                          tickformat=".0%",
+                      ),
+                      hovermode="x unified")
+    fig.data[0].fill = 'tozeroy'
+    fig.data[0].fillcolor = '#d5bad5'
+    fig.update_traces(marker=dict(size=10), line=dict(color='#886688'))
+    fig.update_traces(
+    marker=dict(size=10),
+    line=dict(color='#886688'),
+    hovertemplate='<b>%{y} </b><extra></extra>'
+    )
+    return fig
+
+@instrumented("figure")
+@cached_figure(EPIDEMIC_STATE_PATH)
+def plot_incidence_rate():
+    df = load_epidemic_series().downsample('Ti7')
+    fig = px.line(df, x='date', y='Ti7')
+    fig.update_layout(legend=dict(orientation="h", yanchor="top", y=1.1),
+                      xaxis=dict(title_text=''),
+                      plot_bgcolor='white',
+                      yaxis=dict(showgrid=True, gridwidth=1, gridcolor='lightgrey', title_text=''),
+                      hovermode="x unified")
+    fig.data[0].fill = 'tozeroy'
+    fig.data[0].fillcolor = '#eaeaea'
+    fig.update_traces(marker=dict(size=10), line=dict(color='#7f7f7f'))
+    fig.update_traces(
+    marker=dict(size=10),
+    line=dict(color='#7f7f7f'),
+    hovertemplate='<b>%{y:.0f}‰ </b><extra></extra>'
+    )
+    return fig
@@ -0,0 +1,59 @@
+"""Figure of the health system saturation page."""
+import numpy as np
+import pandas as pd
+import plotly.graph_objects as go
+
+from figcache import cached_figure
+from instrument import instrumented
+from timeseries import TimeSeries, as_time_series
+from utils import SATURATION_PATH, load_saturation_series
+
+
+def get_date_first_peak(data: TimeSeries, column: str):
+    # Filter data to keep only the period of interest
+    data = as_time_series(data).window("2020-03-01", "2020-10-01", inclusive="neither")
+    values = data.column(column)
+    if np.isnan(values).all():
+        return None, None
+    peak = np.nanargmax(values)
+    return pd.Timestamp(data.dates[peak]), values[peak]
+
+
+@instrumented("figure")
+@cached_figure(SATURATION_PATH)
+def plot_saturation(department: str):
+    # Filter data to keep only department of interest
+    if department == "France":
+        department = "France entière"
+    series = load_saturation_series().group(department).window("2020-03-01", inclusive="neither")
+    columns = ["Share of SOS med calls for Covid", "Share of hospital emergency visits for Covid", "Share of all critical care beds occupied by Covid patients"]
+    max_dates = [get_date_first_peak(series, column) for column in columns]
+    max_dates = [date for date in max_dates if date[0] is not None]
+    # The first peaks stay points of the downsampled lines
+    data = series.downsample(*columns, keep=[date for date, _ in max_dates])
+
+    # Create the plot
+    fig = go.Figure()
+    fig.add_trace(go.Scatter(x=data["date"], y=data["Share of SOS med calls for Covid"], mode='lines', name='Share of SOS medecin calls for Covid'))
+    fig.add_trace(go.Scatter(x=data["date"], y=data["Share of hospital emergency visits for Covid"], mode='lines', name='Share of all emergency visits for Covid'))
+    fig.add_trace(go.Scatter(x=data["date"], y=data["Share of all critical care beds occupied by Covid patients"], mode='lines', name='Share of all critical care beds occupied by Covid patients'))
+    fig.add_shape(type="line", x0=data["date"].min(), y0=100, x1=data["date"].max(), y1=100, line=dict(color="red", width=1, dash="dash"))
+    fig.add_annotation(x=data["date"].max(), y=100, text="Saturation", showarrow=False, yshift=10, xshift=30)
+    
+    # Plot dash lines to indicate the date of the first peak for each indicator
+    for index, (x0, max_value) in enumerate(max_dates):
+        fig.add_shape(type="line", x0=x0, y0=0, x1=x0, y1=max_value, line=dict(color="black", width=1, dash="dash"))
+        fig.add_annotation(x=x0, y=max_value, text=f"({index+1})", showarrow=False, yshift=10)
+    
+    # Update layout
+    fig.update_layout(title='Saturation of health system during Covid-19 in France',
+                        xaxis_title='Date',
+                        yaxis_title='Percentage',
+                        showlegend=True,
+                        plot_bgcolor='white',  
+                        paper_bgcolor='white', 
+                        font=dict(color='black'),
+                        xaxis=dict(showgrid=False), 
+                        yaxis=dict(showgrid=False)
+                    )
+    return fig